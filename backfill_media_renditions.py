@@ -0,0 +1,58 @@
+"""
+Migration script to create display renditions for images stored without them.
+
+Renditions (IMAGE_RENDITION_SIZES, by default 64, 200, 800 and 1600 px on the long
+edge, in IMAGE_RENDITION_FORMAT) are otherwise made the first time an image is
+requested with ?size=; running this beforehand means lightbox and map views never
+wait for one. Images are resized on the INGEST_CPU_WORKERS process pool, and the
+script commits in batches, so it can be stopped and re-run safely.
+
+Usage:
+    python backfill_media_renditions.py [--batch-size N]
+"""
+
+import argparse
+
+from src.database import Database
+from src.config import get_config
+from src.database.storage import backfill_media_renditions
+
+
+def migrate(batch_size: int = None):
+    """Create renditions for stored images that have none."""
+    config = get_config()
+    image_processing = config.image_processing
+    batch_size = batch_size or image_processing.batch_size
+    sizes = ", ".join(str(size) for size in image_processing.rendition_sizes)
+    print(f"Starting migration: Creating {image_processing.rendition_format} renditions ({sizes} px)...")
+
+    db = Database(config)
+
+    try:
+        db.create_tables()
+
+        def progress(stats):
+            print(f"  images: {stats['blobs_processed']}, skipped: {stats['blobs_skipped']}, "
+                  f"written: {stats['bytes_written'] / (1024 * 1024):.1f} MB")
+
+        stats = backfill_media_renditions(db, batch_size=batch_size, progress_callback=progress)
+        print("✓ Migration completed successfully")
+        print(f"  - Images with renditions: {stats['blobs_processed']}")
+        print(f"  - Renditions created: {stats['renditions_created']}")
+        print(f"  - Images skipped (animated or undecodable): {stats['blobs_skipped']}")
+        print(f"  - Rendition size: {stats['bytes_written'] / (1024 * 1024):.1f} MB")
+    except Exception as e:
+        print(f"✗ Migration failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create display renditions for stored images")
+    parser.add_argument("--batch-size", type=int, help="Images per transaction (defaults to IMAGE_PROCESSING_BATCH_SIZE)")
+    args = parser.parse_args()
+    success = migrate(args.batch_size)
+    exit(0 if success else 1)
@@ -0,0 +1,55 @@
+"""
+Migration script to deduplicate media blobs by content hash.
+
+Backfills media_blob.content_hash (SHA-256 of image_data, or the blob store key for
+content already moved to the filesystem) for blobs stored before content-addressed
+deduplication, and merges blobs with identical content so that
+each distinct file is stored once. Media items are repointed to the surviving blob.
+
+The content_hash column and its unique index are added automatically when the
+application starts (Database.create_tables), and this script does the same before
+running. It commits in batches and can be re-run safely.
+
+Usage:
+    python dedupe_media_blobs.py [batch_size]
+"""
+
+import sys
+
+from src.database import Database
+from src.config import get_config
+from src.database.storage import deduplicate_media_blobs
+
+
+def migrate(batch_size: int = 500):
+    """Hash existing media blobs and merge duplicates."""
+    print("Starting migration: Deduplicating media blobs by content hash...")
+    
+    config = get_config()
+    db = Database(config)
+    
+    try:
+        db.create_tables()
+        
+        def progress(stats):
+            print(f"  hashed: {stats['blobs_hashed']}, merged: {stats['blobs_merged']}, "
+                  f"freed: {stats['bytes_freed'] / (1024 * 1024):.1f} MB")
+        
+        stats = deduplicate_media_blobs(db, batch_size=batch_size, progress_callback=progress)
+        print("✓ Migration completed successfully")
+        print(f"  - Blobs hashed: {stats['blobs_hashed']}")
+        print(f"  - Duplicate blobs merged: {stats['blobs_merged']}")
+        print(f"  - Space freed: {stats['bytes_freed'] / (1024 * 1024):.1f} MB")
+    except Exception as e:
+        print(f"✗ Migration failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+    
+    return True
+
+
+if __name__ == "__main__":
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    success = migrate(batch_size)
+    exit(0 if success else 1)
@@ -0,0 +1,73 @@
+"""
+Migration script to move media, attachment and reference document content out of
+the database into the filesystem blob store.
+
+Copies media_blob.image_data, attachments.data and reference_documents.data into
+the content-addressed store at BLOB_STORE_PATH, using several writer threads, and
+replaces the bytea value in each row with its key. Media blobs whose content
+another blob already holds are merged into that blob, as dedupe_media_blobs.py
+does. Set BLOB_STORE_BACKEND=filesystem so that new content is written to the
+store as well. The script commits in batches and can be stopped and re-run safely.
+
+With --gc, files that no row refers to any more (left by deleted rows or an
+interrupted run) are removed afterwards. Only use --gc while no import is running.
+
+Usage:
+    python migrate_blobs_to_store.py [--batch-size N] [--workers N] [--gc]
+"""
+
+import argparse
+
+from src.database import Database
+from src.config import get_config
+from src.database.blobstore import FilesystemBlobStore
+from src.database.storage import move_blobs_to_store, delete_unreferenced_blob_files
+
+
+def migrate(batch_size: int = 100, workers: int = 8, gc: bool = False):
+    """Move bytea content into the filesystem blob store."""
+    config = get_config()
+    print(f"Starting migration: Moving blob content to {config.blob_store.path}...")
+    if config.blob_store.backend != "filesystem":
+        print("⚠ Warning: BLOB_STORE_BACKEND is not 'filesystem'; new content will still be stored in the database")
+    
+    db = Database(config)
+    blob_store = FilesystemBlobStore(config.blob_store.path)
+    
+    try:
+        db.create_tables()
+        
+        def progress(stats):
+            print(f"  moved: {stats['rows_moved']} rows, "
+                  f"{stats['bytes_moved'] / (1024 * 1024):.1f} MB, errors: {stats['errors']}")
+        
+        stats = move_blobs_to_store(db, blob_store, batch_size=batch_size, workers=workers, progress_callback=progress)
+        print("✓ Migration completed successfully")
+        print(f"  - Rows moved: {stats['rows_moved']}")
+        print(f"  - Duplicate media blobs merged: {stats['blobs_merged']}")
+        print(f"  - Data moved: {stats['bytes_moved'] / (1024 * 1024):.1f} MB")
+        print(f"  - Errors: {stats['errors']}")
+        
+        if gc:
+            deleted = delete_unreferenced_blob_files(db, blob_store)
+            print(f"  - Unreferenced files deleted: {deleted}")
+        
+        if stats["rows_moved"]:
+            print("  Run VACUUM FULL (or pg_repack) on media_blob, attachments and reference_documents to return the space to the OS")
+    except Exception as e:
+        print(f"✗ Migration failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+    
+    return stats["errors"] == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move blob content from the database to the filesystem blob store")
+    parser.add_argument("--batch-size", type=int, default=100, help="Rows per transaction")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent file writers")
+    parser.add_argument("--gc", action="store_true", help="Delete files no row refers to after moving")
+    args = parser.parse_args()
+    success = migrate(args.batch_size, args.workers, args.gc)
+    exit(0 if success else 1)
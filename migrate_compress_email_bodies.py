@@ -0,0 +1,83 @@
+"""
+Migration script to compress the bodies of emails stored uncompressed.
+
+Trains an HTML dictionary on a sample of stored bodies (unless one exists for the
+codec, or --retrain is given), then rewrites each uncompressed email with its HTML
+and plain text compressed into raw_message_compressed / plain_text_compressed. Set
+EMAIL_BODY_COMPRESSION to the same codec so that new emails are compressed as well.
+The script commits in batches and can be stopped and re-run safely.
+
+Usage:
+    python migrate_compress_email_bodies.py [--codec zlib|zstd] [--batch-size N] [--sample-size N] [--retrain]
+"""
+
+import argparse
+
+from src.database import Database
+from src.config import get_config
+from src.database.bodycodec import get_current_dictionary
+from src.database.storage import compress_email_bodies, train_email_body_dictionary
+
+
+def migrate(codec: str = None, batch_size: int = 500, sample_size: int = 2000, retrain: bool = False):
+    """Compress uncompressed email bodies."""
+    config = get_config()
+    codec = codec or config.email_bodies.compression
+    if codec not in ("zlib", "zstd"):
+        print("✗ No codec given; pass --codec or set EMAIL_BODY_COMPRESSION to 'zlib' or 'zstd'")
+        return False
+    print(f"Starting migration: Compressing email bodies with {codec}...")
+    if config.email_bodies.compression != codec:
+        print(f"⚠ Warning: EMAIL_BODY_COMPRESSION is not '{codec}'; new emails will not be stored compressed with it")
+
+    db = Database(config)
+
+    try:
+        db.create_tables()
+
+        session = db.get_session()
+        try:
+            dictionary_id, _ = get_current_dictionary(session, codec)
+        finally:
+            session.close()
+        if dictionary_id is None or retrain:
+            dictionary_id = train_email_body_dictionary(db, codec, sample_size)
+            if dictionary_id is None:
+                print("  No uncompressed HTML bodies to train a dictionary on")
+            else:
+                print(f"  Trained HTML dictionary {dictionary_id}")
+        else:
+            print(f"  Using existing HTML dictionary {dictionary_id}")
+
+        def progress(stats):
+            print(f"  compressed: {stats['rows_compressed']} rows, "
+                  f"{stats['bytes_before'] / (1024 * 1024):.1f} MB -> {stats['bytes_after'] / (1024 * 1024):.1f} MB")
+
+        stats = compress_email_bodies(db, codec, config.email_bodies.level, batch_size=batch_size, progress_callback=progress)
+        print("✓ Migration completed successfully")
+        print(f"  - Rows compressed: {stats['rows_compressed']}")
+        if stats["bytes_after"]:
+            print(f"  - Body size: {stats['bytes_before'] / (1024 * 1024):.1f} MB -> "
+                  f"{stats['bytes_after'] / (1024 * 1024):.1f} MB "
+                  f"({stats['bytes_before'] / stats['bytes_after']:.1f}x)")
+
+        if stats["rows_compressed"]:
+            print("  Run VACUUM FULL (or pg_repack) on emails to return the space to the OS")
+    except Exception as e:
+        print(f"✗ Migration failed: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress the bodies of emails stored uncompressed")
+    parser.add_argument("--codec", choices=["zlib", "zstd"], help="Codec (defaults to EMAIL_BODY_COMPRESSION)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per transaction")
+    parser.add_argument("--sample-size", type=int, default=2000, help="HTML bodies to train the dictionary on")
+    parser.add_argument("--retrain", action="store_true", help="Train a new dictionary even if one exists")
+    args = parser.parse_args()
+    success = migrate(args.codec, args.batch_size, args.sample_size, args.retrain)
+    exit(0 if success else 1)
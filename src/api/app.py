@@ -5,17 +5,20 @@ import threading
 import json
 import re
 import asyncio
+import anyio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from io import BytesIO
 from fastapi import FastAPI, HTTPException, Response, BackgroundTasks, Query, Request, UploadFile, File, Form, Body
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
 from datetime import datetime
-from sqlalchemy import or_, func, and_, extract, Integer, text
-from sqlalchemy.orm import joinedload
+from sqlalchemy import or_, func, and_, extract, text, select
+from sqlalchemy.orm import joinedload, undefer
 from PIL import Image
 
 from src.services.process_images_service import ProcessImagesService
@@ -28,9 +31,12 @@ try:
 except ImportError:
     HEIF_SUPPORT = False
 
-from ..database import Database,  Email, IMessage, FacebookAlbum, ReferenceDocument
-from ..database.models import MediaMetadata, MediaBlob, MessageAttachment, Attachment, AlbumMedia, Locations, Relationship, Contacts
-from ..database.storage import EmailStorage, ImageStorage
+from ..database import Database, get_database, get_async_database, get_engine_stats, Email, IMessage, FacebookAlbum, ReferenceDocument
+from ..database.models import EmailLabel, MediaMetadata, MediaBlob, MessageAttachment, Attachment, AlbumMedia, Locations, Relationship, Contacts
+from ..database.storage import EmailStorage, ImageStorage, delete_unreferenced_media_blobs, get_media_blob_content, media_blob_size_expression
+from ..database.blobstore import blob_file_path, read_blob
+from ..database.conversioncache import get_conversion_cache
+from ..database.bodycodec import email_html_body, email_text_body
 from ..services import ImageService, EmailService, ReferenceDocumentService, MessageService, ImportService
 from ..services.gemini_service import ChatService, GeminiService
 from ..services.chat_conversation_service import ChatConversationService
@@ -47,6 +53,7 @@ from ..services.dto import (
 )
 from ..loader import EmailDatabaseLoader
 from ..config import get_config
+from ..emailimport import import_mbox_file
 from ..messageimport.imessageimport import import_imessages_from_directory
 from ..messageimport.whatsappimport import import_whatsapp_from_directory
 from ..messageimport.facebookimport import import_facebook_from_directory
@@ -68,8 +75,22 @@ app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
 # Initialize Jinja2 templates
 templates = Jinja2Templates(directory=str(Path(__file__).parent / "templates"))
 
-# Initialize database connection
-db = Database(get_config())
+# Initialize database connections. Read endpoints that run on the event loop use
+# async_db; sync endpoints and background jobs use db from FastAPI's threadpool
+db = get_database()
+async_db = get_async_database()
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    """Bound the worker threads that run sync endpoints and other blocking work.
+    
+    Sync endpoints run in anyio's default thread limiter; sizing it from
+    API_THREADPOOL_SIZE keeps a burst of slow requests from starving the rest
+    while leaving the event loop free for async endpoints and SSE streams.
+    """
+    anyio.to_thread.current_default_thread_limiter().total_tokens = get_config().api.threadpool_size
+
 
 # The Gemini Chat Service (global instance for maintaining conversation history)
 chat_service = ChatService()
@@ -247,6 +268,9 @@ filesystem_import_progress: Dict[str, Any] = {
     "total_files": 0,
     "images_imported": 0,
     "images_updated": 0,
+    "files_unchanged": 0,
+    "files_moved": 0,
+    "files_deleted": 0,
     "errors": 0,
     "error_messages": []
 }
@@ -289,6 +313,25 @@ magick_processing_progress: Dict[str, Any] = {
     "errors": 0,
     "error_messages": [],
     "current_image": None,
+    "images_per_second": 0.0,
+    "status": "idle",  # idle, in_progress, completed, cancelled, error
+    "error_message": None
+}
+
+# HEIC conversion cache warm-up state management
+conversion_cache_warm_lock = threading.Lock()
+conversion_cache_warm_cancelled = threading.Event()
+conversion_cache_warm_in_progress = False
+
+# Progress state for the conversion cache warm-up
+conversion_cache_warm_progress: Dict[str, Any] = {
+    "images_found": 0,
+    "images_cached": 0,
+    "images_skipped": 0,
+    "errors": 0,
+    "bytes_written": 0,
+    "images_per_second": 0.0,
+    "stopped_at_budget": False,
     "status": "idle",  # idle, in_progress, completed, cancelled, error
     "error_message": None
 }
@@ -731,6 +774,12 @@ class ProcessLabelResponse(BaseModel):
     timestamp: datetime
 
 
+class ImportMboxRequest(BaseModel):
+    """Request model for importing emails from an mbox file."""
+    file_path: str
+    default_label: str = "MBOX"
+
+
 class MessageResponse(BaseModel):
     """Generic message response."""
     message: str
@@ -915,6 +964,12 @@ class LabelResponse(BaseModel):
     label_list_visibility: Optional[str] = None
 
 
+class StoredLabelResponse(BaseModel):
+    """Response model for a label carried by stored emails."""
+    name: str
+    email_count: int
+
+
 class AttachmentInfoResponse(BaseModel):
     """Response model for attachment with email metadata."""
     attachment_id: int
@@ -1003,8 +1058,103 @@ def process_single_label_background(label: str, new_only: bool, result_dict: dic
             result_dict["success"] = False
 
 
+def _mark_processing_cancelled(result_dict: dict, results_lock: threading.Lock):
+    """Record that processing was cancelled, broadcasting the event once."""
+    with results_lock:
+        result_dict["error"] = "Processing was cancelled by user"
+        result_dict["success"] = False
+        if get_progress_state()["status"] == "cancelled":
+            return
+        update_progress_state(status="cancelled", error_message="Processing was cancelled by user")
+    broadcast_progress_event_sync("cancelled", get_progress_state())
+
+
+def _process_label_background(
+    label: str,
+    idx: int,
+    new_only: bool,
+    result_dict: dict,
+    results_lock: threading.Lock,
+    loader_factory: Callable[[], EmailDatabaseLoader]
+) -> bool:
+    """Process one label for process_emails_background.
+    
+    Args:
+        loader_factory: Returns the loader to use; concurrently processed labels each
+                        need their own, as a Gmail client is not thread-safe
+    
+    Returns:
+        False if processing was cancelled before the label was loaded, True otherwise
+    """
+    # Check for cancellation before processing each label
+    if processing_cancelled.is_set():
+        print(f"[Background Task] Processing cancelled by user")
+        _mark_processing_cancelled(result_dict, results_lock)
+        return False
+    
+    try:
+        print(f"[Background Task] Starting processing for label: {label}")
+        
+        # Update progress state - starting new label
+        update_progress_state(
+            current_label=label,
+            current_label_index=idx
+        )
+        broadcast_progress_event_sync("progress", get_progress_state())
+        
+        loader_instance = loader_factory()
+        
+        # Check for cancellation before loading emails
+        if processing_cancelled.is_set():
+            print(f"[Background Task] Processing cancelled before loading emails for {label}")
+            _mark_processing_cancelled(result_dict, results_lock)
+            return False
+        
+        count = loader_instance.load_emails(label, new_only=new_only)
+        
+        with results_lock:
+            result_dict["count"] += count
+            result_dict["success"] = True  # Set to True if at least one succeeds
+            
+            # Update progress state - label completed
+            current_state = get_progress_state()
+            update_progress_state(emails_processed=current_state["emails_processed"] + count)
+        broadcast_progress_event_sync("progress", get_progress_state())
+        
+        print(f"[Background Task] Completed processing for label: {label}, processed {count} emails")
+    except Exception as e:
+        with results_lock:
+            error_msg = result_dict.get("error", "")
+            if error_msg:
+                error_msg += " "
+            error_msg += f"Error processing {label}: {str(e)}; "
+            result_dict["error"] = error_msg
+            result_dict["success"] = False
+            
+            # Update progress state - error occurred
+            update_progress_state(
+                status="error",
+                error_message=error_msg
+            )
+        broadcast_progress_event_sync("error", get_progress_state())
+        
+        print(f"[Background Task] Error processing {label}: {str(e)}")
+    return True
+
+
+def _new_loader() -> EmailDatabaseLoader:
+    """Create an email loader with its own Gmail client."""
+    loader_instance = EmailDatabaseLoader()
+    loader_instance.init_client()
+    return loader_instance
+
+
 def process_emails_background(labels: List[str], new_only: bool, result_dict: dict):
-    """Background task coordinator that processes labels sequentially."""
+    """Background task coordinator that processes labels.
+    
+    Labels are processed one at a time, or INGEST_CONCURRENT_LABELS at a time when
+    that is configured above 1.
+    """
     global processing_in_progress
     
     # Filter out TRASH and SPAM folders
@@ -1034,66 +1184,32 @@ def process_emails_background(labels: List[str], new_only: bool, result_dict: di
         result_dict["count"] = 0
         result_dict["success"] = False
         result_dict["error"] = ""
+        results_lock = threading.Lock()
+        
+        concurrent_labels = min(get_config().ingest.concurrent_labels, len(filtered_labels))
+        if concurrent_labels > 1:
+            with ThreadPoolExecutor(max_workers=concurrent_labels, thread_name_prefix="label") as executor:
+                futures = [
+                    executor.submit(
+                        _process_label_background, label, idx, new_only, result_dict, results_lock, _new_loader
+                    )
+                    for idx, label in enumerate(filtered_labels, start=1)
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            # Process labels sequentially, one at a time
+            for idx, label in enumerate(filtered_labels, start=1):
+                if not _process_label_background(label, idx, new_only, result_dict, results_lock, get_loader):
+                    break
         
-        # Process labels sequentially, one at a time
-        for idx, label in enumerate(filtered_labels, start=1):
-            # Check for cancellation before processing each label
-            if processing_cancelled.is_set():
-                print(f"[Background Task] Processing cancelled by user")
-                result_dict["error"] = "Processing was cancelled by user"
-                result_dict["success"] = False
-                update_progress_state(status="cancelled", error_message="Processing was cancelled by user")
-                broadcast_progress_event_sync("cancelled", get_progress_state())
-                break
-            
+        # Attachment bodies left out by lazy downloads are fetched once the emails are stored
+        if get_config().attachments.lazy_download and not processing_cancelled.is_set():
             try:
-                print(f"[Background Task] Starting processing for label: {label}")
-                
-                # Update progress state - starting new label
-                update_progress_state(
-                    current_label=label,
-                    current_label_index=idx
-                )
-                broadcast_progress_event_sync("progress", get_progress_state())
-                
-                loader_instance = get_loader()
-                
-                # Check for cancellation before loading emails
-                if processing_cancelled.is_set():
-                    print(f"[Background Task] Processing cancelled before loading emails for {label}")
-                    result_dict["error"] = "Processing was cancelled by user"
-                    result_dict["success"] = False
-                    update_progress_state(status="cancelled", error_message="Processing was cancelled by user")
-                    broadcast_progress_event_sync("cancelled", get_progress_state())
-                    break
-                
-                count = loader_instance.load_emails(label, new_only=new_only)
-                result_dict["count"] += count
-                result_dict["success"] = True  # Set to True if at least one succeeds
-                
-                # Update progress state - label completed
-                current_state = get_progress_state()
-                update_progress_state(emails_processed=current_state["emails_processed"] + count)
-                broadcast_progress_event_sync("progress", get_progress_state())
-                
-                print(f"[Background Task] Completed processing for label: {label}, processed {count} emails")
+                downloaded = get_loader().download_pending_attachments()
+                print(f"[Background Task] Downloaded {downloaded} pending attachment(s)")
             except Exception as e:
-                error_msg = result_dict.get("error", "")
-                if error_msg:
-                    error_msg += " "
-                error_msg += f"Error processing {label}: {str(e)}; "
-                result_dict["error"] = error_msg
-                result_dict["success"] = False
-                
-                # Update progress state - error occurred
-                current_state = get_progress_state()
-                update_progress_state(
-                    status="error",
-                    error_message=error_msg
-                )
-                broadcast_progress_event_sync("error", get_progress_state())
-                
-                print(f"[Background Task] Error processing {label}: {str(e)}")
+                print(f"[Background Task] Error downloading pending attachments: {str(e)}")
         
         # Mark as completed if not cancelled or errored
         current_state = get_progress_state()
@@ -1108,7 +1224,7 @@ def process_emails_background(labels: List[str], new_only: bool, result_dict: di
 
 
 @app.get("/")
-async def root():
+def root():
     """Root endpoint - returns a welcome message."""
     return {
         "message": "Welcome to the Museum of Dave API",
@@ -1118,6 +1234,7 @@ async def root():
             "POST /emails/process": "Process emails from a list of labels",
             "POST /emails/process/cancel": "Cancel email processing if in progress",
             "GET /emails/process/status": "Get current email processing status",
+            "POST /emails/import/mbox": "Import emails from an mbox file (e.g. Google Takeout), progress on /emails/process/stream",
             "POST /imessages/import": "Import iMessages from a directory structure",
             "GET /imessages/import/stream": "Stream iMessage import progress via SSE",
             "POST /imessages/import/cancel": "Cancel iMessage import if in progress",
@@ -1158,8 +1275,9 @@ async def root():
             "GET /emails/{email_id}/metadata": "Get email metadata by ID",
             "GET /emails/label": "Get metadata for all emails with given labels (query param: labels)",
             "GET /emails/folders": "Get list of available folders/labels from email server",
+            "GET /emails/folders/stored": "Get labels of stored emails with their email counts",
             "GET /emails/search": "Search emails by metadata criteria (from, to, month, year, subject, to_from, has_attachments)",
-            "GET /attachments/{attachment_id}": "Get attachment content",
+            "GET /attachments/{attachment_id}": "Get attachment content (query params: preview, size)",
             "GET /attachments/random": "Get random attachment with email metadata",
             "GET /attachments/by-id": "Get attachment by ID order (query param: offset)",
             "GET /attachments/by-size": "Get attachment by size order (query params: order=asc|desc, offset)",
@@ -1173,7 +1291,7 @@ async def root():
     }
 
 @app.get("/new-page", response_class=HTMLResponse)
-async def new_page(request: Request):
+def new_page(request: Request):
     """Serve the new page."""
     return templates.TemplateResponse(
         "new_page.html",
@@ -1181,7 +1299,7 @@ async def new_page(request: Request):
     )
 
 @app.get("/health")
-async def health_check():
+def health_check():
     """Health check endpoint - returns server status."""
     return MessageResponse(
         message="Server is running",
@@ -1189,8 +1307,18 @@ async def health_check():
     )
 
 
+@app.get("/health/database")
+def database_health_check():
+    """Report how many database engines exist in this process and their pooled connections.
+    
+    There should normally be exactly one engine; more indicate code building its own
+    connection pool instead of using get_database().
+    """
+    return get_engine_stats()
+
+
 @app.get("/api/control-defaults")
-async def get_control_defaults():
+def get_control_defaults():
     """Get default values for control tab inputs from environment variables.
     
     Returns:
@@ -1201,7 +1329,7 @@ async def get_control_defaults():
 
 
 @app.post("/emails/process", response_model=ProcessLabelResponse)
-async def process_emails(
+def process_emails(
     request: ProcessLabelRequest,
     background_tasks: BackgroundTasks
 ):
@@ -1277,8 +1405,135 @@ async def process_emails(
         )
 
 
+def import_mbox_background(file_path: str, default_label: str, result_dict: dict):
+    """Background task importing an mbox file, reporting progress like label processing."""
+    global processing_in_progress
+    
+    file_name = Path(file_path).name
+    
+    # Mark processing as started
+    with processing_lock:
+        processing_in_progress = True
+        processing_cancelled.clear()
+    
+    # The file is shown as the label being processed
+    update_progress_state(
+        current_label=file_name,
+        current_label_index=1,
+        total_labels=1,
+        emails_processed=0,
+        status="in_progress",
+        error_message=None,
+        labels=[file_name]
+    )
+    broadcast_progress_event_sync("progress", get_progress_state())
+    
+    try:
+        def progress_callback(stats: Dict[str, Any]):
+            """Callback function to update progress state."""
+            update_progress_state(emails_processed=stats["emails_imported"])
+            broadcast_progress_event_sync("progress", get_progress_state())
+        
+        def cancelled_check() -> bool:
+            """Check if import should be cancelled."""
+            return processing_cancelled.is_set()
+        
+        stats = import_mbox_file(
+            file_path,
+            progress_callback=progress_callback,
+            cancelled_check=cancelled_check,
+            default_label=default_label
+        )
+        result_dict.update(stats)
+        result_dict["count"] = stats["emails_imported"]
+        result_dict["success"] = True
+        
+        if processing_cancelled.is_set():
+            update_progress_state(status="cancelled", error_message="Processing was cancelled by user")
+            broadcast_progress_event_sync("cancelled", get_progress_state())
+        else:
+            update_progress_state(status="completed", emails_processed=stats["emails_imported"])
+            broadcast_progress_event_sync("completed", get_progress_state())
+        print(f"[Background Task] Imported {stats['emails_imported']} emails from {file_name} ({stats['errors']} errors)")
+    except Exception as e:
+        error_msg = f"Error importing {file_name}: {str(e)}"
+        result_dict["success"] = False
+        result_dict["error"] = error_msg
+        update_progress_state(status="error", error_message=error_msg)
+        broadcast_progress_event_sync("error", get_progress_state())
+        print(f"[Background Task] {error_msg}")
+    finally:
+        with processing_lock:
+            processing_in_progress = False
+
+
+@app.post("/emails/import/mbox", response_model=ProcessLabelResponse)
+def import_mbox(
+    request: ImportMboxRequest,
+    background_tasks: BackgroundTasks
+):
+    """Import emails from an mbox file, such as a Google Takeout Mail export, asynchronously.
+    
+    Runs as email processing: progress is streamed on /emails/process/stream and it
+    is cancelled with /emails/process/cancel.
+    
+    Args:
+        request: ImportMboxRequest with the file path and the label for messages without labels
+        background_tasks: FastAPI background tasks
+        
+    Returns:
+        ProcessLabelResponse with processing status
+        
+    Raises:
+        HTTPException: If the file doesn't exist or email processing is already in progress
+    """
+    global processing_in_progress
+    
+    # Create email service with state accessors
+    def get_state():
+        return processing_in_progress
+    
+    def set_state(value):
+        global processing_in_progress
+        processing_in_progress = value
+    
+    email_service = EmailService(
+        get_processing_state=get_state,
+        set_processing_state=set_state,
+        cancellation_event=processing_cancelled,
+        processing_lock=processing_lock
+    )
+    
+    try:
+        email_service.can_start_processing()
+    except ConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    file_path = Path(request.file_path)
+    if not file_path.exists() or not file_path.is_file():
+        raise HTTPException(
+            status_code=400,
+            detail=f"File does not exist or is not a file: {request.file_path}"
+        )
+    
+    result_dict = {"count": 0, "success": False}
+    background_tasks.add_task(
+        import_mbox_background,
+        request.file_path,
+        request.default_label,
+        result_dict
+    )
+    
+    return ProcessLabelResponse(
+        message=f"Importing emails from {file_path.name} started",
+        labels=[file_path.name],
+        count=0,  # Will be updated in background
+        timestamp=datetime.now()
+    )
+
+
 @app.post("/emails/process/cancel")
-async def cancel_email_processing():
+def cancel_email_processing():
     """Cancel email processing if it is in progress.
     
     Returns:
@@ -1319,7 +1574,7 @@ async def cancel_email_processing():
 
 
 @app.get("/emails/process/status")
-async def get_processing_status():
+def get_processing_status():
     """Get the current status of email processing.
     
     Returns:
@@ -1430,7 +1685,7 @@ def import_imessages_background(directory_path: str, result_dict: dict):
 
 
 @app.post("/imessages/import", response_model=ImportIMessagesResponse)
-async def import_imessages(
+def import_imessages(
     request: ImportIMessagesRequest,
     background_tasks: BackgroundTasks
 ):
@@ -1609,7 +1864,7 @@ async def stream_imessage_import_progress():
 
 
 @app.post("/imessages/import/cancel")
-async def cancel_imessage_import():
+def cancel_imessage_import():
     """Cancel iMessage import if it is in progress.
     
     Returns:
@@ -1634,7 +1889,7 @@ async def cancel_imessage_import():
 
 
 @app.get("/imessages/import/status")
-async def get_imessage_import_status():
+def get_imessage_import_status():
     """Get the current status of iMessage import.
     
     Returns:
@@ -1653,7 +1908,7 @@ async def get_imessage_import_status():
 
 
 @app.get("/imessages/chat-sessions")
-async def get_chat_sessions():
+def get_chat_sessions():
     """Get list of unique chat session names from messages table.
     
     Returns:
@@ -1700,7 +1955,7 @@ async def get_chat_sessions():
 
 
 @app.get("/imessages/conversation/{chat_session}")
-async def get_conversation_messages(chat_session: str):
+def get_conversation_messages(chat_session: str):
     """Get all messages for a specific chat session.
     
     Args:
@@ -1767,7 +2022,7 @@ async def get_conversation_messages(chat_session: str):
 
 
 @app.get("/imessages/{message_id}/metadata")
-async def get_message_metadata(message_id: int):
+def get_message_metadata(message_id: int):
     """Get message metadata by ID.
     
     Args:
@@ -1811,7 +2066,7 @@ async def get_message_metadata(message_id: int):
 
 
 @app.post("/imessages/conversation/{chat_session}/summarize")
-async def summarize_conversation(chat_session: str):
+def summarize_conversation(chat_session: str):
     """Summarize a conversation using Gemini LLM synchronously.
     
     Args:
@@ -1872,7 +2127,7 @@ async def summarize_conversation(chat_session: str):
     }
 
 @app.post("/emails/thread/{participant}/summarize")
-async def summarize_conversation(participant: str):
+def summarize_conversation(participant: str):
     """Summarize email intercation  with a person using Gemini LLM synchronously.
     
     Args:
@@ -1951,7 +2206,7 @@ class ChatResponse(BaseModel):
 
 
 @app.post("/chat/generate", response_model=ChatResponse)
-async def generate_chat_response(request: ChatRequest):
+def generate_chat_response(request: ChatRequest):
     """Generate a chat response using ChatService with Gemini LLM.
     
     This endpoint allows users to send a prompt and receive a response from the ChatService.
@@ -2079,7 +2334,7 @@ class ConversationUpdateRequest(BaseModel):
 
 
 @app.post("/chat/conversations")
-async def create_conversation(request: ConversationCreateRequest):
+def create_conversation(request: ConversationCreateRequest):
     """Create a new conversation.
     
     Args:
@@ -2109,7 +2364,7 @@ async def create_conversation(request: ConversationCreateRequest):
 
 
 @app.get("/chat/conversations")
-async def list_conversations(limit: Optional[int] = Query(None)):
+def list_conversations(limit: Optional[int] = Query(None)):
     """List all conversations, ordered by most recent activity.
     
     Args:
@@ -2157,7 +2412,7 @@ async def list_conversations(limit: Optional[int] = Query(None)):
 
 
 @app.get("/chat/conversations/{conversation_id}")
-async def get_conversation(conversation_id: int):
+def get_conversation(conversation_id: int):
     """Get conversation details including turns.
     
     Args:
@@ -2204,7 +2459,7 @@ async def get_conversation(conversation_id: int):
 
 
 @app.put("/chat/conversations/{conversation_id}")
-async def update_conversation(conversation_id: int, request: ConversationUpdateRequest):
+def update_conversation(conversation_id: int, request: ConversationUpdateRequest):
     """Update conversation metadata.
     
     Args:
@@ -2242,7 +2497,7 @@ async def update_conversation(conversation_id: int, request: ConversationUpdateR
 
 
 @app.delete("/chat/conversations/{conversation_id}")
-async def delete_conversation(conversation_id: int):
+def delete_conversation(conversation_id: int):
     """Delete a conversation and all its turns.
     
     Args:
@@ -2281,7 +2536,7 @@ class SubjectConfigurationRequest(BaseModel):
 
 
 @app.get("/api/subject-configuration")
-async def get_subject_configuration():
+def get_subject_configuration():
     """Get current subject configuration.
     
     Returns:
@@ -2319,7 +2574,7 @@ async def get_subject_configuration():
 
 
 @app.post("/api/subject-configuration")
-async def create_or_update_subject_configuration(request: SubjectConfigurationRequest):
+def create_or_update_subject_configuration(request: SubjectConfigurationRequest):
     """Create or update subject configuration.
     
     Args:
@@ -2370,7 +2625,7 @@ async def create_or_update_subject_configuration(request: SubjectConfigurationRe
 
 
 @app.get("/chat/conversations/{conversation_id}/turns")
-async def get_conversation_turns(conversation_id: int, limit: int = Query(30, ge=1, le=100)):
+def get_conversation_turns(conversation_id: int, limit: int = Query(30, ge=1, le=100)):
     """Get turns for a conversation.
     
     Args:
@@ -2585,7 +2840,7 @@ async def stream_conversation_summary_progress(chat_session: str):
 
 
 @app.delete("/imessages/conversation/{chat_session}")
-async def delete_conversation(chat_session: str):
+def delete_conversation(chat_session: str):
     """Delete all messages for a specific chat session.
     
     Args:
@@ -2731,7 +2986,7 @@ def import_whatsapp_background(directory_path: str, result_dict: dict):
 
 
 @app.post("/whatsapp/import", response_model=ImportWhatsAppResponse)
-async def import_whatsapp(
+def import_whatsapp(
     request: ImportWhatsAppRequest,
     background_tasks: BackgroundTasks
 ):
@@ -2885,7 +3140,7 @@ async def stream_whatsapp_import_progress():
 
 
 @app.post("/whatsapp/import/cancel")
-async def cancel_whatsapp_import():
+def cancel_whatsapp_import():
     """Cancel WhatsApp import if it is in progress.
     
     Returns:
@@ -2910,7 +3165,7 @@ async def cancel_whatsapp_import():
 
 
 @app.get("/whatsapp/import/status")
-async def get_whatsapp_import_status():
+def get_whatsapp_import_status():
     """Get the current status of WhatsApp import.
     
     Returns:
@@ -3022,7 +3277,7 @@ def import_facebook_background(directory_path: str, user_name: Optional[str], re
 
 
 @app.post("/facebook/import", response_model=ImportFacebookResponse)
-async def import_facebook(
+def import_facebook(
     request: ImportFacebookRequest,
     background_tasks: BackgroundTasks
 ):
@@ -3180,7 +3435,7 @@ async def stream_facebook_import_progress():
 
 
 @app.post("/facebook/import/cancel")
-async def cancel_facebook_import():
+def cancel_facebook_import():
     """Cancel Facebook Messenger import if it is in progress.
     
     Returns:
@@ -3205,7 +3460,7 @@ async def cancel_facebook_import():
 
 
 @app.get("/facebook/import/status")
-async def get_facebook_import_status():
+def get_facebook_import_status():
     """Get the current status of Facebook Messenger import.
     
     Returns:
@@ -3315,7 +3570,7 @@ def import_instagram_background(
 
 
 @app.post("/instagram/import", response_model=ImportInstagramResponse)
-async def import_instagram(
+def import_instagram(
     request: ImportInstagramRequest,
     background_tasks: BackgroundTasks
 ):
@@ -3467,7 +3722,7 @@ async def stream_instagram_import_progress():
 
 
 @app.post("/instagram/import/cancel")
-async def cancel_instagram_import():
+def cancel_instagram_import():
     """Cancel Instagram import if it is in progress.
     
     Returns:
@@ -3491,7 +3746,7 @@ async def cancel_instagram_import():
 
 
 @app.get("/instagram/import/status")
-async def get_instagram_import_status():
+def get_instagram_import_status():
     """Get the current status of Instagram import.
     
     Returns:
@@ -3628,6 +3883,9 @@ def import_filesystem_images_background(
         total_files=0,
         images_imported=0,
         images_updated=0,
+        files_unchanged=0,
+        files_moved=0,
+        files_deleted=0,
         errors=0,
         error_messages=[]
     )
@@ -3641,6 +3899,10 @@ def import_filesystem_images_background(
         'files_processed': 0,
         'images_imported': 0,
         'images_updated': 0,
+        'files_unchanged': 0,
+        'files_moved': 0,
+        'files_deleted': 0,
+        'deleted_files': [],
         'errors': 0,
         'error_messages': [],
         'current_file': None
@@ -3662,6 +3924,8 @@ def import_filesystem_images_background(
                 total_files=accumulated_stats['total_files'] + stats.get("total_files", 0),
                 images_imported=accumulated_stats['images_imported'] + stats.get("images_imported", 0),
                 images_updated=accumulated_stats['images_updated'] + stats.get("images_updated", 0),
+                files_unchanged=accumulated_stats['files_unchanged'] + stats.get("files_unchanged", 0),
+                files_moved=accumulated_stats['files_moved'] + stats.get("files_moved", 0),
                 errors=accumulated_stats['errors'] + stats.get("errors", 0),
                 error_messages=accumulated_stats['error_messages'] + stats.get("error_messages", []),
                 status="in_progress"
@@ -3708,6 +3972,10 @@ def import_filesystem_images_background(
             accumulated_stats['files_processed'] += stats.get('files_processed', 0)
             accumulated_stats['images_imported'] += stats.get('images_imported', 0)
             accumulated_stats['images_updated'] += stats.get('images_updated', 0)
+            accumulated_stats['files_unchanged'] += stats.get('files_unchanged', 0)
+            accumulated_stats['files_moved'] += stats.get('files_moved', 0)
+            accumulated_stats['files_deleted'] += stats.get('files_deleted', 0)
+            accumulated_stats['deleted_files'].extend(stats.get('deleted_files', []))
             accumulated_stats['errors'] += stats.get('errors', 0)
             accumulated_stats['error_messages'].extend(stats.get('error_messages', []))
             
@@ -3745,7 +4013,7 @@ def import_filesystem_images_background(
 
 
 @app.post("/facebook/albums/import", response_model=ImportFacebookAlbumsResponse)
-async def import_facebook_albums(
+def import_facebook_albums(
     request: ImportFacebookAlbumsRequest,
     background_tasks: BackgroundTasks
 ):
@@ -3855,7 +4123,7 @@ async def stream_facebook_albums_import_progress(request: Request):
 
 
 @app.post("/facebook/albums/import/cancel")
-async def cancel_facebook_albums_import():
+def cancel_facebook_albums_import():
     """Cancel Facebook Albums import if in progress.
     
     Returns:
@@ -3872,7 +4140,7 @@ async def cancel_facebook_albums_import():
 
 
 @app.get("/facebook/albums/import/status")
-async def get_facebook_albums_import_status():
+def get_facebook_albums_import_status():
     """Get current status of Facebook Albums import.
     
     Returns:
@@ -3891,7 +4159,7 @@ async def get_facebook_albums_import_status():
 
 
 @app.post("/images/import", response_model=ImportFilesystemImagesResponse)
-async def import_filesystem_images(
+def import_filesystem_images(
     request: ImportFilesystemImagesRequest,
     background_tasks: BackgroundTasks
 ):
@@ -4017,7 +4285,7 @@ async def stream_filesystem_import_progress(request: Request):
 
 
 @app.post("/images/import/cancel")
-async def cancel_filesystem_import():
+def cancel_filesystem_import():
     """Cancel Filesystem import if it is in progress.
     
     Returns:
@@ -4041,7 +4309,7 @@ async def cancel_filesystem_import():
 
 
 @app.get("/images/import/status")
-async def get_filesystem_import_status():
+def get_filesystem_import_status():
     """Get the current status of Filesystem import.
     
     Returns:
@@ -4069,7 +4337,6 @@ def process_thumbnails_background(result_dict: dict):
              set processed=true.
     """
     global thumbnail_processing_in_progress
-    db = Database()
     image_service = ImageService(db)
     
     # Mark processing as started
@@ -4181,9 +4448,10 @@ def process_thumbnails_background(result_dict: dict):
                         MediaBlob.id == metadata_item.media_blob_id
                     ).first()
 
-                    if blob and blob.image_data:
+                    image_data = get_media_blob_content(blob)
+                    if image_data:
 
-                        thumbnail_data, exif_data = process_images_service.create_thumb_and_get_exif(blob.image_data, process_thunbnail=True, process_exif=True, width=200)
+                        thumbnail_data, exif_data = process_images_service.create_thumb_and_get_exif(image_data, process_thunbnail=True, process_exif=True, width=200)
 
                         if thumbnail_data:
                             blob.thumbnail_data = thumbnail_data
@@ -4273,7 +4541,7 @@ def process_thumbnails_background(result_dict: dict):
 
 
 @app.post("/images/process-thumbnails")
-async def start_thumbnail_processing(background_tasks: BackgroundTasks):
+def start_thumbnail_processing(background_tasks: BackgroundTasks):
     """Start thumbnail processing.
     
     Returns:
@@ -4356,7 +4624,7 @@ async def stream_thumbnail_processing_progress(request: Request):
 
 
 @app.post("/images/process-thumbnails/cancel")
-async def cancel_thumbnail_processing():
+def cancel_thumbnail_processing():
     """Cancel thumbnail processing if it is in progress.
     
     Returns:
@@ -4380,7 +4648,7 @@ async def cancel_thumbnail_processing():
 
 
 @app.get("/images/process-thumbnails/status")
-async def get_thumbnail_processing_status():
+def get_thumbnail_processing_status():
     """Get the current status of thumbnail processing.
     
     Returns:
@@ -4399,7 +4667,7 @@ async def get_thumbnail_processing_status():
 
 
 @app.get("/facebook/albums")
-async def get_facebook_albums():
+def get_facebook_albums():
     """Get list of all Facebook albums.
     
     Returns:
@@ -4438,7 +4706,7 @@ async def get_facebook_albums():
 
 
 @app.get("/facebook/albums/{album_id}/images")
-async def get_facebook_album_images(album_id: int):
+def get_facebook_album_images(album_id: int):
     """Get all images for a specific Facebook album.
     
     Args:
@@ -4474,7 +4742,7 @@ async def get_facebook_album_images(album_id: int):
 
 
 @app.get("/facebook/albums/images/{image_id}")
-async def get_facebook_album_image(image_id: int):
+def get_facebook_album_image(image_id: int):
     """Get image data for a specific Facebook album image.
     
     Args:
@@ -4502,7 +4770,8 @@ async def get_facebook_album_image(image_id: int):
             )
         
         # Get MediaBlob
-        if not media_item.media_blob or not media_item.media_blob.image_data:
+        media_blob = media_item.media_blob
+        if not media_blob or (media_blob.image_data is None and not media_blob.image_key):
             raise HTTPException(
                 status_code=404,
                 detail=f"Image with ID {image_id} has no image data"
@@ -4516,8 +4785,12 @@ async def get_facebook_album_image(image_id: int):
             if guessed_type:
                 content_type = guessed_type
         
+        file_path = blob_file_path(media_blob.image_key) if media_blob.image_data is None else None
+        if file_path:
+            return FileResponse(file_path, media_type=content_type)
+        
         return Response(
-            content=media_item.media_blob.image_data,
+            content=get_media_blob_content(media_blob),
             media_type=content_type
         )
     finally:
@@ -4525,7 +4798,7 @@ async def get_facebook_album_image(image_id: int):
 
 
 @app.get("/imessages/{message_id}/attachment")
-async def get_imessage_attachment(message_id: int, preview: bool = False):
+def get_imessage_attachment(message_id: int, preview: bool = False):
     """Get attachment content for a message.
     
     Uses unified media system via MessageAttachment junction table.
@@ -4572,7 +4845,10 @@ async def get_imessage_attachment(message_id: int, preview: bool = False):
                 detail=f"Media item for attachment not found"
             )
         
-        media_blob = session.query(MediaBlob).filter(
+        # Load only the content column this request returns
+        media_blob = session.query(MediaBlob).options(
+            undefer(MediaBlob.thumbnail_data) if preview else undefer(MediaBlob.image_data)
+        ).filter(
             MediaBlob.id == media_item.media_blob_id
         ).first()
         
@@ -4595,15 +4871,24 @@ async def get_imessage_attachment(message_id: int, preview: bool = False):
             base_name, ext = os.path.splitext(filename)
             safe_filename = f"{base_name}_thumb.jpg".replace('"', '\\"')
         else:
-            content = media_blob.image_data
+            content_type = media_item.media_type or "application/octet-stream"
+            filename = media_item.title or "attachment"
+            safe_filename = filename.replace('"', '\\"')
+            file_path = blob_file_path(media_blob.image_key) if media_blob.image_data is None else None
+            if file_path:
+                return FileResponse(
+                    file_path,
+                    media_type=content_type,
+                    headers={
+                        "Content-Disposition": f'inline; filename="{safe_filename}"'
+                    }
+                )
+            content = get_media_blob_content(media_blob)
             if content is None:
                 raise HTTPException(
                     status_code=404,
                     detail=f"Message attachment has no content"
                 )
-            content_type = media_item.media_type or "application/octet-stream"
-            filename = media_item.title or "attachment"
-            safe_filename = filename.replace('"', '\\"')
         
         return Response(
             content=content,
@@ -4699,7 +4984,7 @@ async def stream_processing_progress():
 
 
 @app.get("/emails/{email_id}/html")
-async def get_email_html(email_id: int):
+def get_email_html(email_id: int):
     """Get email HTML content by ID.
     
     Args:
@@ -4713,7 +4998,15 @@ async def get_email_html(email_id: int):
     """
     session = db.get_session()
     try:
-        email = session.query(Email).filter(Email.id == email_id).filter(Email.user_deleted == False).first()
+        email = session.query(Email).options(
+            undefer(Email.raw_message),
+            undefer(Email.plain_text),
+            undefer(Email.raw_message_compressed),
+            undefer(Email.plain_text_compressed)
+        ).filter(Email.id == email_id).filter(Email.user_deleted == False).first()
+        if email:
+            html_body = email_html_body(session, email)
+            text_body = email_text_body(session, email)
     finally:
         session.close()
     
@@ -4724,8 +5017,8 @@ async def get_email_html(email_id: int):
         )
     
     # If HTML is not available, fall back to plain text wrapped in HTML
-    if not email.raw_message:
-        if email.plain_text:
+    if not html_body:
+        if text_body:
             # Wrap plain text in basic HTML for display
             html_content = f"""<!DOCTYPE html>
 <html>
@@ -4744,7 +5037,7 @@ async def get_email_html(email_id: int):
     </style>
 </head>
 <body>
-{email.plain_text}
+{text_body}
 </body>
 </html>"""
             return Response(
@@ -4759,13 +5052,13 @@ async def get_email_html(email_id: int):
     
     # Return the HTML content with proper content type
     return Response(
-        content=email.raw_message,
+        content=html_body,
         media_type="text/html"
     )
 
 
 @app.get("/emails/{email_id}/text")
-async def get_email_text(email_id: int):
+def get_email_text(email_id: int):
     """Get email plain text content by ID.
     
     Args:
@@ -4779,7 +5072,12 @@ async def get_email_text(email_id: int):
     """
     session = db.get_session()
     try:
-        email = session.query(Email).filter(Email.id == email_id).filter(Email.user_deleted == False).first()
+        email = session.query(Email).options(
+            undefer(Email.plain_text),
+            undefer(Email.plain_text_compressed)
+        ).filter(Email.id == email_id).filter(Email.user_deleted == False).first()
+        if email:
+            text_body = email_text_body(session, email)
     finally:
         session.close()
     
@@ -4789,7 +5087,7 @@ async def get_email_text(email_id: int):
             detail=f"Email with ID {email_id} not found"
         )
     
-    if not email.plain_text:
+    if not text_body:
         raise HTTPException(
             status_code=404,
             detail=f"Email with ID {email_id} has no text content"
@@ -4797,13 +5095,13 @@ async def get_email_text(email_id: int):
     
     # Return the plain text content with proper content type
     return Response(
-        content=email.plain_text,
+        content=text_body,
         media_type="text/plain"
     )
 
 
 @app.get("/emails/{email_id}/snippet")
-async def get_email_snippet(email_id: int):
+def get_email_snippet(email_id: int):
     """Get email snippet by ID.
     
     Args:
@@ -4841,7 +5139,7 @@ async def get_email_snippet(email_id: int):
 
 
 @app.get("/emails/{email_id}/metadata", response_model=EmailMetadataResponse)
-async def get_email_metadata(email_id: int):
+def get_email_metadata(email_id: int):
     """Get email metadata by ID.
     
     Args:
@@ -4865,8 +5163,7 @@ async def get_email_metadata(email_id: int):
         
         # Get media item IDs (attachment IDs) for this email
         media_items = session.query(MediaMetadata).filter(
-            MediaMetadata.source == "email_attachment",
-            MediaMetadata.source_reference == str(email_id)
+            MediaMetadata.email_id == email_id
         ).all()
         attachment_ids = [item.id for item in media_items]
         
@@ -4895,7 +5192,7 @@ async def get_email_metadata(email_id: int):
 
 
 @app.put("/emails/{email_id}")
-async def update_email(email_id: int, updates: Dict[str, Any]):
+def update_email(email_id: int, updates: Dict[str, Any]):
     """Update email fields.
     
     Args:
@@ -4932,8 +5229,7 @@ async def update_email(email_id: int, updates: Dict[str, Any]):
         
         # Get media item IDs (attachment IDs) for this email
         media_items = session.query(MediaMetadata).filter(
-            MediaMetadata.source == "email_attachment",
-            MediaMetadata.source_reference == str(email_id)
+            MediaMetadata.email_id == email_id
         ).all()
         attachment_ids = [item.id for item in media_items]
         
@@ -4969,7 +5265,7 @@ async def update_email(email_id: int, updates: Dict[str, Any]):
 
 
 @app.delete("/emails/bulk-delete")
-async def bulk_delete_emails(delete_data: Dict[str, Any] = Body(...)):
+def bulk_delete_emails(delete_data: Dict[str, Any] = Body(...)):
     """Bulk delete multiple emails by their IDs.
     
     Args:
@@ -5005,8 +5301,7 @@ async def bulk_delete_emails(delete_data: Dict[str, Any] = Body(...)):
                 
                 # Delete all media items associated with the email
                 media_items = session.query(MediaMetadata).filter(
-                    MediaMetadata.source == "email_attachment",
-                    MediaMetadata.source_reference == str(email_id)
+                    MediaMetadata.email_id == email_id
                 ).all()
                 
                 for media_item in media_items:
@@ -5031,6 +5326,8 @@ async def bulk_delete_emails(delete_data: Dict[str, Any] = Body(...)):
                 # Set user_deleted flag to True (soft delete) and clear other fields
                 email.raw_message = None
                 email.plain_text = None
+                email.raw_message_compressed = None
+                email.plain_text_compressed = None
                 email.snippet = None
                 email.embedding = None
                 email.has_attachments = False
@@ -5060,7 +5357,7 @@ async def bulk_delete_emails(delete_data: Dict[str, Any] = Body(...)):
 
 
 @app.delete("/emails/{email_id}")
-async def delete_email(email_id: int):
+def delete_email(email_id: int):
     """Delete an email by ID.
     
     Deletes all attachments associated with the email and sets the user_deleted
@@ -5087,8 +5384,7 @@ async def delete_email(email_id: int):
         
         # Delete all media items associated with the email
         media_items = session.query(MediaMetadata).filter(
-            MediaMetadata.source == "email_attachment",
-            MediaMetadata.source_reference == str(email_id)
+            MediaMetadata.email_id == email_id
         ).all()
         
         for media_item in media_items:
@@ -5117,6 +5413,8 @@ async def delete_email(email_id: int):
         # cause the email to be re-processed and re-indexed.
         email.raw_message = None
         email.plain_text = None
+        email.raw_message_compressed = None
+        email.plain_text_compressed = None
         email.snippet = None
         email.embedding = None
         email.has_attachments = False
@@ -5137,7 +5435,7 @@ async def delete_email(email_id: int):
 
 
 @app.get("/emails/folders", response_model=List[LabelResponse])
-async def get_folders():
+def get_folders():
     """Get list of available folders/labels from the email server.
     
     Returns:
@@ -5168,6 +5466,65 @@ async def get_folders():
         )
 
 
+@app.get("/emails/folders/stored", response_model=List[StoredLabelResponse])
+async def get_stored_folders():
+    """Get the labels carried by stored emails, with the number of emails per label.
+    
+    Returns:
+        List of StoredLabelResponse objects ordered by label name, excluding user deleted emails
+    """
+    async with async_db.get_session() as session:
+        rows = await session.execute(
+            select(EmailLabel.label, func.count(EmailLabel.email_id))
+            .join(Email, Email.id == EmailLabel.email_id)
+            .where(Email.user_deleted == False)
+            .group_by(EmailLabel.label)
+            .order_by(EmailLabel.label)
+        )
+        return [StoredLabelResponse(name=label, email_count=count) for label, count in rows]
+
+
+async def _email_metadata_responses(session, emails) -> List[EmailMetadataResponse]:
+    """Convert emails to response models, loading their attachment IDs in one query.
+    
+    Args:
+        session: Open AsyncSession
+        emails: Email rows to convert
+        
+    Returns:
+        List of EmailMetadataResponse objects in the order of emails
+    """
+    # Attachment IDs are the media items created from each email's attachments
+    attachment_ids: Dict[int, List[int]] = {}
+    if emails:
+        rows = await session.execute(
+            select(MediaMetadata.email_id, MediaMetadata.id).where(
+                MediaMetadata.email_id.in_([email.id for email in emails])
+            ).order_by(MediaMetadata.id)
+        )
+        for email_id, media_id in rows:
+            attachment_ids.setdefault(email_id, []).append(media_id)
+    
+    return [
+        EmailMetadataResponse(
+            id=email.id,
+            uid=email.uid,
+            folder=email.folder,
+            subject=email.subject,
+            from_address=email.from_address,
+            to_addresses=email.to_addresses,
+            cc_addresses=email.cc_addresses,
+            bcc_addresses=email.bcc_addresses,
+            date=email.date,
+            snippet=email.snippet,
+            attachment_ids=attachment_ids.get(email.id, []),
+            created_at=email.created_at,
+            updated_at=email.updated_at
+        )
+        for email in emails
+    ]
+
+
 @app.get("/emails/label", response_model=List[EmailMetadataResponse])
 async def get_emails_by_label(labels: List[str] = Query(..., description="List of labels to filter by")):
     """Get metadata for all emails with given labels.
@@ -5180,8 +5537,8 @@ async def get_emails_by_label(labels: List[str] = Query(..., description="List o
         List of EmailMetadataResponse objects for all emails matching any of the given labels
         
     Note:
-        Labels are stored as comma-separated strings in the folder field.
-        This endpoint matches emails where any of the provided labels appears anywhere in the folder field.
+        Labels are matched through the email_labels table, which holds one row per
+        label of each email's comma-separated folder field.
     """
     if not labels:
         raise HTTPException(
@@ -5189,56 +5546,20 @@ async def get_emails_by_label(labels: List[str] = Query(..., description="List o
             detail="At least one label must be provided as query parameter (e.g., ?labels=INBOX&labels=IMPORTANT)"
         )
     
-    session = db.get_session()
-    try:
-        # Build filter conditions for each label
-        label_filters = []
-        for label in labels:
-            label_filters.extend([
-                Email.folder == label,  # Exact match
-                Email.folder.like(f"{label},%"),  # Label at start
-                Email.folder.like(f"%,{label},%"),  # Label in middle
-                Email.folder.like(f"%,{label}")  # Label at end
-            ])
-        
-        # Query emails where the folder field contains any of the labels
+    async with async_db.get_session() as session:
+        # Query emails carrying any of the labels
         # Exclude emails where user_deleted is True
-        emails = session.query(Email).filter(
-            and_(
-                or_(*label_filters),
-                Email.user_deleted == False
+        labelled_email_ids = select(EmailLabel.email_id).where(EmailLabel.label.in_(labels))
+        emails = (await session.scalars(
+            select(Email).where(
+                and_(
+                    Email.id.in_(labelled_email_ids),
+                    Email.user_deleted == False
+                )
             )
-        ).all()
+        )).all()
         
-        # Convert to response models (get attachment IDs from media items)
-        result = []
-        for email in emails:
-            # Get media item IDs (attachment IDs) for this email
-            media_items = session.query(MediaMetadata).filter(
-                MediaMetadata.source == "email_attachment",
-                MediaMetadata.source_reference == str(email.id)
-            ).all()
-            attachment_ids = [item.id for item in media_items]
-            
-            result.append(EmailMetadataResponse(
-                id=email.id,
-                uid=email.uid,
-                folder=email.folder,
-                subject=email.subject,
-                from_address=email.from_address,
-                to_addresses=email.to_addresses,
-                cc_addresses=email.cc_addresses,
-                bcc_addresses=email.bcc_addresses,
-                date=email.date,
-                snippet=email.snippet,
-                attachment_ids=attachment_ids,
-                created_at=email.created_at,
-                updated_at=email.updated_at
-            ))
-    finally:
-        session.close()
-    
-    return result
+        return await _email_metadata_responses(session, emails)
 
 
 @app.get("/emails/search", response_model=List[EmailMetadataResponse])
@@ -5268,10 +5589,9 @@ async def search_emails(
     Returns:
         List of EmailMetadataResponse objects matching all specified criteria
     """
-    session = db.get_session()
-    try:
+    async with async_db.get_session() as session:
         # Start building query with base filter
-        query = session.query(Email)
+        query = select(Email)
         filters = []
         
         # Filter by from_address (partial match, case-insensitive)
@@ -5312,47 +5632,19 @@ async def search_emails(
         
         # Apply all filters with AND logic
         if filters:
-            query = query.filter(and_(*filters))
+            query = query.where(and_(*filters))
         
         # Sort by descending date (newest first)
         query = query.order_by(Email.date.desc())
         
         # Execute query
-        emails = query.all()
-        
-        # Convert to response models (get attachment IDs from media items)
-        result = []
-        for email in emails:
-            # Get media item IDs (attachment IDs) for this email
-            media_items = session.query(MediaMetadata).filter(
-                MediaMetadata.source == "email_attachment",
-                MediaMetadata.source_reference == str(email.id)
-            ).all()
-            attachment_ids = [item.id for item in media_items]
-            
-            result.append(EmailMetadataResponse(
-                id=email.id,
-                uid=email.uid,
-                folder=email.folder,
-                subject=email.subject,
-                from_address=email.from_address,
-                to_addresses=email.to_addresses,
-                cc_addresses=email.cc_addresses,
-                bcc_addresses=email.bcc_addresses,
-                date=email.date,
-                snippet=email.snippet,
-                attachment_ids=attachment_ids,
-                created_at=email.created_at,
-                updated_at=email.updated_at
-            ))
+        emails = (await session.scalars(query)).all()
         
-        return result
-    finally:
-        session.close()
+        return await _email_metadata_responses(session, emails)
 
 
 @app.get("/attachments/random", response_model=Optional[AttachmentInfoResponse])
-async def get_random_attachment():
+def get_random_attachment():
     """Get a random attachment with its email metadata.
     
     Returns:
@@ -5368,9 +5660,8 @@ async def get_random_attachment():
         if not media_item:
             return None
         
-        # Get the email for this attachment (from source_reference)
-        email_id = int(media_item.source_reference)
-        email = session.query(Email).filter(Email.id == email_id).first()
+        # Get the email for this attachment
+        email = session.query(Email).filter(Email.id == media_item.email_id).first()
         
         if not email:
             return None
@@ -5394,7 +5685,7 @@ async def get_random_attachment():
 
 
 @app.get("/attachments/by-id", response_model=Optional[AttachmentInfoResponse])
-async def get_attachment_by_id_order(offset: int = Query(0, ge=0, description="Offset for pagination")):
+def get_attachment_by_id_order(offset: int = Query(0, ge=0, description="Offset for pagination")):
     """Get attachment by ID order with offset.
     
     Args:
@@ -5413,9 +5704,8 @@ async def get_attachment_by_id_order(offset: int = Query(0, ge=0, description="O
         if not media_item:
             return None
         
-        # Get the email for this attachment (from source_reference)
-        email_id = int(media_item.source_reference)
-        email = session.query(Email).filter(Email.id == email_id).first()
+        # Get the email for this attachment
+        email = session.query(Email).filter(Email.id == media_item.email_id).first()
         
         if not email:
             return None
@@ -5439,7 +5729,7 @@ async def get_attachment_by_id_order(offset: int = Query(0, ge=0, description="O
 
 
 @app.get("/attachments/by-size", response_model=Optional[AttachmentInfoResponse])
-async def get_attachment_by_size_order(
+def get_attachment_by_size_order(
     order: str = Query("asc", regex="^(asc|desc)$", description="Order: 'asc' for smallest to biggest, 'desc' for biggest to smallest"),
     offset: int = Query(0, ge=0, description="Offset for pagination")
 ):
@@ -5464,18 +5754,17 @@ async def get_attachment_by_size_order(
         # Order by blob data length (using func.length for binary data)
         from sqlalchemy import func
         if order == "asc":
-            query = query.order_by(func.length(MediaBlob.image_data).asc().nullslast())
+            query = query.order_by(media_blob_size_expression().asc().nullslast())
         else:
-            query = query.order_by(func.length(MediaBlob.image_data).desc().nullslast())
+            query = query.order_by(media_blob_size_expression().desc().nullslast())
         
         media_item = query.offset(offset).first()
         
         if not media_item:
             return None
         
-        # Get the email for this attachment (from source_reference)
-        email_id = int(media_item.source_reference)
-        email = session.query(Email).filter(Email.id == email_id).first()
+        # Get the email for this attachment
+        email = session.query(Email).filter(Email.id == media_item.email_id).first()
         
         if not email:
             return None
@@ -5484,8 +5773,7 @@ async def get_attachment_by_size_order(
         content_type = media_item.media_type or "application/octet-stream"
         
         # Calculate size from blob data length
-        media_blob = session.query(MediaBlob).filter(MediaBlob.id == media_item.media_blob_id).first()
-        size = len(media_blob.image_data) if media_blob and media_blob.image_data else None
+        size = session.query(media_blob_size_expression()).filter(MediaBlob.id == media_item.media_blob_id).scalar()
         
         return AttachmentInfoResponse(
             attachment_id=media_item.id,
@@ -5503,7 +5791,7 @@ async def get_attachment_by_size_order(
 
 
 @app.get("/attachments/count")
-async def get_attachment_count():
+def get_attachment_count():
     """Get total count of attachments in the database.
     
     Returns:
@@ -5520,7 +5808,7 @@ async def get_attachment_count():
 
 
 @app.get("/attachments/images", response_model=ImageGridResponse)
-async def get_images_grid(
+def get_images_grid(
     page: int = Query(1, ge=1, description="Page number (1-based)"),
     page_size: int = Query(50, ge=1, le=100, description="Number of images per page"),
     order: str = Query("id", regex="^(id|size|date)$", description="Sort order: 'id', 'size', or 'date'"),
@@ -5544,18 +5832,14 @@ async def get_images_grid(
         # Calculate offset
         offset = (page - 1) * page_size
         
-        # Query media items with source="email_attachment" - filter by type if not showing all types
-        if all_types:
-            media_query = session.query(MediaMetadata).join(MediaBlob).join(
-                Email, Email.id == func.cast(MediaMetadata.source_reference, Integer)
-            ).filter(MediaMetadata.source == "email_attachment")
-        else:
-            media_query = session.query(MediaMetadata).join(MediaBlob).join(
-                Email, Email.id == func.cast(MediaMetadata.source_reference, Integer)
-            ).filter(
-                MediaMetadata.source == "email_attachment",
-                MediaMetadata.media_type.like('image/%')
-            )
+        # Query email attachment media items with their email and blob size in one
+        # index join - filter by type if not showing all types
+        size_expression = media_blob_size_expression()
+        media_query = session.query(MediaMetadata, Email, size_expression).join(MediaBlob).join(
+            Email, Email.id == MediaMetadata.email_id
+        )
+        if not all_types:
+            media_query = media_query.filter(MediaMetadata.media_type.like('image/%'))
         
         # Apply sorting
         if order == "id":
@@ -5566,9 +5850,9 @@ async def get_images_grid(
         elif order == "size":
             # Order by blob data length
             if direction == "asc":
-                media_query = media_query.order_by(func.length(MediaBlob.image_data).asc().nullslast())
+                media_query = media_query.order_by(size_expression.asc().nullslast())
             else:
-                media_query = media_query.order_by(func.length(MediaBlob.image_data).desc().nullslast())
+                media_query = media_query.order_by(size_expression.desc().nullslast())
         elif order == "date":
             if direction == "asc":
                 media_query = media_query.order_by(Email.date.asc().nullslast())
@@ -5579,32 +5863,25 @@ async def get_images_grid(
         total = media_query.count()
         
         # Get paginated results
-        media_items = media_query.offset(offset).limit(page_size).all()
+        rows = media_query.offset(offset).limit(page_size).all()
         
         # Build response
         image_list = []
-        for media_item in media_items:
-            # Get email from source_reference
-            email_id = int(media_item.source_reference)
-            email = session.query(Email).filter(Email.id == email_id).first()
+        for media_item, email, size in rows:
+            # Get content type
+            content_type = media_item.media_type or "application/octet-stream"
             
-            if email:
-                # Get content type and size
-                content_type = media_item.image_type or "application/octet-stream"
-                media_blob = session.query(MediaBlob).filter(MediaBlob.id == media_item.media_blob_id).first()
-                size = len(media_blob.image_data) if media_blob and media_blob.image_data else None
-                
-                image_list.append(AttachmentInfoResponse(
-                    attachment_id=media_item.id,
-                    filename=media_item.title or "attachment",
-                    content_type=content_type,
-                    size=size,
-                    email_id=email.id,
-                    email_subject=email.subject,
-                    email_from=email.from_address,
-                    email_date=email.date,
-                    email_folder=email.folder
-                ))
+            image_list.append(AttachmentInfoResponse(
+                attachment_id=media_item.id,
+                filename=media_item.title or "attachment",
+                content_type=content_type,
+                size=size,
+                email_id=email.id,
+                email_subject=email.subject,
+                email_from=email.from_address,
+                email_date=email.date,
+                email_folder=email.folder
+            ))
         
         total_pages = (total + page_size - 1) // page_size  # Ceiling division
         
@@ -5620,7 +5897,7 @@ async def get_images_grid(
 
 
 @app.get("/attachments/{attachment_id}/info", response_model=AttachmentInfoResponse)
-async def get_attachment_info(attachment_id: int):
+def get_attachment_info(attachment_id: int):
     """Get attachment information with email metadata.
     
     Args:
@@ -5646,9 +5923,8 @@ async def get_attachment_info(attachment_id: int):
                 detail=f"Attachment with ID {attachment_id} not found"
             )
         
-        # Get the email for this attachment (from source_reference)
-        email_id = int(media_item.source_reference)
-        email = session.query(Email).filter(Email.id == email_id).first()
+        # Get the email for this attachment
+        email = session.query(Email).filter(Email.id == media_item.email_id).first()
         
         if not email:
             raise HTTPException(
@@ -5675,7 +5951,7 @@ async def get_attachment_info(attachment_id: int):
 
 
 @app.delete("/attachments/{attachment_id}")
-async def delete_attachment(attachment_id: int):
+def delete_attachment(attachment_id: int):
     """Delete an attachment by ID (media_item_id).
     
     Deletes from unified MediaMetadata/MediaBlob tables.
@@ -5737,7 +6013,11 @@ async def delete_attachment(attachment_id: int):
 
 
 @app.get("/attachments/{attachment_id}")
-async def get_attachment_content(attachment_id: int, preview: bool = False):
+def get_attachment_content(
+    attachment_id: int,
+    preview: bool = False,
+    size: Optional[int] = Query(None, ge=1, description="If set, return the nearest display rendition (long edge in pixels) of an image attachment")
+):
     """Get attachment content by ID (media_item_id).
     
     Uses unified MediaMetadata/MediaBlob tables.
@@ -5745,6 +6025,8 @@ async def get_attachment_content(attachment_id: int, preview: bool = False):
     Args:
         attachment_id: The media_item ID of the attachment to retrieve
         preview: If True and attachment is an image, return thumbnail instead of full image
+        size: If set and the attachment is an image, return its nearest display
+              rendition (WebP or JPEG) instead of the full image
         
     Returns:
         Attachment file content with appropriate MIME type
@@ -5766,8 +6048,22 @@ async def get_attachment_content(attachment_id: int, preview: bool = False):
                 detail=f"Attachment with ID {attachment_id} not found"
             )
         
-        # Get the media blob
-        media_blob = session.query(MediaBlob).filter(
+        if size and not preview and media_item.media_blob_id and (media_item.media_type or "").startswith("image/"):
+            rendition = ImageService(db=db).get_rendition(media_item.media_blob_id, size, media_item.title or "attachment")
+            if rendition is not None:
+                safe_filename = rendition.filename.replace('"', '\\"')
+                return Response(
+                    content=rendition.content,
+                    media_type=rendition.content_type,
+                    headers={
+                        "Content-Disposition": f'inline; filename="{safe_filename}"'
+                    }
+                )
+        
+        # Get the media blob, loading only the content column this request returns
+        media_blob = session.query(MediaBlob).options(
+            undefer(MediaBlob.thumbnail_data) if preview else undefer(MediaBlob.image_data)
+        ).filter(
             MediaBlob.id == media_item.media_blob_id
         ).first()
         
@@ -5792,14 +6088,24 @@ async def get_attachment_content(attachment_id: int, preview: bool = False):
             base_name, ext = os.path.splitext(filename)
             safe_filename = f"{base_name}_thumb.jpg".replace('"', '\\"')
         else:
-            content = media_blob.image_data
+            filename = media_item.title or "attachment"
+            safe_filename = filename.replace('"', '\\"')
+            file_path = blob_file_path(media_blob.image_key) if media_blob.image_data is None else None
+            if file_path:
+                # Content is in the filesystem blob store; let the server send the file directly
+                return FileResponse(
+                    file_path,
+                    media_type=content_type,
+                    headers={
+                        "Content-Disposition": f'inline; filename="{safe_filename}"'
+                    }
+                )
+            content = get_media_blob_content(media_blob)
             if content is None:
                 raise HTTPException(
                     status_code=404,
                     detail=f"Attachment with ID {attachment_id} has no content"
                 )
-            filename = media_item.title or "attachment"
-            safe_filename = filename.replace('"', '\\"')
         
         headers = {
             "Content-Disposition": f'inline; filename="{safe_filename}"'
@@ -5815,7 +6121,7 @@ async def get_attachment_content(attachment_id: int, preview: bool = False):
 
 
 @app.get("/images/search", response_model=List[MediaMetadataResponse])
-async def search_images(
+def search_images(
     title: Optional[str] = Query(None, description="Filter by title (partial match, case-insensitive)"),
     description: Optional[str] = Query(None, description="Filter by description (partial match, case-insensitive)"),
     author: Optional[str] = Query(None, description="Filter by author (partial match, case-insensitive)"),
@@ -5905,26 +6211,23 @@ async def get_distinct_years():
     Returns:
         List of distinct years (integers) sorted in descending order
     """
-    session = db.get_session()
     try:
-        # Query distinct years from MediaMetadata where year is not null
-        years = session.query(func.distinct(MediaMetadata.year)).filter(
-            MediaMetadata.year.isnot(None)
-        ).order_by(
-            MediaMetadata.year.desc()
-        ).all()
-        
-        # Extract year values from tuples and return as list
-        year_list = [year[0] for year in years]
-        
-        return {"years": year_list}
+        async with async_db.get_session() as session:
+            # Query distinct years from MediaMetadata where year is not null
+            years = await session.scalars(
+                select(func.distinct(MediaMetadata.year)).where(
+                    MediaMetadata.year.isnot(None)
+                ).order_by(
+                    MediaMetadata.year.desc()
+                )
+            )
+            
+            return {"years": list(years)}
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error retrieving distinct years: {str(e)}"
         )
-    finally:
-        session.close()
 
 
 @app.get("/images/tags")
@@ -5937,21 +6240,23 @@ async def get_distinct_tags():
     Returns:
         List of distinct tags (strings) sorted alphabetically
     """
-    session = db.get_session()
     try:
-        # Query all tags from MediaMetadata where tags is not null
-        tag_records = session.query(MediaMetadata.tags).filter(
-            MediaMetadata.tags.isnot(None),
-            MediaMetadata.tags != ''
-        ).all()
-        
-        # Extract and split comma-separated tags
-        all_tags = set()
-        for record in tag_records:
-            if record[0]:
-                # Split by comma and clean up whitespace
-                tags = [tag.strip() for tag in record[0].split(',') if tag.strip()]
-                all_tags.update(tags)
+        async with async_db.get_session() as session:
+            # Query the distinct tag strings from MediaMetadata where tags is not null
+            tag_records = await session.scalars(
+                select(MediaMetadata.tags).where(
+                    MediaMetadata.tags.isnot(None),
+                    MediaMetadata.tags != ''
+                ).distinct()
+            )
+            
+            # Extract and split comma-separated tags
+            all_tags = set()
+            for record in tag_records:
+                if record:
+                    # Split by comma and clean up whitespace
+                    tags = [tag.strip() for tag in record.split(',') if tag.strip()]
+                    all_tags.update(tags)
         
         # Convert to sorted list
         tag_list = sorted(list(all_tags))
@@ -5962,8 +6267,6 @@ async def get_distinct_tags():
             status_code=500,
             detail=f"Error retrieving distinct tags: {str(e)}"
         )
-    finally:
-        session.close()
 
 
 @app.get("/getLocations")
@@ -5987,19 +6290,21 @@ async def get_locations():
         - source: Source of the media item (if available)
         - source_reference: Source reference (if available)
     """
-    session = db.get_session()
     try:
-        # Query media items with GPS data
-        # Filter by has_gps=True OR (latitude is not None AND longitude is not None)
-        media_items = session.query(MediaMetadata).filter(
-            or_(
-                MediaMetadata.has_gps == True,
-                and_(
-                    MediaMetadata.latitude.isnot(None),
-                    MediaMetadata.longitude.isnot(None)
+        async with async_db.get_session() as session:
+            # Query media items with GPS data
+            # Filter by has_gps=True OR (latitude is not None AND longitude is not None)
+            media_items = (await session.scalars(
+                select(MediaMetadata).where(
+                    or_(
+                        MediaMetadata.has_gps == True,
+                        and_(
+                            MediaMetadata.latitude.isnot(None),
+                            MediaMetadata.longitude.isnot(None)
+                        )
+                    )
                 )
-            )
-        ).all()
+            )).all()
         
         # Build response list
         locations = []
@@ -6029,16 +6334,15 @@ async def get_locations():
             status_code=500,
             detail=f"Error retrieving locations: {str(e)}"
         )
-    finally:
-        session.close()
 
 
 @app.get("/images/{image_id}")
-async def get_image_content(
+def get_image_content(
     image_id: int,
     type: str = Query("blob", regex="^(blob|metadata)$", description="Type of ID: 'blob' for media_blob.id or 'metadata' for media_items.id"),
     preview: bool = Query(False, description="If True, return thumbnail instead of full image"),
-    convert_heic_to_jpg: bool = Query(True, description="If True, convert HEIC images to JPG format before returning")
+    convert_heic_to_jpg: bool = Query(True, description="If True, convert HEIC images to JPG format before returning"),
+    size: Optional[int] = Query(None, ge=1, description="If set, return the nearest display rendition (long edge in pixels)")
 ):
     """Get image content by ID.
     
@@ -6047,6 +6351,8 @@ async def get_image_content(
         type: Type of ID - 'blob' for media_blob.id or 'metadata' for media_items.id (default: 'blob')
         preview: If True, return thumbnail instead of full image
         convert_heic_to_jpg: If True, convert HEIC images to JPG format before returning (default: True)
+        size: If set, return the nearest display rendition (WebP or JPEG, made on first
+              request) instead of the full image; e.g. 1600 for a lightbox
         
     Returns:
         Image binary data with appropriate content-type
@@ -6067,7 +6373,8 @@ async def get_image_content(
             image_id=image_id,
             id_type=type,
             preview=preview,
-            convert_heic=convert_heic_to_jpg
+            convert_heic=convert_heic_to_jpg,
+            size=size
         )       
         # Set Content-Disposition header
         safe_filename = image_content.filename.replace('"', '\\"')
@@ -6075,6 +6382,13 @@ async def get_image_content(
             "Content-Disposition": f'inline; filename="{safe_filename}"'
         }
         
+        if image_content.file_path:
+            return FileResponse(
+                image_content.file_path,
+                media_type=image_content.content_type,
+                headers=headers
+            )
+        
         return Response(
             content=image_content.content,
             media_type=image_content.content_type,
@@ -6092,7 +6406,7 @@ async def get_image_content(
 
 
 @app.put("/images/bulk-update")
-async def bulk_update_images(update_data: Dict[str, Any]):
+def bulk_update_images(update_data: Dict[str, Any]):
     """Bulk update multiple images with tags.
     
     Args:
@@ -6160,6 +6474,7 @@ def process_images_with_magick_background(result_dict: dict):
         "errors": 0,
         "error_messages": [],
         "current_image": None,
+        "images_per_second": 0.0,
         "status": "in_progress",
         "error_message": None
     })
@@ -6191,9 +6506,16 @@ def process_images_with_magick_background(result_dict: dict):
         images_created = 0
         images_updated = 0
         errors = []
+        process_images_service = ProcessImagesService()
+        batch_size = process_images_service.batch_size
+        
+        def record_error(error_msg: str):
+            errors.append(error_msg)
+            magick_processing_progress["errors"] += 1
+            magick_processing_progress["error_messages"].append(error_msg)
         
-        # Process each image
-        for idx, image_metadata in enumerate(images_metadata):
+        # Process the images a batch at a time on the image process pool
+        for start in range(0, len(images_metadata), batch_size):
             # Check for cancellation
             if magick_processing_cancelled.is_set():
                 magick_processing_progress["status"] = "cancelled"
@@ -6201,51 +6523,46 @@ def process_images_with_magick_background(result_dict: dict):
                 result_dict["message"] = "Processing was cancelled by user"
                 return
             
-            magick_processing_progress["current_image"] = f"Image {image_metadata.id}"
-            magick_processing_progress["images_processed"] = idx + 1
+            batch = images_metadata[start:start + batch_size]
+            magick_processing_progress["current_image"] = f"Image {batch[0].id}"
             
-            try:
-                image = image_service.storage.get_image_by_metadata_id(image_metadata.id)
+            blobs = []
+            for image_metadata in batch:
+                try:
+                    image = image_service.storage.get_image_by_metadata_id(image_metadata.id)
+                except Exception as e:
+                    image = None
+                    print(f"Error loading image {image_metadata.id}: {e}")
+                if not image:
+                    record_error(f"Image blob not found for metadata ID {image_metadata.id}")
+                blobs.append(image)
+            
+            results = process_images_service.create_thumbs_and_get_exif(
+                [get_media_blob_content(image) if image else None for image in blobs],
+                process_thumbnail=True, process_exif=False, width=200
+            )
+            
+            for image_metadata, image, (thumbnail_data, _) in zip(batch, blobs, results):
                 if not image:
-                    error_msg = f"Image blob not found for metadata ID {image_metadata.id}"
-                    errors.append(error_msg)
-                    magick_processing_progress["errors"] += 1
-                    magick_processing_progress["error_messages"].append(error_msg)
                     continue
-                
-                print(f"Processing image {image_metadata.id}. Description: {image_metadata.description} with Magick")
-                thumbnail_data = ImageService.create_thumbnail_from_bytes(image.image_data)
-                
-                if thumbnail_data:
-                    # Check if thumbnail already exists
-                    session = db.get_session()
-                    try:
-                        media_blob = session.query(MediaBlob).filter(MediaBlob.id == image_metadata.media_blob_id).first()
-                        if media_blob and media_blob.thumbnail_data:
+                try:
+                    if thumbnail_data:
+                        if image.thumbnail_data:
                             images_updated += 1
                         else:
                             images_created += 1
-                    finally:
-                        session.close()
-                    
-                    image_service.storage.update_image_thumbnail(image_id=image_metadata.id, thumbnail_data=thumbnail_data)
-                    images_processed += 1
-                    print(f"Done Processing image {image_metadata.id}. Description: {image_metadata.description} with Magick")
-                else:
-                    error_msg = f"Failed to create thumbnail for image {image_metadata.id}"
-                    errors.append(error_msg)
-                    magick_processing_progress["errors"] += 1
-                    magick_processing_progress["error_messages"].append(error_msg)
-                    
-            except Exception as e:
-                error_msg = f"Error processing image {image_metadata.id}: {str(e)}"
-                print(f"Error processing image {image_metadata.id}. Description: {image_metadata.description} with Magick: {e}")
-                errors.append(error_msg)
-                magick_processing_progress["errors"] += 1
-                magick_processing_progress["error_messages"].append(error_msg)
-                import traceback
-                traceback.print_exc()
-                continue
+                        image_service.storage.update_image_thumbnail(image_id=image_metadata.id, thumbnail_data=thumbnail_data)
+                        images_processed += 1
+                    else:
+                        record_error(f"Failed to create thumbnail for image {image_metadata.id}")
+                except Exception as e:
+                    print(f"Error processing image {image_metadata.id}. Description: {image_metadata.description}: {e}")
+                    record_error(f"Error processing image {image_metadata.id}: {str(e)}")
+            
+            magick_processing_progress["images_processed"] = min(start + batch_size, len(images_metadata))
+            magick_processing_progress["images_per_second"] = round(process_images_service.images_per_second(), 1)
+            print(f"Processed {magick_processing_progress['images_processed']}/{len(images_metadata)} images: "
+                  f"{process_images_service.throughput}")
         
         # Update final progress state
         magick_processing_progress["images_processed"] = images_processed
@@ -6258,6 +6575,7 @@ def process_images_with_magick_background(result_dict: dict):
         result_dict["images_processed"] = images_processed
         result_dict["images_created"] = images_created
         result_dict["images_updated"] = images_updated
+        result_dict["images_per_second"] = round(process_images_service.images_per_second(), 1)
         result_dict["errors"] = errors
         
     except Exception as e:
@@ -6274,7 +6592,7 @@ def process_images_with_magick_background(result_dict: dict):
 
 
 @app.post("/images/process-with-magick", response_model=ProcessImagesWithMagickResponse)
-async def process_images_with_magick(background_tasks: BackgroundTasks):
+def process_images_with_magick(background_tasks: BackgroundTasks):
     """Process unprocessed images with ImageMagick to create thumbnails (background task).
     
     Finds all images where processed=False and media_type starts with "image/",
@@ -6333,8 +6651,124 @@ async def process_images_with_magick(background_tasks: BackgroundTasks):
     )
 
 
+def warm_conversion_cache_background():
+    """Background function to convert stored HEIC/HEIF images into the conversion cache."""
+    global conversion_cache_warm_in_progress
+    
+    conversion_cache_warm_progress.update({
+        "images_found": 0,
+        "images_cached": 0,
+        "images_skipped": 0,
+        "errors": 0,
+        "bytes_written": 0,
+        "images_per_second": 0.0,
+        "stopped_at_budget": False,
+        "status": "in_progress",
+        "error_message": None
+    })
+    
+    try:
+        stats = ImageService(db=db).warm_conversion_cache(
+            progress_callback=conversion_cache_warm_progress.update,
+            cancelled=conversion_cache_warm_cancelled
+        )
+        conversion_cache_warm_progress.update(stats)
+        conversion_cache_warm_progress["status"] = "cancelled" if conversion_cache_warm_cancelled.is_set() else "completed"
+        print(f"Conversion cache warm-up {conversion_cache_warm_progress['status']}: "
+              f"{stats['images_cached']} image(s) converted, {stats['images_skipped']} already cached")
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        conversion_cache_warm_progress["status"] = "error"
+        conversion_cache_warm_progress["error_message"] = str(e)
+    finally:
+        with conversion_cache_warm_lock:
+            conversion_cache_warm_in_progress = False
+
+
+@app.post("/images/conversion-cache/warm")
+def warm_conversion_cache(background_tasks: BackgroundTasks):
+    """Convert all stored HEIC/HEIF images to JPEG into the conversion cache (background task).
+    
+    Full-size requests for these images are then served from the cache instead
+    of being converted on the fly. Images already cached are skipped.
+    
+    Args:
+        background_tasks: FastAPI background tasks
+        
+    Returns:
+        Success message and the current cache statistics
+        
+    Raises:
+        HTTPException: 400 if the warm-up is already in progress or the cache is disabled
+    """
+    global conversion_cache_warm_in_progress
+    
+    conversion_cache = get_conversion_cache()
+    if not conversion_cache.enabled:
+        raise HTTPException(
+            status_code=400,
+            detail="The conversion cache is disabled (CONVERSION_CACHE_MAX_BYTES=0)"
+        )
+    
+    with conversion_cache_warm_lock:
+        if conversion_cache_warm_in_progress:
+            raise HTTPException(
+                status_code=400,
+                detail="Conversion cache warm-up is already in progress"
+            )
+        conversion_cache_warm_in_progress = True
+        conversion_cache_warm_cancelled.clear()
+    
+    background_tasks.add_task(warm_conversion_cache_background)
+    
+    return {
+        "success": True,
+        "message": "Conversion cache warm-up started",
+        "cache": conversion_cache.stats()
+    }
+
+
+@app.post("/images/conversion-cache/warm/cancel")
+def cancel_conversion_cache_warm():
+    """Cancel the conversion cache warm-up if it is in progress.
+    
+    Returns:
+        Success message indicating cancellation status
+    """
+    with conversion_cache_warm_lock:
+        if not conversion_cache_warm_in_progress:
+            return {
+                "message": "No conversion cache warm-up is currently in progress",
+                "cancelled": False
+            }
+        
+        conversion_cache_warm_cancelled.set()
+        
+        return {
+            "message": "Conversion cache warm-up cancellation requested. It will stop after the current batch completes.",
+            "cancelled": True
+        }
+
+
+@app.get("/images/conversion-cache/status")
+def get_conversion_cache_status():
+    """Get the conversion cache statistics and the status of its warm-up.
+    
+    Returns:
+        Warm-up progress, plus cache entries, total_bytes and max_bytes under "cache"
+    """
+    with conversion_cache_warm_lock:
+        return {
+            "in_progress": conversion_cache_warm_in_progress,
+            "cancelled": conversion_cache_warm_cancelled.is_set(),
+            **conversion_cache_warm_progress,
+            "cache": get_conversion_cache().stats()
+        }
+
+
 @app.get("/images/{image_id}/metadata", response_model=MediaMetadataResponse)
-async def get_image_metadata(image_id: int):
+def get_image_metadata(image_id: int):
     """Get image metadata by ID.
     
     Args:
@@ -6395,7 +6829,7 @@ async def get_image_metadata(image_id: int):
 
 
 @app.put("/images/{image_id}")
-async def update_image_metadata(image_id: int, update_data: Dict[str, Any]):
+def update_image_metadata(image_id: int, update_data: Dict[str, Any]):
     """Update image metadata fields.
     
     Args:
@@ -6443,7 +6877,7 @@ async def update_image_metadata(image_id: int, update_data: Dict[str, Any]):
 
 
 @app.delete("/images/bulk-delete")
-async def bulk_delete_images(delete_data: Dict[str, Any]):
+def bulk_delete_images(delete_data: Dict[str, Any]):
     """Bulk delete multiple images by their metadata IDs.
     
     Args:
@@ -6480,7 +6914,7 @@ async def bulk_delete_images(delete_data: Dict[str, Any]):
 
 
 @app.delete("/images/{image_id}")
-async def delete_image(image_id: int):
+def delete_image(image_id: int):
     """Delete an image by metadata ID.
     
     Args:
@@ -6511,7 +6945,7 @@ async def delete_image(image_id: int):
 
 
 @app.delete("/images")
-async def delete_images(
+def delete_images(
     all: bool = Query(False, description="If True, delete all images"),
     start_id: Optional[int] = Query(None, description="Start of ID range (inclusive)"),
     end_id: Optional[int] = Query(None, description="End of ID range (inclusive)")
@@ -6556,8 +6990,9 @@ async def delete_images(
                     detail="No images found to delete"
                 )
             
-            # Delete all metadata records (cascade will delete blobs)
+            # Delete all metadata records, then the blobs nothing references any more
             deleted_count = query.delete(synchronize_session=False)
+            delete_unreferenced_media_blobs(session)
             session.commit()
             
             return {
@@ -6591,16 +7026,16 @@ async def delete_images(
                     detail="No images found in the specified range"
                 )
             
-            # Delete metadata records (cascade will delete blobs)
-            # Need to load relationships for cascade to work properly
+            # Delete metadata records, then any of their blobs that are no longer shared
             metadata_records = query.all()
+            blob_ids = []
             deleted_count = 0
             for metadata in metadata_records:
-                # Load the relationship to ensure cascade works
-                _ = metadata.image_blob
+                blob_ids.append(metadata.media_blob_id)
                 session.delete(metadata)
                 deleted_count += 1
             
+            delete_unreferenced_media_blobs(session, blob_ids)
             session.commit()
             
             return {
@@ -6623,7 +7058,7 @@ async def delete_images(
 
 
 @app.get("/attachments-viewer", response_class=HTMLResponse)
-async def attachments_viewer(request: Request):
+def attachments_viewer(request: Request):
     """Serve the attachment viewer web page."""
     return templates.TemplateResponse(
         "attachments_viewer.html",
@@ -6632,7 +7067,7 @@ async def attachments_viewer(request: Request):
 
 
 @app.get("/attachments-images-grid", response_class=HTMLResponse)
-async def images_grid_viewer(request: Request):
+def images_grid_viewer(request: Request):
     """Serve the image grid viewer web page."""
     return templates.TemplateResponse(
         "images_grid.html",
@@ -6643,7 +7078,7 @@ async def images_grid_viewer(request: Request):
 # Reference Documents API Endpoints
 
 @app.get("/reference-documents", response_model=List[ReferenceDocumentResponse])
-async def get_reference_documents(
+def get_reference_documents(
     search: Optional[str] = Query(None, description="Search in filename, title, description, author"),
     category: Optional[str] = Query(None, description="Filter by category"),
     tag: Optional[str] = Query(None, description="Filter by tag"),
@@ -6729,7 +7164,7 @@ async def get_reference_documents(
 
 
 @app.get("/reference-documents/{document_id}", response_model=ReferenceDocumentResponse)
-async def get_reference_document(document_id: int):
+def get_reference_document(document_id: int):
     """Get reference document metadata by ID.
     
     Args:
@@ -6771,7 +7206,7 @@ async def get_reference_document(document_id: int):
 
 
 @app.get("/reference-documents/{document_id}/download")
-async def download_reference_document(document_id: int):
+def download_reference_document(document_id: int):
     """Download/view reference document file.
     
     Args:
@@ -6795,7 +7230,7 @@ async def download_reference_document(document_id: int):
             detail=f"Reference document with ID {document_id} not found"
         )
     
-    if not document.data:
+    if not document.data and not document.data_key:
         raise HTTPException(
             status_code=404,
             detail=f"Reference document with ID {document_id} has no file data"
@@ -6804,8 +7239,18 @@ async def download_reference_document(document_id: int):
     filename = document.filename or "document"
     safe_filename = filename.replace('"', '\\"')
     
+    file_path = blob_file_path(document.data_key) if document.data is None else None
+    if file_path:
+        return FileResponse(
+            file_path,
+            media_type=document.content_type or "application/octet-stream",
+            headers={
+                "Content-Disposition": f'inline; filename="{safe_filename}"'
+            }
+        )
+    
     return Response(
-        content=document.data,
+        content=read_blob(document.data, document.data_key),
         media_type=document.content_type or "application/octet-stream",
         headers={
             "Content-Disposition": f'inline; filename="{safe_filename}"'
@@ -6870,7 +7315,8 @@ async def create_reference_document(
         )
         
         # Create document
-        document = doc_service.create_document(file_data, metadata)
+        # Writing the content (and its blob file) blocks, so keep it off the event loop
+        document = await run_in_threadpool(doc_service.create_document, file_data, metadata)
         
         # Convert to response model
         return ReferenceDocumentResponse(**doc_service.to_response_model(document))
@@ -6883,7 +7329,7 @@ async def create_reference_document(
 
 
 @app.put("/reference-documents/{document_id}", response_model=ReferenceDocumentResponse)
-async def update_reference_document(
+def update_reference_document(
     document_id: int,
     update_data: ReferenceDocumentUpdateRequest
 ):
@@ -6927,7 +7373,7 @@ async def update_reference_document(
 
 
 @app.delete("/reference-documents/{document_id}")
-async def delete_reference_document(document_id: int):
+def delete_reference_document(document_id: int):
     """Delete a reference document.
     
     Args:
@@ -6963,7 +7409,7 @@ async def delete_reference_document(document_id: int):
 
 
 @app.delete("/admin/empty-media-tables")
-async def empty_media_tables():
+def empty_media_tables():
     """Empty the attachments, media_blob, media_items, messages, and message_attachments tables.
     
     WARNING: This permanently deletes all data from these tables.
@@ -7085,7 +7531,7 @@ def extract_places_from_data(data, places_list):
 
 
 @app.post("/facebook/import-places", response_model=ImportFacebookPlacesResponse)
-async def import_facebook_places(request: ImportFacebookPlacesRequest):
+def import_facebook_places(request: ImportFacebookPlacesRequest):
     """Import places from a Facebook posts JSON file.
     
     Extracts all 'place' elements from the JSON file and stores them in the database
@@ -7240,7 +7686,7 @@ async def import_facebook_places(request: ImportFacebookPlacesRequest):
 
 
 @app.get("/facebook/places", response_model=FacebookPlacesListResponse)
-async def get_facebook_places(
+def get_facebook_places(
     name: Optional[str] = Query(None, description="Filter by place name (partial match, case-insensitive)"),
     region: Optional[str] = Query(None, description="Filter by region (partial match, case-insensitive)"),
     limit: Optional[int] = Query(100, description="Maximum number of places to return", ge=1, le=1000),
@@ -7428,7 +7874,7 @@ class RelationshipsListResponse(BaseModel):
 
 
 @app.post("/relationships/create-contacts-from-chat-sessions", response_model=CreateContactsFromChatSessionsResponse)
-async def create_contacts_from_chat_sessions():
+def create_contacts_from_chat_sessions():
     """Create contact entries from distinct combinations of chat_session and service values in the messages table.
     
     This endpoint:
@@ -7472,7 +7918,7 @@ async def create_contacts_from_chat_sessions():
 
 
 @app.post("/relationships/create-contacts-from-emails", response_model=CreateContactsFromEmailsResponse)
-async def create_contacts_from_emails():
+def create_contacts_from_emails():
     """Create contact entries from distinct email addresses in the emails table.
     
     This endpoint:
@@ -7510,7 +7956,7 @@ async def create_contacts_from_emails():
 
 
 @app.get("/relationships", response_model=RelationshipsListResponse)
-async def get_relationships(
+def get_relationships(
     source_id: Optional[int] = Query(None, description="Filter by source contact ID"),
     target_id: Optional[int] = Query(None, description="Filter by target contact ID"),
     contact_id: Optional[int] = Query(None, description="Filter by contact ID (as source or target)"),
@@ -7624,7 +8070,7 @@ async def get_relationships(
 
 
 @app.get("/contacts", response_model=ContactsListResponse)
-async def get_contacts(
+def get_contacts(
     name: Optional[str] = Query(None, description="Filter by name (partial match, case-insensitive)"),
     email: Optional[str] = Query(None, description="Filter by email (partial match, case-insensitive)"),
     is_subject: Optional[bool] = Query(None, description="Filter by is_subject flag"),
@@ -7820,7 +8266,7 @@ ORDER BY A.id;"""
         session.close()
 
 @app.get("/merge-contacts", response_model=MergeContactsResponse)
-async def merge_contacts():
+def merge_contacts():
     """Merge likely matching contacts.
     
     Returns:
@@ -2,6 +2,8 @@ let currentAttachmentId = null;
 let currentOffset = 0;
 let currentOrder = 'random';
 const API_BASE = window.location.origin;
+// Long edge of the display rendition loaded instead of the original
+const DISPLAY_IMAGE_SIZE = 1600;
 
 async function loadAttachment(maxAttempts = 50) {
     try {
@@ -128,7 +130,7 @@ async function loadAttachment(maxAttempts = 50) {
             
             if (isImage) {
                 const img = document.createElement('img');
-                img.src = `${API_BASE}/attachments/${data.attachment_id}`;
+                img.src = `${API_BASE}/attachments/${data.attachment_id}?size=${DISPLAY_IMAGE_SIZE}`;
                 img.alt = data.filename || 'Attachment preview';
                 img.onerror = function() {
                     previewContainer.innerHTML = '<p style="color: #666;">Image not available</p>';
@@ -4,6 +4,8 @@ let totalPages = 1;
 let currentSortOrder = 'id';
 let currentSortDirection = 'asc';
 const API_BASE = window.location.origin;
+// Long edge of the display rendition the modal loads instead of the original
+const DISPLAY_IMAGE_SIZE = 1600;
 const selectedImages = new Set();
 
 async function loadImages(page) {
@@ -464,7 +466,7 @@ function showFullImage(imageId) {
                 // Show image normally
                 modalPdf.style.display = 'none';
                 modalImg.style.display = 'block';
-                modalImg.src = `${API_BASE}/attachments/${imageId}`;
+                modalImg.src = `${API_BASE}/attachments/${imageId}?size=${DISPLAY_IMAGE_SIZE}`;
             }
         })
         .catch(error => {
@@ -472,7 +474,7 @@ function showFullImage(imageId) {
             // Fallback: try as image
             modalImg.style.display = 'block';
             modalPdf.style.display = 'none';
-            modalImg.src = `${API_BASE}/attachments/${imageId}`;
+            modalImg.src = `${API_BASE}/attachments/${imageId}?size=${DISPLAY_IMAGE_SIZE}`;
         });
 }
 
@@ -33,6 +33,8 @@ document.addEventListener('DOMContentLoaded', () => {
             'dave_sm': 'dave_sm.png', 'irish_sm': 'irish_sm.png', 'haiku_sm': 'haiku_sm.png',
             'insult_sm': 'insult_sm.png', 'earthchild_sm': 'earthchild_sm.png',
         },
+        // Long edge of the display rendition lightbox and map views load instead of the original
+        DISPLAY_IMAGE_SIZE: 1600,
         // FUNCTION_NAMES: Object.freeze({
         //     FirstFunction: "testFunction",
         //     SecondFunction: "showFBMessengerOptions",
@@ -2113,7 +2115,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     } catch (error) {
                         console.error('Error fetching image metadata:', error);
                         // Fallback to basic display if fetch fails
-                        const imageUrl = `/images/${item.id}?type=metadata`;
+                        const imageUrl = `/images/${item.id}?type=metadata&size=${CONSTANTS.DISPLAY_IMAGE_SIZE}`;
                         const filename = item.title || item.source_reference || `Image ${item.id}`;
                         Modals.SingleImageDisplay.showSingleImageModal(
                             filename,
@@ -3214,7 +3216,7 @@ ${textContent}
                 if (isImage) {
                     // Show image in image modal
                     if (DOM.emailAttachmentImageDisplay && DOM.emailAttachmentImageModal) {
-                        DOM.emailAttachmentImageDisplay.src = `/attachments/${attachmentId}`;
+                        DOM.emailAttachmentImageDisplay.src = `/attachments/${attachmentId}?size=${CONSTANTS.DISPLAY_IMAGE_SIZE}`;
                         DOM.emailAttachmentImageDisplay.alt = attachmentInfo.filename || 'Attachment';
                         DOM.emailAttachmentImageModal.style.display = 'flex';
                     }
@@ -5135,7 +5137,7 @@ ${textContent}
                 };
                 
                 // Set image source
-                DOM.newImageGalleryDetailImage.src = `/images/${image.id}?type=metadata&convert_heic_to_jpg=true`;
+                DOM.newImageGalleryDetailImage.src = `/images/${image.id}?type=metadata&convert_heic_to_jpg=true&size=${CONSTANTS.DISPLAY_IMAGE_SIZE}`;
                 DOM.newImageGalleryDetailImage.alt = image.title || 'Image';
                 
                 // Show delete and save buttons
@@ -2,7 +2,7 @@
 
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 from dataclasses import dataclass
 
 try:
@@ -64,17 +64,87 @@ class DatabaseConfig:
     name: str
     user: str
     password: str
+    pool_size: int = 10  # Connections kept open in the shared pool
+    max_overflow: int = 20  # Extra connections allowed beyond pool_size under load
+    pool_recycle: int = 3600  # Recycle connections after this many seconds
+    pool_timeout: int = 30  # Seconds to wait for a free connection
 
     @property
     def connection_string(self) -> str:
         """Get SQLAlchemy connection string."""
         return f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.name}"
 
+    @property
+    def async_connection_string(self) -> str:
+        """Get SQLAlchemy connection string for the asyncpg driver."""
+        return f"postgresql+asyncpg://{self.user}:{self.password}@{self.host}:{self.port}/{self.name}"
+
 @dataclass
 class AttachmentConfig:
     """Attachment filtering configuration."""
     allowed_types: Optional[list] = None  # List of allowed file extensions or MIME types
     min_size: int = 0  # Minimum size in bytes (0 = no minimum)
+    lazy_download: bool = False  # Store attachment metadata with the email and download bodies afterwards
+
+
+@dataclass
+class ImportConfig:
+    """Bulk import configuration."""
+    message_batch_size: int = 2000  # Messages written per transaction by the message importers
+    message_batch_max_bytes: int = 256 * 1024 * 1024  # Flush a batch early once its attachments reach this size
+
+
+@dataclass
+class BlobStoreConfig:
+    """Blob store configuration for media, attachment and reference document content."""
+    backend: str = "database"  # "database" keeps content in bytea columns, "filesystem" writes it to path
+    path: str = "blobstore"  # Root directory of the filesystem backend
+
+
+@dataclass
+class GmailConfig:
+    """Gmail retrieval configuration."""
+    batch_size: int = 50  # Messages per Gmail batch request (1 = one request per message)
+    batches_in_flight: int = 2  # Batches fetched concurrently ahead of the one being stored
+
+
+@dataclass
+class EmailBodyConfig:
+    """Storage configuration for email bodies."""
+    compression: str = "none"  # "none", "zlib" or "zstd" (see database/bodycodec.py)
+    level: Optional[int] = None  # Compression level; None uses the codec's default
+
+
+@dataclass
+class IngestConfig:
+    """Email ingest pipeline configuration."""
+    cpu_workers: int = os.cpu_count() or 1  # Processes building thumbnails and extracting EXIF data (0 = in a thread)
+    queue_size: int = 100  # Emails buffered between pipeline stages
+    write_batch_size: int = 25  # Emails written per database transaction
+    concurrent_labels: int = 1  # Labels processed at the same time by a processing request
+
+
+@dataclass
+class ImageProcessingConfig:
+    """Thumbnail and EXIF processing configuration."""
+    backend: str = "pillow"  # "pillow" (in process) or "magick" (ImageMagick subprocess per image)
+    batch_size: int = 32  # Images handed to the process pool at a time
+    rendition_sizes: Tuple[int, ...] = (64, 200, 800, 1600)  # Long edge of the display renditions, in pixels
+    rendition_format: str = "webp"  # "webp" or "jpeg"
+    rendition_quality: int = 80  # Encoder quality of the renditions (1-100)
+
+
+@dataclass
+class ConversionCacheConfig:
+    """Disk cache of HEIC/HEIF-to-JPEG conversions."""
+    path: str = "conversion_cache"  # Cache directory
+    max_bytes: int = 2 * 1024 * 1024 * 1024  # Size budget; least recently used entries are evicted beyond it (0 disables)
+
+
+@dataclass
+class ApiConfig:
+    """API server configuration."""
+    threadpool_size: int = 40  # Worker threads for sync endpoints and other blocking work
 
 
 class Config:
@@ -84,6 +154,14 @@ class Config:
         """Load configuration from environment variables."""
         self.db = self._load_database_config()
         self.attachments = self._load_attachment_config()
+        self.imports = self._load_import_config()
+        self.blob_store = self._load_blob_store_config()
+        self.api = self._load_api_config()
+        self.gmail = self._load_gmail_config()
+        self.ingest = self._load_ingest_config()
+        self.email_bodies = self._load_email_body_config()
+        self.image_processing = self._load_image_processing_config()
+        self.conversion_cache = self._load_conversion_cache_config()
 
     def _load_database_config(self) -> DatabaseConfig:
         """Load database configuration from environment."""
@@ -104,12 +182,29 @@ class Config:
         except ValueError:
             raise ValueError(f"DB_PORT must be an integer, got: {port}")
 
+        pool_settings = {}
+        for env_name, field_name, default, minimum in (
+            ("DB_POOL_SIZE", "pool_size", "10", 1),
+            ("DB_MAX_OVERFLOW", "max_overflow", "20", 0),
+            ("DB_POOL_RECYCLE", "pool_recycle", "3600", -1),
+            ("DB_POOL_TIMEOUT", "pool_timeout", "30", 1),
+        ):
+            value_str = os.getenv(env_name, default).strip()
+            try:
+                value = int(value_str)
+                if value < minimum:
+                    raise ValueError(f"{env_name} must be at least {minimum}")
+            except ValueError:
+                raise ValueError(f"{env_name} must be an integer of at least {minimum}, got: {value_str}")
+            pool_settings[field_name] = value
+
         return DatabaseConfig(
             host=host,
             port=port_int,
             name=name,
             user=user,
             password=password,
+            **pool_settings,
         )
 
     def _load_attachment_config(self) -> AttachmentConfig:
@@ -132,11 +227,195 @@ class Config:
         except ValueError:
             raise ValueError(f"ATTACHMENT_MIN_SIZE must be an integer, got: {min_size_str}")
 
+        lazy_download = os.getenv("ATTACHMENT_LAZY_DOWNLOAD", "false").strip().lower() == "true"
+
         return AttachmentConfig(
             allowed_types=allowed_types,
             min_size=min_size,
+            lazy_download=lazy_download,
+        )
+
+    def _load_import_config(self) -> ImportConfig:
+        """Load bulk import configuration from environment."""
+        batch_size_str = os.getenv("IMPORT_MESSAGE_BATCH_SIZE", "2000").strip()
+        try:
+            batch_size = int(batch_size_str)
+            if batch_size < 1:
+                raise ValueError("IMPORT_MESSAGE_BATCH_SIZE must be positive")
+        except ValueError:
+            raise ValueError(f"IMPORT_MESSAGE_BATCH_SIZE must be a positive integer, got: {batch_size_str}")
+
+        max_bytes_str = os.getenv("IMPORT_MESSAGE_BATCH_MAX_BYTES", str(256 * 1024 * 1024)).strip()
+        try:
+            max_bytes = int(max_bytes_str)
+            if max_bytes < 1:
+                raise ValueError("IMPORT_MESSAGE_BATCH_MAX_BYTES must be positive")
+        except ValueError:
+            raise ValueError(f"IMPORT_MESSAGE_BATCH_MAX_BYTES must be a positive integer, got: {max_bytes_str}")
+
+        return ImportConfig(
+            message_batch_size=batch_size,
+            message_batch_max_bytes=max_bytes,
+        )
+
+    def _load_blob_store_config(self) -> BlobStoreConfig:
+        """Load blob store configuration from environment."""
+        backend = os.getenv("BLOB_STORE_BACKEND", "database").strip().lower()
+        if backend not in ("database", "filesystem"):
+            raise ValueError(f"BLOB_STORE_BACKEND must be 'database' or 'filesystem', got: {backend}")
+
+        path = os.getenv("BLOB_STORE_PATH", "blobstore").strip()
+        if not path:
+            raise ValueError("BLOB_STORE_PATH must not be empty")
+
+        return BlobStoreConfig(
+            backend=backend,
+            path=str(Path(path).expanduser()),
         )
 
+    def _load_api_config(self) -> ApiConfig:
+        """Load API server configuration from environment."""
+        threadpool_size_str = os.getenv("API_THREADPOOL_SIZE", "40").strip()
+        try:
+            threadpool_size = int(threadpool_size_str)
+            if threadpool_size < 1:
+                raise ValueError("API_THREADPOOL_SIZE must be positive")
+        except ValueError:
+            raise ValueError(f"API_THREADPOOL_SIZE must be a positive integer, got: {threadpool_size_str}")
+
+        return ApiConfig(threadpool_size=threadpool_size)
+
+    def _load_gmail_config(self) -> GmailConfig:
+        """Load Gmail retrieval configuration from environment."""
+        batch_size_str = os.getenv("GMAIL_BATCH_SIZE", "50").strip()
+        try:
+            batch_size = int(batch_size_str)
+            # Gmail accepts at most 100 calls per batch request
+            if batch_size < 1 or batch_size > 100:
+                raise ValueError("GMAIL_BATCH_SIZE must be between 1 and 100")
+        except ValueError:
+            raise ValueError(f"GMAIL_BATCH_SIZE must be an integer between 1 and 100, got: {batch_size_str}")
+
+        in_flight_str = os.getenv("GMAIL_BATCHES_IN_FLIGHT", "2").strip()
+        try:
+            batches_in_flight = int(in_flight_str)
+            if batches_in_flight < 1:
+                raise ValueError("GMAIL_BATCHES_IN_FLIGHT must be positive")
+        except ValueError:
+            raise ValueError(f"GMAIL_BATCHES_IN_FLIGHT must be a positive integer, got: {in_flight_str}")
+
+        return GmailConfig(
+            batch_size=batch_size,
+            batches_in_flight=batches_in_flight,
+        )
+
+    def _load_ingest_config(self) -> IngestConfig:
+        """Load email ingest pipeline configuration from environment."""
+        workers_str = os.getenv("INGEST_CPU_WORKERS", str(os.cpu_count() or 1)).strip()
+        try:
+            cpu_workers = int(workers_str)
+            if cpu_workers < 0:
+                raise ValueError("INGEST_CPU_WORKERS must not be negative")
+        except ValueError:
+            raise ValueError(f"INGEST_CPU_WORKERS must be a non-negative integer, got: {workers_str}")
+
+        positive = {}
+        for name, default in (
+            ("INGEST_QUEUE_SIZE", "100"),
+            ("INGEST_WRITE_BATCH_SIZE", "25"),
+            ("INGEST_CONCURRENT_LABELS", "1"),
+        ):
+            value_str = os.getenv(name, default).strip()
+            try:
+                positive[name] = int(value_str)
+                if positive[name] < 1:
+                    raise ValueError(f"{name} must be positive")
+            except ValueError:
+                raise ValueError(f"{name} must be a positive integer, got: {value_str}")
+
+        return IngestConfig(
+            cpu_workers=cpu_workers,
+            queue_size=positive["INGEST_QUEUE_SIZE"],
+            write_batch_size=positive["INGEST_WRITE_BATCH_SIZE"],
+            concurrent_labels=positive["INGEST_CONCURRENT_LABELS"],
+        )
+
+    def _load_email_body_config(self) -> EmailBodyConfig:
+        """Load email body storage configuration from environment."""
+        compression = os.getenv("EMAIL_BODY_COMPRESSION", "none").strip().lower()
+        if compression not in ("none", "zlib", "zstd"):
+            raise ValueError(f"EMAIL_BODY_COMPRESSION must be 'none', 'zlib' or 'zstd', got: {compression}")
+
+        level = None
+        level_str = os.getenv("EMAIL_BODY_COMPRESSION_LEVEL", "").strip()
+        if level_str:
+            try:
+                level = int(level_str)
+            except ValueError:
+                raise ValueError(f"EMAIL_BODY_COMPRESSION_LEVEL must be an integer, got: {level_str}")
+
+        return EmailBodyConfig(compression=compression, level=level)
+
+    def _load_image_processing_config(self) -> ImageProcessingConfig:
+        """Load thumbnail and EXIF processing configuration from environment."""
+        backend = os.getenv("IMAGE_PROCESSING_BACKEND", "pillow").strip().lower()
+        if backend not in ("pillow", "magick"):
+            raise ValueError(f"IMAGE_PROCESSING_BACKEND must be 'pillow' or 'magick', got: {backend}")
+
+        batch_size_str = os.getenv("IMAGE_PROCESSING_BATCH_SIZE", "32").strip()
+        try:
+            batch_size = int(batch_size_str)
+            if batch_size < 1:
+                raise ValueError("IMAGE_PROCESSING_BATCH_SIZE must be positive")
+        except ValueError:
+            raise ValueError(f"IMAGE_PROCESSING_BATCH_SIZE must be a positive integer, got: {batch_size_str}")
+
+        sizes_str = os.getenv("IMAGE_RENDITION_SIZES", "64,200,800,1600").strip()
+        try:
+            rendition_sizes = tuple(sorted({int(size) for size in sizes_str.split(",") if size.strip()}))
+            if not rendition_sizes or rendition_sizes[0] < 1:
+                raise ValueError("IMAGE_RENDITION_SIZES must list positive sizes")
+        except ValueError:
+            raise ValueError(f"IMAGE_RENDITION_SIZES must be a comma-separated list of positive integers, got: {sizes_str}")
+
+        rendition_format = os.getenv("IMAGE_RENDITION_FORMAT", "webp").strip().lower()
+        if rendition_format == "jpg":
+            rendition_format = "jpeg"
+        if rendition_format not in ("webp", "jpeg"):
+            raise ValueError(f"IMAGE_RENDITION_FORMAT must be 'webp' or 'jpeg', got: {rendition_format}")
+
+        quality_str = os.getenv("IMAGE_RENDITION_QUALITY", "80").strip()
+        try:
+            rendition_quality = int(quality_str)
+            if not 1 <= rendition_quality <= 100:
+                raise ValueError("IMAGE_RENDITION_QUALITY must be between 1 and 100")
+        except ValueError:
+            raise ValueError(f"IMAGE_RENDITION_QUALITY must be an integer between 1 and 100, got: {quality_str}")
+
+        return ImageProcessingConfig(
+            backend=backend,
+            batch_size=batch_size,
+            rendition_sizes=rendition_sizes,
+            rendition_format=rendition_format,
+            rendition_quality=rendition_quality,
+        )
+
+    def _load_conversion_cache_config(self) -> ConversionCacheConfig:
+        """Load conversion cache configuration from environment."""
+        path = os.getenv("CONVERSION_CACHE_PATH", "conversion_cache").strip()
+        if not path:
+            raise ValueError("CONVERSION_CACHE_PATH must not be empty")
+
+        max_bytes_str = os.getenv("CONVERSION_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)).strip()
+        try:
+            max_bytes = int(max_bytes_str)
+            if max_bytes < 0:
+                raise ValueError("CONVERSION_CACHE_MAX_BYTES must not be negative")
+        except ValueError:
+            raise ValueError(f"CONVERSION_CACHE_MAX_BYTES must be a non-negative integer, got: {max_bytes_str}")
+
+        return ConversionCacheConfig(path=str(Path(path).expanduser()), max_bytes=max_bytes)
+
     def get_control_defaults(self) -> dict:
         """Get default values for control tab inputs from environment variables."""
         return {
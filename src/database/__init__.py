@@ -1,7 +1,7 @@
 """Database package."""
 
 from .models import Email, Attachment, IMessage, FacebookAlbum, ReferenceDocument, Base
-from .connection import Database
+from .connection import Database, AsyncDatabase, get_database, get_async_database, get_engine_stats
 from .storage import EmailStorage, FacebookAlbumStorage
 
-__all__ = ["Email", "Attachment", "IMessage", "FacebookAlbum", "ReferenceDocument", "Base", "Database", "EmailStorage", "FacebookAlbumStorage"]
+__all__ = ["Email", "Attachment", "IMessage", "FacebookAlbum", "ReferenceDocument", "Base", "Database", "AsyncDatabase", "get_database", "get_async_database", "get_engine_stats", "EmailStorage", "FacebookAlbumStorage"]
@@ -0,0 +1,201 @@
+"""Blob stores for media, attachment and reference document content.
+
+With the database backend, content stays in the bytea columns as before. With the
+filesystem backend, content is written once to a sharded, content-addressed
+directory tree and the row only keeps the key (the SHA-256 hex digest). Rows
+written under either backend stay readable after switching, so existing data can
+be moved out gradually with migrate_blobs_to_store.py.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import Optional, Iterator
+
+from ..config import Config, get_config
+
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_TEMP_PREFIX = ".tmp-"
+
+
+class BlobStore:
+    """Interface for where binary content is kept."""
+
+    # True when put() moves content out of the row and returns a key
+    external = False
+
+    def put(self, data: bytes, key: Optional[str] = None) -> Optional[str]:
+        """Store content.
+
+        Args:
+            data: Content to store
+            key: SHA-256 hex digest of data, if the caller already computed it
+
+        Returns:
+            Key to keep in the row, or None if the row should keep the content itself
+        """
+        raise NotImplementedError
+
+    def get(self, key: str) -> bytes:
+        """Read the content stored under key."""
+        raise NotImplementedError
+
+    def path(self, key: str) -> Optional[str]:
+        """Get a local file path for key, for zero-copy responses, or None if there is none."""
+        return None
+
+    def exists(self, key: str) -> bool:
+        """Check whether content is stored under key."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Remove the content stored under key, if any."""
+        raise NotImplementedError
+
+    def keys(self) -> Iterator[str]:
+        """Iterate over all stored keys."""
+        raise NotImplementedError
+
+
+class FilesystemBlobStore(BlobStore):
+    """Content-addressed store on the local filesystem.
+
+    Files are named by their SHA-256 digest and sharded two levels deep
+    (ab/cd/abcd...), so identical content is only written once. Writes go to a
+    temporary file in the target directory which is fsynced and renamed into
+    place, so readers never see a partially written file.
+    """
+
+    external = True
+
+    def __init__(self, root: str):
+        """Initialize the store rooted at the given directory."""
+        self.root = os.path.abspath(root)
+
+    def _file_path(self, key: str) -> str:
+        if not _KEY_PATTERN.match(key or ""):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[0:2], key[2:4], key)
+
+    def put(self, data: bytes, key: Optional[str] = None) -> Optional[str]:
+        if key is None:
+            key = hashlib.sha256(data).hexdigest()
+        destination = self._file_path(key)
+        if os.path.exists(destination):
+            return key
+
+        directory = os.path.dirname(destination)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=_TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, destination)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        return key
+
+    def get(self, key: str) -> bytes:
+        with open(self._file_path(key), "rb") as f:
+            return f.read()
+
+    def path(self, key: str) -> Optional[str]:
+        file_path = self._file_path(key)
+        return file_path if os.path.isfile(file_path) else None
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._file_path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._file_path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self) -> Iterator[str]:
+        if not os.path.isdir(self.root):
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if _KEY_PATTERN.match(filename):
+                    yield filename
+
+
+class DatabaseBlobStore(BlobStore):
+    """Keeps content inline in the bytea columns (the original behaviour).
+
+    Keys written earlier by the filesystem backend are still resolved from the
+    configured directory, so switching back does not orphan any content.
+    """
+
+    external = False
+
+    def __init__(self, root: str):
+        """Initialize the store; root is where previously externalized content lives."""
+        self._files = FilesystemBlobStore(root)
+
+    def put(self, data: bytes, key: Optional[str] = None) -> Optional[str]:
+        return None
+
+    def get(self, key: str) -> bytes:
+        return self._files.get(key)
+
+    def path(self, key: str) -> Optional[str]:
+        return self._files.path(key)
+
+    def exists(self, key: str) -> bool:
+        return self._files.exists(key)
+
+    def delete(self, key: str) -> None:
+        self._files.delete(key)
+
+    def keys(self) -> Iterator[str]:
+        return self._files.keys()
+
+
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def create_blob_store(config: Optional[Config] = None) -> BlobStore:
+    """Create the blob store selected by BLOB_STORE_BACKEND."""
+    if config is None:
+        config = get_config()
+    if config.blob_store.backend == "filesystem":
+        return FilesystemBlobStore(config.blob_store.path)
+    return DatabaseBlobStore(config.blob_store.path)
+
+
+def get_blob_store() -> BlobStore:
+    """Get the process-wide blob store, creating it from configuration on first use."""
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            if _blob_store is None:
+                _blob_store = create_blob_store()
+    return _blob_store
+
+
+def read_blob(data: Optional[bytes], key: Optional[str]) -> Optional[bytes]:
+    """Get content from a row's inline bytes or, if it was externalized, from the blob store."""
+    if data is not None:
+        return bytes(data)
+    if key:
+        return get_blob_store().get(key)
+    return None
+
+
+def blob_file_path(key: Optional[str]) -> Optional[str]:
+    """Get the local file path for an externalized row's content, or None."""
+    if not key:
+        return None
+    return get_blob_store().path(key)
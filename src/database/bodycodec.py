@@ -0,0 +1,201 @@
+"""Compression of stored email bodies.
+
+With EMAIL_BODY_COMPRESSION set to "zlib" or "zstd", new emails keep their HTML and
+plain text bodies compressed in emails.raw_message_compressed and
+emails.plain_text_compressed instead of raw_message and plain_text, and body_codec
+records the codec. HTML is compressed with a dictionary trained on a sample of stored
+HTML (kept in compression_dictionaries and referenced by body_dictionary_id), which
+is what makes short newsletter bodies compress well. Rows written with compression
+off stay readable, so existing data can be compressed gradually with
+migrate_compress_email_bodies.py. Read bodies with email_html_body / email_text_body
+(or decode_body for column projections) rather than the columns directly.
+"""
+
+import threading
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .models import CompressionDictionary, Email
+
+try:
+    import zstandard
+    ZSTD_SUPPORT = True
+except ImportError:
+    zstandard = None
+    ZSTD_SUPPORT = False
+
+
+CODECS = ("zlib", "zstd")
+
+# zlib only uses the last 32 KB of a preset dictionary
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+ZSTD_DICTIONARY_SIZE = 112 * 1024
+
+DEFAULT_LEVELS = {"zlib": 6, "zstd": 9}
+
+# Dictionaries never change once stored, so they are cached by ID for the process lifetime
+_dictionaries: Dict[int, bytes] = {}
+# Latest dictionary per codec: codec -> (dictionary ID, data), or _NO_DICTIONARY when
+# none has been trained, so writes do not look for one every time
+_NO_DICTIONARY: Tuple[None, None] = (None, None)
+_current_dictionaries: Dict[str, Tuple[Optional[int], Optional[bytes]]] = {}
+_dictionaries_lock = threading.Lock()
+
+
+def _require_codec(codec: str):
+    if codec not in CODECS:
+        raise ValueError(f"Unknown email body codec: {codec}")
+    if codec == "zstd" and not ZSTD_SUPPORT:
+        raise ValueError("EMAIL_BODY_COMPRESSION=zstd requires the zstandard package")
+
+
+def train_dictionary(codec: str, samples: List[bytes]) -> bytes:
+    """Build a compression dictionary from sample bodies.
+
+    zstd trains a real dictionary. zlib can only use a preset dictionary of common
+    content, so it gets the lines that occur most often across the samples, with the
+    most frequent last (zlib finds content near the end of the dictionary cheapest).
+    """
+    _require_codec(codec)
+    if codec == "zstd":
+        return zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples).as_bytes()
+
+    counts = Counter()
+    for sample in samples:
+        # Count each line once per sample, so one long repetitive body does not dominate
+        counts.update(set(line.strip() for line in sample.splitlines() if len(line.strip()) > 8))
+    dictionary = b""
+    for line, count in counts.most_common():
+        if count < 2 or len(dictionary) + len(line) + 1 > ZLIB_DICTIONARY_SIZE:
+            continue
+        dictionary = line + b"\n" + dictionary
+    return dictionary
+
+
+def compress_body(codec: str, text: Optional[str], dictionary: Optional[bytes] = None,
+                  level: Optional[int] = None) -> Optional[bytes]:
+    """Compress a body with codec, optionally with a dictionary. None stays None."""
+    if text is None:
+        return None
+    _require_codec(codec)
+    data = text.encode("utf-8")
+    level = level if level is not None else DEFAULT_LEVELS[codec]
+    if codec == "zstd":
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compress(data)
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_body(codec: str, data: Optional[bytes], dictionary: Optional[bytes] = None) -> Optional[str]:
+    """Decompress a body written by compress_body."""
+    if data is None:
+        return None
+    _require_codec(codec)
+    if codec == "zstd":
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data).decode("utf-8")
+    if dictionary:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        decompressor = zlib.decompressobj()
+    return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+def get_dictionary(session: Session, dictionary_id: Optional[int]) -> Optional[bytes]:
+    """Get a stored dictionary's data by ID (cached)."""
+    if dictionary_id is None:
+        return None
+    dictionary = _dictionaries.get(dictionary_id)
+    if dictionary is None:
+        dictionary = session.query(CompressionDictionary.data).filter(
+            CompressionDictionary.id == dictionary_id
+        ).scalar()
+        if dictionary is None:
+            raise ValueError(f"Compression dictionary {dictionary_id} does not exist")
+        with _dictionaries_lock:
+            _dictionaries[dictionary_id] = dictionary
+    return dictionary
+
+
+def get_current_dictionary(session: Session, codec: str) -> Tuple[Optional[int], Optional[bytes]]:
+    """Get the newest dictionary for codec as (ID, data), or (None, None) if none was trained."""
+    current = _current_dictionaries.get(codec)
+    if current is None:
+        row = session.query(CompressionDictionary.id, CompressionDictionary.data).filter(
+            CompressionDictionary.codec == codec
+        ).order_by(CompressionDictionary.id.desc()).first()
+        if row is None:
+            current = _NO_DICTIONARY
+            with _dictionaries_lock:
+                _current_dictionaries.setdefault(codec, current)
+            return current
+        current = (row.id, row.data)
+        with _dictionaries_lock:
+            _current_dictionaries[codec] = current
+            _dictionaries[row.id] = row.data
+    return current
+
+
+def set_current_dictionary(codec: str, dictionary_id: int, dictionary: bytes):
+    """Make a newly stored dictionary the one new bodies are compressed with in this process."""
+    with _dictionaries_lock:
+        _current_dictionaries[codec] = (dictionary_id, dictionary)
+        _dictionaries[dictionary_id] = dictionary
+
+
+def encode_bodies(session: Session, codec: Optional[str], raw_message: Optional[str],
+                  plain_text: Optional[str], level: Optional[int] = None) -> Dict[str, object]:
+    """Get the emails column values storing these bodies.
+
+    Args:
+        session: Open session, used to look up the current HTML dictionary
+        codec: "zlib", "zstd", or None/"none" to store the bodies uncompressed
+
+    Returns:
+        Dictionary of raw_message, plain_text, raw_message_compressed,
+        plain_text_compressed, body_codec and body_dictionary_id values
+    """
+    if not codec or codec == "none":
+        return {
+            "raw_message": raw_message,
+            "plain_text": plain_text,
+            "raw_message_compressed": None,
+            "plain_text_compressed": None,
+            "body_codec": None,
+            "body_dictionary_id": None,
+        }
+    dictionary_id, dictionary = get_current_dictionary(session, codec)
+    return {
+        "raw_message": None,
+        "plain_text": None,
+        "raw_message_compressed": compress_body(codec, raw_message, dictionary, level),
+        "plain_text_compressed": compress_body(codec, plain_text, None, level),
+        "body_codec": codec,
+        "body_dictionary_id": dictionary_id,
+    }
+
+
+def decode_body(session: Session, codec: Optional[str], plain: Optional[str], compressed: Optional[bytes],
+                dictionary_id: Optional[int] = None) -> Optional[str]:
+    """Get a body from its uncompressed and compressed column values."""
+    if not codec:
+        return plain
+    return decompress_body(codec, compressed, get_dictionary(session, dictionary_id))
+
+
+def email_html_body(session: Session, email: Email) -> Optional[str]:
+    """Get an email's HTML body (raw_message), decompressing it if needed."""
+    return decode_body(session, email.body_codec, email.raw_message, email.raw_message_compressed,
+                       email.body_dictionary_id)
+
+
+def email_text_body(session: Session, email: Email) -> Optional[str]:
+    """Get an email's plain text body, decompressing it if needed."""
+    return decode_body(session, email.body_codec, email.plain_text, email.plain_text_compressed)
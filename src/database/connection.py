@@ -1,33 +1,149 @@
 """Database connection and management."""
 
-from typing import Optional
+import threading
+from typing import Any, Dict, List, Optional, Tuple
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 
-from ..config import Config, get_config
+from ..config import Config, DatabaseConfig, get_config
+from .migrations import LATEST_SCHEMA_VERSION, get_schema_version, run_migrations
+
+
+# One engine (and connection pool) per distinct database configuration, shared by
+# every Database instance in the process
+_engines: Dict[tuple, Tuple[Engine, sessionmaker]] = {}
+_engines_lock = threading.Lock()
+_default_database: Optional["Database"] = None
+
+# Same for the asyncpg engines used by the async API endpoints
+_async_engines: Dict[tuple, Tuple[AsyncEngine, async_sessionmaker]] = {}
+_default_async_database: Optional["AsyncDatabase"] = None
+
+
+def _engine_key(db_config: DatabaseConfig, connection_string: str) -> tuple:
+    return (
+        connection_string,
+        db_config.pool_size,
+        db_config.max_overflow,
+        db_config.pool_recycle,
+        db_config.pool_timeout,
+    )
+
+
+def _get_shared_engine(db_config: DatabaseConfig) -> Tuple[Engine, sessionmaker]:
+    """Get the engine and session factory for a database configuration, creating them once."""
+    key = _engine_key(db_config, db_config.connection_string)
+    with _engines_lock:
+        if key not in _engines:
+            engine = create_engine(
+                db_config.connection_string,
+                pool_pre_ping=True,
+                echo=False,
+                pool_size=db_config.pool_size,  # Number of connections to maintain in the pool
+                max_overflow=db_config.max_overflow,  # Maximum number of connections beyond pool_size
+                pool_recycle=db_config.pool_recycle,  # Recycle connections after this many seconds
+                pool_timeout=db_config.pool_timeout,  # Timeout for getting a connection from the pool
+            )
+            _engines[key] = (engine, sessionmaker(bind=engine))
+        return _engines[key]
+
+
+def _get_shared_async_engine(db_config: DatabaseConfig) -> Tuple[AsyncEngine, async_sessionmaker]:
+    """Get the async engine and session factory for a database configuration, creating them once."""
+    key = _engine_key(db_config, db_config.async_connection_string)
+    with _engines_lock:
+        if key not in _async_engines:
+            engine = create_async_engine(
+                db_config.async_connection_string,
+                pool_pre_ping=True,
+                echo=False,
+                pool_size=db_config.pool_size,
+                max_overflow=db_config.max_overflow,
+                pool_recycle=db_config.pool_recycle,
+                pool_timeout=db_config.pool_timeout,
+            )
+            # Results are converted to responses after the session closes, so keep
+            # loaded attributes instead of expiring them on commit
+            _async_engines[key] = (engine, async_sessionmaker(bind=engine, expire_on_commit=False))
+        return _async_engines[key]
+
+
+def get_database() -> "Database":
+    """Get the process-wide Database for the configuration in the environment."""
+    global _default_database
+    if _default_database is None:
+        database = Database()
+        with _engines_lock:
+            if _default_database is None:
+                _default_database = database
+    return _default_database
+
+
+def get_async_database() -> "AsyncDatabase":
+    """Get the process-wide AsyncDatabase for the configuration in the environment."""
+    global _default_async_database
+    if _default_async_database is None:
+        database = AsyncDatabase()
+        with _engines_lock:
+            if _default_async_database is None:
+                _default_async_database = database
+    return _default_async_database
+
+
+def get_engine_stats() -> Dict[str, Any]:
+    """Report the engines in this process and the state of their connection pools."""
+    with _engines_lock:
+        engines = [engine for engine, _ in _engines.values()]
+        engines.extend(engine.sync_engine for engine, _ in _async_engines.values())
+
+    pools = []
+    for engine in engines:
+        pool = engine.pool
+        pools.append({
+            "url": engine.url.render_as_string(hide_password=True),
+            "pool_size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "status": pool.status(),
+        })
+
+    return {
+        "engines": len(engines),
+        "pooled_connections": sum((p["checked_out"] or 0) + (p["checked_in"] or 0) for p in pools),
+        "pools": pools,
+    }
 
 
 class Database:
-    """Database connection and management."""
+    """Database connection and management.
+    
+    Instances are cheap: every Database with the same configuration shares one
+    engine and connection pool, so constructing one per request or import does
+    not open new connections. Use get_database() for the process-wide default.
+    """
 
     def __init__(self, config: Optional[Config] = None):
         """Initialize database connection."""
         if config is None:
             config = get_config()
         self.config = config
-        self.engine = create_engine(
-            config.db.connection_string,
-            pool_pre_ping=True,
-            echo=False,
-            pool_size=10,  # Number of connections to maintain in the pool
-            max_overflow=20,  # Maximum number of connections beyond pool_size
-            pool_recycle=3600,  # Recycle connections after 1 hour
-            pool_timeout=30,  # Timeout for getting a connection from the pool
-        )
-        self.SessionLocal = sessionmaker(bind=self.engine)
+        self.engine, self.SessionLocal = _get_shared_engine(config.db)
 
     def create_tables(self):
-        """Create all tables if they don't exist."""
+        """Create all tables if they don't exist and apply pending schema migrations.
+        
+        Does no DDL when the database already has the latest schema version; see
+        migrations.py for how later schema changes are added.
+        """
+        try:
+            if get_schema_version(self.engine) >= LATEST_SCHEMA_VERSION:
+                return
+        except Exception as e:
+            print(f"Warning: Could not read schema version: {e}")
+
         # Try to create pgvector extension if available
         try:
             with self.engine.connect() as conn:
@@ -73,6 +189,81 @@ class Database:
             # If we can't create index, that's okay - searches will still work, just slower
             pass
         
+        # Add content hash column to media_blob on databases created before blob deduplication
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text(
+                    "ALTER TABLE media_blob ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"
+                ))
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_media_blob_content_hash "
+                    "ON media_blob (content_hash)"
+                ))
+                conn.commit()
+        except Exception as e:
+            print(f"Warning: Could not add media_blob.content_hash column: {e}")
+
+        # Add blob store key columns (content may live outside the database)
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE media_blob ADD COLUMN IF NOT EXISTS image_key VARCHAR(64)"))
+                conn.execute(text("ALTER TABLE media_blob ADD COLUMN IF NOT EXISTS size INTEGER"))
+                conn.execute(text("ALTER TABLE attachments ADD COLUMN IF NOT EXISTS data_key VARCHAR(64)"))
+                conn.execute(text("ALTER TABLE reference_documents ADD COLUMN IF NOT EXISTS data_key VARCHAR(64)"))
+                conn.execute(text("ALTER TABLE reference_documents ALTER COLUMN data DROP NOT NULL"))
+                conn.commit()
+        except Exception as e:
+            print(f"Warning: Could not add blob store key columns: {e}")
+
+        # Typed parent links on media_items (email_id, message_id, album_id)
+        self._ensure_media_item_links()
+
+        # Natural-key unique indexes used as upsert targets. Databases created before
+        # these existed may hold duplicates, which are merged first (lowest ID wins).
+        self._ensure_unique_index(
+            "uq_messages_natural_key",
+            [
+                # Repoint attachments of duplicate messages to the surviving message
+                f"""
+                WITH {self._DUPLICATE_MESSAGES_CTE}
+                UPDATE media_items SET source_reference = dupes.keep_id::text, message_id = dupes.keep_id
+                FROM message_attachments, dupes
+                WHERE message_attachments.message_id = dupes.id
+                AND media_items.id = message_attachments.media_item_id
+                """,
+                f"""
+                WITH {self._DUPLICATE_MESSAGES_CTE}
+                UPDATE message_attachments SET message_id = dupes.keep_id
+                FROM dupes WHERE message_attachments.message_id = dupes.id
+                """,
+                f"""
+                WITH {self._DUPLICATE_MESSAGES_CTE}
+                DELETE FROM messages USING dupes WHERE messages.id = dupes.id
+                """,
+            ],
+            "CREATE UNIQUE INDEX uq_messages_natural_key ON messages ("
+            "COALESCE(chat_session, ''), COALESCE(message_date, '-infinity'::timestamp), "
+            "COALESCE(sender_id, ''), COALESCE(type, ''))",
+        )
+        self._ensure_unique_index(
+            "uq_media_items_source_path",
+            [
+                """
+                DELETE FROM media_items USING media_items AS keep
+                WHERE media_items.source = 'Filesystem' AND keep.source = 'Filesystem'
+                AND media_items.source_reference = keep.source_reference
+                AND media_items.id > keep.id
+                """,
+                """
+                DELETE FROM media_blob WHERE NOT EXISTS (
+                    SELECT 1 FROM media_items WHERE media_items.media_blob_id = media_blob.id
+                )
+                """,
+            ],
+            "CREATE UNIQUE INDEX uq_media_items_source_path ON media_items (source, source_reference) "
+            "WHERE source = 'Filesystem'",
+        )
+
         # Create update_location_regions function
         try:
             with self.engine.connect() as conn:
@@ -181,6 +372,113 @@ class Database:
             print(f"Warning: Could not create update_location_regions() function: {e}")
             pass
 
+        # Apply versioned migrations on top of the baseline schema
+        try:
+            version = run_migrations(self.engine)
+            print(f"Database schema version: {version}")
+        except Exception as e:
+            print(f"Warning: Could not apply schema migrations: {e}")
+
+    # Messages sharing a natural key with a lower-ID message, paired with that message
+    _DUPLICATE_MESSAGES_CTE = """
+        dupes AS (
+            SELECT id, keep_id FROM (
+                SELECT id, MIN(id) OVER (PARTITION BY
+                    COALESCE(chat_session, ''), COALESCE(message_date, '-infinity'::timestamp),
+                    COALESCE(sender_id, ''), COALESCE(type, '')
+                ) AS keep_id
+                FROM messages
+            ) AS ranked
+            WHERE id <> keep_id
+        )
+    """
+
+    # media_items link columns and the tables they reference
+    _MEDIA_ITEM_LINKS = [
+        ("email_id", "emails"),
+        ("message_id", "messages"),
+        ("album_id", "facebook_albums"),
+    ]
+
+    # Fill the link columns of existing media items from source_reference and the
+    # junction tables
+    _MEDIA_ITEM_LINK_BACKFILLS = [
+        ("email attachment(s)", """
+            UPDATE media_items SET email_id = emails.id
+            FROM emails
+            WHERE media_items.source = 'email_attachment'
+            AND media_items.source_reference = emails.id::text
+            AND media_items.email_id IS NULL
+        """),
+        ("message attachment(s)", """
+            UPDATE media_items SET message_id = message_attachments.message_id
+            FROM message_attachments
+            WHERE message_attachments.media_item_id = media_items.id
+            AND media_items.message_id IS NULL
+        """),
+        ("album photo(s)", """
+            UPDATE media_items SET album_id = album_media.album_id
+            FROM album_media
+            WHERE album_media.media_item_id = media_items.id
+            AND media_items.album_id IS NULL
+        """),
+    ]
+
+    def _ensure_media_item_links(self):
+        """Add and backfill the typed link columns on media_items.
+        
+        Does nothing once the indexes exist (new databases get them from
+        create_all). Columns, backfill and indexes are added in one transaction,
+        so a failure leaves the table unchanged and is retried on the next start.
+        """
+        try:
+            with self.engine.connect() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_media_items_email_id'")
+                ).first()
+                if exists:
+                    return
+                for column, table in self._MEDIA_ITEM_LINKS:
+                    conn.execute(text(
+                        f"ALTER TABLE media_items ADD COLUMN IF NOT EXISTS {column} INTEGER "
+                        f"REFERENCES {table} (id) ON DELETE SET NULL"
+                    ))
+                for description, statement in self._MEDIA_ITEM_LINK_BACKFILLS:
+                    result = conn.execute(text(statement))
+                    if result.rowcount:
+                        print(f"media_items: linked {result.rowcount} {description}")
+                for column, _ in self._MEDIA_ITEM_LINKS:
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_media_items_{column} ON media_items ({column})"
+                    ))
+                conn.commit()
+                print("Added typed link columns to media_items.")
+        except Exception as e:
+            print(f"Warning: Could not add media_items link columns: {e}")
+
+    def _ensure_unique_index(self, name: str, dedupe_statements: List[str], create_statement: str):
+        """Create a unique index on an existing table, removing duplicates first.
+        
+        Does nothing if the index already exists. The duplicate cleanup and the index
+        creation run in one transaction, so a failure leaves the table unchanged.
+        """
+        try:
+            with self.engine.connect() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM pg_indexes WHERE indexname = :name"), {"name": name}
+                ).first()
+                if exists:
+                    return
+                for statement in dedupe_statements:
+                    result = conn.execute(text(statement))
+                    if result.rowcount:
+                        print(f"{name}: merged {result.rowcount} duplicate row(s)")
+                conn.execute(text(create_statement))
+                conn.commit()
+                print(f"Created unique index {name}.")
+        except Exception as e:
+            print(f"Warning: Could not create unique index {name}: {e}")
+
     def get_session(self) -> Session:
         """Get a database session."""
         return self.SessionLocal()
@@ -193,3 +491,33 @@ class Database:
                 return True
         except Exception:
             return False
+
+
+class AsyncDatabase:
+    """Async counterpart of Database for use inside the event loop.
+
+    Backed by an asyncpg engine, so queries from async API endpoints wait on the
+    database without blocking other requests. Schema management stays on
+    Database; this class only hands out sessions. Use get_async_database() for
+    the process-wide default.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        """Initialize async database connection."""
+        if config is None:
+            config = get_config()
+        self.config = config
+        self.engine, self.SessionLocal = _get_shared_async_engine(config.db)
+
+    def get_session(self) -> AsyncSession:
+        """Get an async database session, for use with `async with`."""
+        return self.SessionLocal()
+
+    async def check_database_exists(self) -> bool:
+        """Check if database exists."""
+        try:
+            async with self.engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                return True
+        except Exception:
+            return False
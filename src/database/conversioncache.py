@@ -0,0 +1,185 @@
+"""Disk cache of converted media content.
+
+Full-size HEIC/HEIF images are converted to JPEG for browsers that cannot show
+them. The conversion costs hundreds of milliseconds per photo, so its output is
+kept on disk, named by the blob ID and the content hash of the original
+(<hash[:2]>/<blob id>-<hash>.jpg under CONVERSION_CACHE_PATH). A blob's content never
+changes, so entries are never stale; they are only evicted, least recently used
+first, once the cache grows beyond CONVERSION_CACHE_MAX_BYTES.
+
+Each process keeps an index of the entries, built from the directory on first use
+and ordered by file modification time, which hits refresh. Several processes can
+share a directory; an entry another process evicted is simply a miss.
+"""
+
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from ..config import Config, get_config
+
+
+_ENTRY_PATTERN = re.compile(r"^(\d+)-([0-9a-f]{64})\.jpg$")
+_TEMP_PREFIX = ".tmp-"
+
+
+class ConversionCache:
+    """Size-bounded LRU cache of converted images on the local filesystem.
+
+    Writes go to a temporary file in the target directory that is renamed into
+    place, so readers never see a partially written entry. Entries are not fsynced:
+    one lost in a crash is converted again.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        """Initialize the cache rooted at the given directory, holding up to max_bytes."""
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._entries: Optional["OrderedDict[str, int]"] = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _file_name(blob_id: int, content_hash: str) -> str:
+        return f"{int(blob_id)}-{content_hash}.jpg"
+
+    def _file_path(self, file_name: str) -> str:
+        # Shard by the content hash, which is already in the name
+        return os.path.join(self.root, file_name.split("-", 1)[1][0:2], file_name)
+
+    def _load_index(self):
+        """Build the LRU index from the files in the cache directory (least recent first)."""
+        entries = []
+        if os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if not _ENTRY_PATTERN.match(filename):
+                        continue
+                    try:
+                        stat = os.stat(os.path.join(dirpath, filename))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, filename, stat.st_size))
+        entries.sort()
+        self._entries = OrderedDict((filename, size) for _, filename, size in entries)
+        self._total_bytes = sum(self._entries.values())
+
+    def _index(self) -> "OrderedDict[str, int]":
+        if self._entries is None:
+            self._load_index()
+        return self._entries
+
+    def _evict(self, keep: Optional[str] = None):
+        """Remove least recently used entries until the cache fits its budget."""
+        entries = self._index()
+        while self._total_bytes > self.max_bytes and entries:
+            file_name, size = next(iter(entries.items()))
+            if file_name == keep and len(entries) == 1:
+                break
+            del entries[file_name]
+            self._total_bytes -= size
+            try:
+                os.unlink(self._file_path(file_name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Warning: Could not evict conversion cache entry {file_name}: {e}")
+
+    def contains(self, blob_id: int, content_hash: str) -> bool:
+        """Check whether a blob's conversion is cached, without marking it as used."""
+        if not self.enabled:
+            return False
+        return os.path.isfile(self._file_path(self._file_name(blob_id, content_hash)))
+
+    def get_path(self, blob_id: int, content_hash: str) -> Optional[str]:
+        """Get the file holding a blob's conversion and mark it as recently used, or None."""
+        if not self.enabled:
+            return None
+        file_name = self._file_name(blob_id, content_hash)
+        file_path = self._file_path(file_name)
+        with self._lock:
+            entries = self._index()
+            try:
+                # Record the hit in the file, so the order survives restarts
+                os.utime(file_path)
+                size = os.path.getsize(file_path)
+            except FileNotFoundError:
+                if file_name in entries:
+                    self._total_bytes -= entries.pop(file_name)
+                return None
+            if file_name in entries:
+                entries.move_to_end(file_name)
+            else:
+                # Written by another process sharing the directory
+                entries[file_name] = size
+                self._total_bytes += size
+                self._evict(keep=file_name)
+        return file_path
+
+    def put(self, blob_id: int, content_hash: str, data: bytes) -> Optional[str]:
+        """Store a blob's conversion, evicting old entries as needed.
+
+        Returns:
+            Path of the cached file, or None if the cache is disabled or the
+            conversion alone is larger than the budget
+        """
+        if not self.enabled or len(data) > self.max_bytes:
+            return None
+        file_name = self._file_name(blob_id, content_hash)
+        destination = self._file_path(file_name)
+        directory = os.path.dirname(destination)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=_TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, destination)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            entries = self._index()
+            if file_name in entries:
+                self._total_bytes -= entries.pop(file_name)
+            entries[file_name] = len(data)
+            self._total_bytes += len(data)
+            self._evict(keep=file_name)
+        return destination
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of entries, their total size and the budget, in bytes."""
+        with self._lock:
+            entries = self._index()
+            return {"entries": len(entries), "total_bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+
+_conversion_cache: Optional[ConversionCache] = None
+_conversion_cache_lock = threading.Lock()
+
+
+def create_conversion_cache(config: Optional[Config] = None) -> ConversionCache:
+    """Create the conversion cache configured by CONVERSION_CACHE_PATH and CONVERSION_CACHE_MAX_BYTES."""
+    if config is None:
+        config = get_config()
+    return ConversionCache(config.conversion_cache.path, config.conversion_cache.max_bytes)
+
+
+def get_conversion_cache() -> ConversionCache:
+    """Get the process-wide conversion cache, creating it from configuration on first use."""
+    global _conversion_cache
+    if _conversion_cache is None:
+        with _conversion_cache_lock:
+            if _conversion_cache is None:
+                _conversion_cache = create_conversion_cache()
+    return _conversion_cache
@@ -0,0 +1,233 @@
+"""Versioned schema migrations.
+
+Database.create_tables brings a database up to the baseline schema (create_all plus
+the column additions and unique indexes that predate versioning). Every schema change
+after that is a Migration below, applied in order and recorded in schema_migrations.
+Once a database has the latest version, create_tables skips all DDL.
+
+Schema objects must also be declared in models.py so create_all produces them on new
+databases; the migration then brings existing databases in line (hence IF NOT EXISTS).
+"""
+
+from dataclasses import dataclass
+from typing import Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+@dataclass(frozen=True)
+class Migration:
+    """One schema version.
+
+    statements run in a single transaction. concurrent_indexes are (name, definition)
+    pairs created with CREATE INDEX CONCURRENTLY after that transaction, so building
+    them on a populated table does not block writes; definition is everything after
+    the index name, e.g. "ON emails (date)".
+    """
+    version: int
+    description: str
+    statements: Tuple[str, ...] = ()
+    concurrent_indexes: Tuple[Tuple[str, str], ...] = ()
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        description="Indexes for hot lookup keys",
+        concurrent_indexes=(
+            ("ix_media_items_source_reference", "ON media_items (source, source_reference)"),
+            ("ix_media_items_processed_media_type", "ON media_items (processed, media_type)"),
+            ("ix_media_items_media_blob_id", "ON media_items (media_blob_id)"),
+            ("ix_messages_chat_session_date", "ON messages (chat_session, message_date)"),
+            ("ix_message_attachments_message_id", "ON message_attachments (message_id)"),
+            ("ix_message_attachments_media_item_id", "ON message_attachments (media_item_id)"),
+            ("ix_album_media_album_id", "ON album_media (album_id)"),
+            ("ix_album_media_media_item_id", "ON album_media (media_item_id)"),
+            ("ix_emails_date", "ON emails (date)"),
+            ("ix_emails_user_deleted_date", "ON emails (user_deleted, date)"),
+        ),
+    ),
+    Migration(
+        version=2,
+        description="Gmail sync state for incremental label sync",
+        statements=(
+            "CREATE TABLE IF NOT EXISTS gmail_sync_state ("
+            "label VARCHAR(255) PRIMARY KEY, "
+            "history_id VARCHAR(32) NOT NULL, "
+            "updated_at TIMESTAMP)",
+        ),
+    ),
+    Migration(
+        version=3,
+        description="email_labels junction table split from emails.folder",
+        statements=(
+            "CREATE TABLE IF NOT EXISTS email_labels ("
+            "email_id INTEGER NOT NULL REFERENCES emails (id) ON DELETE CASCADE, "
+            "label VARCHAR(255) NOT NULL, "
+            "PRIMARY KEY (email_id, label))",
+            "INSERT INTO email_labels (email_id, label) "
+            "SELECT DISTINCT emails.id, folder_label FROM emails, "
+            "unnest(string_to_array(emails.folder, ',')) AS folder_label "
+            "WHERE folder_label <> '' "
+            "ON CONFLICT DO NOTHING",
+        ),
+        concurrent_indexes=(
+            ("ix_email_labels_label_email_id", "ON email_labels (label, email_id)"),
+        ),
+    ),
+    Migration(
+        version=4,
+        description="Pending email attachments for lazy attachment downloads",
+        statements=(
+            "CREATE TABLE IF NOT EXISTS pending_email_attachments ("
+            "id SERIAL PRIMARY KEY, "
+            "email_id INTEGER NOT NULL REFERENCES emails (id) ON DELETE CASCADE, "
+            "gmail_attachment_id TEXT NOT NULL, "
+            "filename VARCHAR(500), "
+            "mime_type VARCHAR(255), "
+            "size INTEGER, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "last_error TEXT, "
+            "created_at TIMESTAMP)",
+            "CREATE INDEX IF NOT EXISTS ix_pending_email_attachments_email_id "
+            "ON pending_email_attachments (email_id)",
+        ),
+    ),
+    Migration(
+        version=5,
+        description="Compressed email bodies",
+        statements=(
+            "CREATE TABLE IF NOT EXISTS compression_dictionaries ("
+            "id SERIAL PRIMARY KEY, "
+            "codec VARCHAR(16) NOT NULL, "
+            "data BYTEA NOT NULL, "
+            "sample_count INTEGER NOT NULL DEFAULT 0, "
+            "created_at TIMESTAMP)",
+            "ALTER TABLE emails ADD COLUMN IF NOT EXISTS raw_message_compressed BYTEA",
+            "ALTER TABLE emails ADD COLUMN IF NOT EXISTS plain_text_compressed BYTEA",
+            "ALTER TABLE emails ADD COLUMN IF NOT EXISTS body_codec VARCHAR(16)",
+            "ALTER TABLE emails ADD COLUMN IF NOT EXISTS body_dictionary_id INTEGER "
+            "REFERENCES compression_dictionaries (id)",
+        ),
+    ),
+    Migration(
+        version=6,
+        description="Manifest of imported filesystem images",
+        statements=(
+            "CREATE TABLE IF NOT EXISTS imported_files ("
+            "path TEXT PRIMARY KEY, "
+            "size BIGINT NOT NULL, "
+            "mtime_ns BIGINT NOT NULL, "
+            "content_hash VARCHAR(64) NOT NULL, "
+            "media_item_id INTEGER REFERENCES media_items (id) ON DELETE SET NULL, "
+            "updated_at TIMESTAMP)",
+            "CREATE INDEX IF NOT EXISTS ix_imported_files_path_pattern "
+            "ON imported_files (path text_pattern_ops)",
+            "CREATE INDEX IF NOT EXISTS ix_imported_files_content_hash "
+            "ON imported_files (content_hash)",
+        ),
+    ),
+    Migration(
+        version=7,
+        description="Display-size renditions of media blobs",
+        statements=(
+            "CREATE TABLE IF NOT EXISTS media_renditions ("
+            "media_blob_id INTEGER NOT NULL REFERENCES media_blob (id) ON DELETE CASCADE, "
+            "size INTEGER NOT NULL, "
+            "content_type VARCHAR(50) NOT NULL, "
+            "width INTEGER NOT NULL, "
+            "height INTEGER NOT NULL, "
+            "data BYTEA NOT NULL, "
+            "created_at TIMESTAMP, "
+            "PRIMARY KEY (media_blob_id, size))",
+        ),
+    ),
+    Migration(
+        version=8,
+        description="Sorted labels in email folders",
+        statements=(
+            # Same order as folder_from_labels (code point, hence COLLATE "C"). Where
+            # several rows of a UID sort to the same folder only the first is updated,
+            # and none is if a row already has it, to keep (uid, folder) unique
+            "UPDATE emails SET folder = sorted.folder "
+            "FROM (SELECT id, uid, folder, "
+            "row_number() OVER (PARTITION BY uid, folder ORDER BY id) AS position "
+            "FROM (SELECT id, uid, ("
+            "SELECT string_agg(DISTINCT label COLLATE \"C\", ',' ORDER BY label COLLATE \"C\") "
+            "FROM unnest(string_to_array(emails.folder, ',')) AS label WHERE label <> ''"
+            ") AS folder FROM emails WHERE folder IS NOT NULL) AS normalised) AS sorted "
+            "WHERE emails.id = sorted.id AND sorted.position = 1 AND sorted.folder IS NOT NULL "
+            "AND emails.folder <> sorted.folder "
+            "AND NOT EXISTS (SELECT 1 FROM emails AS other "
+            "WHERE other.uid = sorted.uid AND other.folder = sorted.folder)",
+        ),
+    ),
+)
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(engine: Engine) -> int:
+    """Get the schema version recorded in the database, or 0 if none is recorded."""
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT to_regclass('schema_migrations')")).scalar() is None:
+            return 0
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
+
+def _create_index_concurrently(engine: Engine, name: str, definition: str):
+    """Create an index without locking out writes, replacing a leftover invalid build."""
+    # CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # A failed concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+        invalid = conn.execute(text(
+            "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ), {"name": name}).first()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}"))
+
+
+def run_migrations(engine: Engine) -> int:
+    """Apply all migrations newer than the database's schema version.
+
+    Stops at the first failing migration, leaving it unrecorded so it is retried
+    on the next start.
+
+    Returns:
+        The schema version after running
+    """
+    with engine.connect() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "description TEXT, "
+            "applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'))"
+        ))
+        conn.commit()
+
+    version = get_schema_version(engine)
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        print(f"Applying schema migration {migration.version}: {migration.description}...")
+        try:
+            with engine.connect() as conn:
+                for statement in migration.statements:
+                    conn.execute(text(statement))
+                conn.commit()
+            for name, definition in migration.concurrent_indexes:
+                _create_index_concurrently(engine, name, definition)
+            with engine.connect() as conn:
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                    {"version": migration.version, "description": migration.description},
+                )
+                conn.commit()
+        except Exception as e:
+            print(f"Warning: Schema migration {migration.version} failed: {e}")
+            break
+        version = migration.version
+    return version
@@ -2,6 +2,7 @@
 
 from datetime import datetime, timezone
 from sqlalchemy import (
+    BigInteger,
     Column,
     Float,
     Integer,
@@ -16,7 +17,7 @@ from sqlalchemy import (
     text,
 )
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
 
 def utcnow():
@@ -26,6 +27,27 @@ def utcnow():
 Base = declarative_base()
 
 
+# Natural key used to deduplicate messages. NULLs are coalesced so that messages
+# without a sender or type still collide, as they did with the old lookup. Used both
+# for the unique index and as the ON CONFLICT target of message upserts.
+MESSAGE_NATURAL_KEY = (
+    text("COALESCE(chat_session, '')"),
+    text("COALESCE(message_date, '-infinity'::timestamp)"),
+    text("COALESCE(sender_id, '')"),
+    text("COALESCE(type, '')"),
+)
+
+# Media source whose source_reference is a unique file path, so (source,
+# source_reference) identifies an image. Other sources reference a parent row
+# (email, message, album) that can own several media items.
+PATH_KEYED_MEDIA_SOURCE = "Filesystem"
+PATH_KEYED_MEDIA_SOURCE_WHERE = text(f"source = '{PATH_KEYED_MEDIA_SOURCE}'")
+
+# media_renditions size of the empty row that marks a blob whose image cannot have
+# renditions (animated or undecodable), so it is not decoded again on every request
+NO_RENDITIONS_SIZE = 0
+
+
 class Email(Base):
     """Email model."""
 
@@ -40,10 +62,19 @@ class Email(Base):
     cc_addresses = Column(Text)
     bcc_addresses = Column(Text)
     date = Column(DateTime)
-    raw_message = Column(Text)
-    plain_text = Column(Text)
+    # Message bodies and the embedding are deferred so listing queries only read
+    # the metadata columns; use undefer() where the content is needed
+    raw_message = deferred(Column(Text))
+    plain_text = deferred(Column(Text))
+    # With EMAIL_BODY_COMPRESSION the bodies are kept compressed here instead of in
+    # raw_message / plain_text; body_codec is NULL for uncompressed rows. Read them
+    # with bodycodec.email_html_body / email_text_body
+    raw_message_compressed = deferred(Column(LargeBinary, nullable=True))
+    plain_text_compressed = deferred(Column(LargeBinary, nullable=True))
+    body_codec = Column(String(16), nullable=True)
+    body_dictionary_id = Column(Integer, ForeignKey("compression_dictionaries.id"), nullable=True)
     snippet = Column(Text)
-    embedding = Column(Text, nullable=True)  # Will store vector as text/json, can be converted to pgvector later
+    embedding = deferred(Column(Text, nullable=True))  # Will store vector as text/json, can be converted to pgvector later
     has_attachments = Column(Boolean, default=False, nullable=False)
     user_deleted = Column(Boolean, default=False, nullable=False)
     is_personal = Column(Boolean, default=False, nullable=False)
@@ -63,9 +94,50 @@ class Email(Base):
     __table_args__ = (
         UniqueConstraint('uid', 'folder', name='uq_email_uid_folder'),
         Index('idx_email_uid_folder', 'uid', 'folder'),
+        Index('ix_emails_date', 'date'),
+        Index('ix_emails_user_deleted_date', 'user_deleted', 'date'),
     )
 
 
+class CompressionDictionary(Base):
+    """Dictionary the HTML bodies of emails are compressed with (see bodycodec)."""
+
+    __tablename__ = "compression_dictionaries"
+
+    id = Column(Integer, primary_key=True)
+    codec = Column(String(16), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    sample_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=utcnow)
+
+
+class EmailLabel(Base):
+    """Junction table of the labels each email carries.
+    
+    Mirrors the comma-separated Email.folder string one row per label, so label
+    filters are index lookups instead of LIKE patterns.
+    """
+
+    __tablename__ = "email_labels"
+
+    email_id = Column(Integer, ForeignKey("emails.id", ondelete="CASCADE"), primary_key=True)
+    label = Column(String(255), primary_key=True)
+
+    __table_args__ = (
+        Index('ix_email_labels_label_email_id', 'label', 'email_id'),
+    )
+
+
+class GmailSyncState(Base):
+    """Gmail history ID each label was last synced to, for incremental sync."""
+
+    __tablename__ = "gmail_sync_state"
+
+    label = Column(String(255), primary_key=True)
+    history_id = Column(String(32), nullable=False)  # Gmail history IDs are unsigned 64-bit, sent as strings
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+
 class Attachment(Base):
     """Attachment model."""
 
@@ -77,12 +149,33 @@ class Attachment(Base):
     content_type = Column(String(255))
     size = Column(Integer)
     data = Column(LargeBinary)
+    data_key = Column(String(64), nullable=True)  # Blob store key when data is kept outside the database
     image_thumbnail = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime, default=utcnow)
 
     email = relationship("Email", back_populates="attachments")
 
 
+class PendingEmailAttachment(Base):
+    """Email attachment whose body has not been downloaded from Gmail yet.
+    
+    Written instead of a media item when attachments are downloaded lazily; the row is
+    deleted once the body is fetched and stored as a media item.
+    """
+
+    __tablename__ = "pending_email_attachments"
+
+    id = Column(Integer, primary_key=True)
+    email_id = Column(Integer, ForeignKey("emails.id", ondelete="CASCADE"), nullable=False, index=True)
+    gmail_attachment_id = Column(Text, nullable=False)
+    filename = Column(String(500))
+    mime_type = Column(String(255))
+    size = Column(Integer)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=utcnow)
+
+
 class MessageAttachment(Base):
     """Junction table linking messages to media items."""
 
@@ -96,6 +189,11 @@ class MessageAttachment(Base):
     message = relationship("IMessage", back_populates="media_attachments")
     media_item = relationship("MediaMetadata", foreign_keys=[media_item_id])
 
+    __table_args__ = (
+        Index('ix_message_attachments_message_id', 'message_id'),
+        Index('ix_message_attachments_media_item_id', 'media_item_id'),
+    )
+
 
 class AlbumMedia(Base):
     """Junction table linking Facebook albums to media items."""
@@ -110,6 +208,11 @@ class AlbumMedia(Base):
     album = relationship("FacebookAlbum", back_populates="media_items")
     media_item = relationship("MediaMetadata", foreign_keys=[media_item_id])
 
+    __table_args__ = (
+        Index('ix_album_media_album_id', 'album_id'),
+        Index('ix_album_media_media_item_id', 'media_item_id'),
+    )
+
 
 class IMessage(Base):
     """Message model (supports iMessage, SMS, and WhatsApp)."""
@@ -137,6 +240,11 @@ class IMessage(Base):
 
     media_attachments = relationship("MessageAttachment", back_populates="message", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index('uq_messages_natural_key', *MESSAGE_NATURAL_KEY, unique=True),
+        Index('ix_messages_chat_session_date', 'chat_session', 'message_date'),
+    )
+
 
 class FacebookAlbum(Base):
     """Facebook Album model."""
@@ -166,7 +274,8 @@ class ReferenceDocument(Base):
     author = Column(String(500), nullable=True)
     content_type = Column(String(255), nullable=False)
     size = Column(Integer, nullable=False)
-    data = Column(LargeBinary, nullable=False)
+    data = Column(LargeBinary, nullable=True)
+    data_key = Column(String(64), nullable=True)  # Blob store key when data is kept outside the database
     tags = Column(Text, nullable=True)
     categories = Column(Text, nullable=True)
     notes = Column(Text, nullable=True)
@@ -214,7 +323,15 @@ class MediaMetadata(Base):
     use_by_ai = Column(Boolean, default=False, nullable=True)
     source=Column(String(255), nullable=True)
     source_reference=Column(String(500), nullable=True)
-    media_blob = relationship("MediaBlob", back_populates="media_metadata", uselist=False, cascade="all, delete")
+    # Typed link to the row the item was imported from (at most one is set). Email
+    # attachments, message attachments and album photos also keep that row's ID as
+    # text in source_reference; lookups and joins should use these indexed columns
+    email_id = Column(Integer, ForeignKey("emails.id", ondelete="SET NULL"), nullable=True, index=True)
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="SET NULL"), nullable=True, index=True)
+    album_id = Column(Integer, ForeignKey("facebook_albums.id", ondelete="SET NULL"), nullable=True, index=True)
+    # Blobs are content-addressed and may be shared by several media items, so deleting
+    # an item must not cascade to its blob; see storage.delete_unreferenced_media_blobs
+    media_blob = relationship("MediaBlob", back_populates="media_metadata", uselist=False, cascade="save-update, merge")
     
     # Relationship to messages via MessageAttachment junction table
     message_attachments = relationship("MessageAttachment", foreign_keys="MessageAttachment.media_item_id", back_populates="media_item")
@@ -222,18 +339,79 @@ class MediaMetadata(Base):
     # Relationship to albums via AlbumMedia junction table
     album_media = relationship("AlbumMedia", foreign_keys="AlbumMedia.media_item_id")
 
+    __table_args__ = (
+        Index(
+            'uq_media_items_source_path', 'source', 'source_reference',
+            unique=True, postgresql_where=PATH_KEYED_MEDIA_SOURCE_WHERE,
+        ),
+        Index('ix_media_items_source_reference', 'source', 'source_reference'),
+        Index('ix_media_items_processed_media_type', 'processed', 'media_type'),
+        Index('ix_media_items_media_blob_id', 'media_blob_id'),
+    )
+
 class MediaBlob(Base):
     """Media Blob model."""
 
     __tablename__ = "media_blob"
 
     id = Column(Integer, primary_key=True)
-    image_data = Column(LargeBinary, nullable=True)
-    thumbnail_data = Column(LargeBinary, nullable=True)
+    # Content columns are deferred so that loading a blob row (or selecting only the
+    # thumbnail) never pulls the full-size image out of TOAST. Use undefer() when
+    # the bytes are needed on a detached instance.
+    image_data = deferred(Column(LargeBinary, nullable=True))
+    thumbnail_data = deferred(Column(LargeBinary, nullable=True))
+    content_hash = Column(String(64), nullable=True)  # SHA-256 hex digest of image_data
+    image_key = Column(String(64), nullable=True)  # Blob store key when image_data is kept outside the database
+    size = Column(Integer, nullable=True)  # Length of the image content in bytes
     created_at = Column(DateTime, default=utcnow)
     updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
-    # Relationship back to MediaMetadata (no foreign key needed - MediaMetadata has media_blob_id)
-    media_metadata = relationship("MediaMetadata", back_populates="media_blob", uselist=False)
+    # Relationship back to MediaMetadata (no foreign key needed - MediaMetadata has media_blob_id).
+    # A blob can be shared by several media items with identical content.
+    media_metadata = relationship("MediaMetadata", back_populates="media_blob")
+
+    __table_args__ = (
+        Index('uq_media_blob_content_hash', 'content_hash', unique=True),
+    )
+
+class MediaRendition(Base):
+    """Display-size copy of a media blob's image, fitting a size x size box.
+    
+    Blobs are content-addressed and never change, so renditions are made once
+    (on first request or by backfill_media_renditions.py) and go with their blob.
+    A blob whose image cannot have renditions gets a single NO_RENDITIONS_SIZE row.
+    """
+
+    __tablename__ = "media_renditions"
+
+    media_blob_id = Column(Integer, ForeignKey("media_blob.id", ondelete="CASCADE"), primary_key=True)
+    size = Column(Integer, primary_key=True)  # Long edge of the bounding box, in pixels
+    content_type = Column(String(50), nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=utcnow)
+
+class ImportedFile(Base):
+    """File seen by the filesystem image import, keyed by absolute path.
+    
+    Re-imports skip files whose size and mtime are unchanged without opening them,
+    and use content_hash to recognise moved or renamed files.
+    """
+
+    __tablename__ = "imported_files"
+
+    path = Column(Text, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    media_item_id = Column(Integer, ForeignKey("media_items.id", ondelete="SET NULL"), nullable=True)
+    updated_at = Column(DateTime, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        # Prefix (LIKE 'root/%') lookups of the files under an import root
+        Index('ix_imported_files_path_pattern', 'path', postgresql_ops={'path': 'text_pattern_ops'}),
+        Index('ix_imported_files_content_hash', 'content_hash'),
+    )
 
 class Places(Base):
     """Places model."""
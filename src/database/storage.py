@@ -1,15 +1,67 @@
 """Email storage operations."""
 
-from typing import List, Set, Optional, Dict, Any, Tuple
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set, Optional, Dict, Any, Tuple, Callable, Iterable
 from datetime import datetime
 from io import BytesIO
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, insert, or_, update, exists, text, func, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, undefer
 
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 
-from .connection import Database
-from .models import Email, IMessage, FacebookAlbum, MediaMetadata, MediaBlob, MessageAttachment, AlbumMedia, utcnow
+from .blobstore import BlobStore, get_blob_store, read_blob
+from .bodycodec import encode_bodies, set_current_dictionary, train_dictionary
+from .connection import Database, get_database
+from .models import MESSAGE_NATURAL_KEY, NO_RENDITIONS_SIZE, PATH_KEYED_MEDIA_SOURCE, PATH_KEYED_MEDIA_SOURCE_WHERE, CompressionDictionary, Email, EmailLabel, GmailSyncState, ImportedFile, PendingEmailAttachment, Attachment, IMessage, FacebookAlbum, MediaMetadata, MediaBlob, MediaRendition, MessageAttachment, AlbumMedia, ReferenceDocument, utcnow
+
+
+# RETURNING column of an INSERT ... ON CONFLICT DO UPDATE that tells whether the row
+# already existed: PostgreSQL sets xmax on the row version written by the update branch.
+UPSERT_WAS_UPDATE = literal_column("xmax <> 0").label("was_update")
+
+# RETURNING column of a media_items upsert giving the blob the row pointed to before
+# the statement. The subquery reads the statement's snapshot, which still holds the
+# old row version; it is NULL for newly inserted rows.
+PREVIOUS_MEDIA_BLOB_ID = literal_column(
+    "(SELECT previous.media_blob_id FROM media_items AS previous WHERE previous.id = media_items.id)"
+).label("previous_blob_id")
+
+
+def folder_from_labels(labels: Iterable[str]) -> str:
+    """Build an email's folder string from its labels.
+    
+    Labels are de-duplicated and sorted, so the same message gets the same folder
+    (and so the same (uid, folder) row) whichever order its source lists them in.
+    """
+    return ",".join(sorted({label for label in labels if label}))
+
+
+def _split_folder(folder: Optional[str]) -> List[str]:
+    """Split an email's folder string (comma-separated labels) into its labels."""
+    labels = []
+    for label in (folder or "").split(","):
+        if label and label not in labels:
+            labels.append(label)
+    return labels
+
+
+def _replace_email_labels(session: Session, email_id: int, folder: Optional[str]):
+    """Make an email's email_labels rows match its folder string."""
+    labels = _split_folder(folder)
+    stale = delete(EmailLabel).where(EmailLabel.email_id == email_id)
+    if labels:
+        stale = stale.where(EmailLabel.label.notin_(labels))
+    session.execute(stale)
+    if labels:
+        session.execute(
+            pg_insert(EmailLabel)
+            .values([{"email_id": email_id, "label": label} for label in labels])
+            .on_conflict_do_nothing()
+        )
 
 
 class EmailStorage:
@@ -18,7 +70,7 @@ class EmailStorage:
     def __init__(self, db: Optional[Database] = None):
         """Initialize storage with database connection."""
         if db is None:
-            db = Database()
+            db = get_database()
         self.db = db
 
     def email_exists(self, uid: str, folder: str) -> bool:
@@ -42,6 +94,32 @@ class EmailStorage:
         finally:
             session.close()
 
+    def get_existing_uids_with_label(self, uids: List[str], label: str) -> Set[str]:
+        """Get the UIDs among uids that are already stored with the given label.
+        
+        One query for the whole list, joining the email_labels junction table.
+        
+        Args:
+            uids: Gmail message IDs to check (e.g. one listing page of up to 500)
+            label: Label the emails must have been stored with
+            
+        Returns:
+            Set of the UIDs that exist
+        """
+        if not uids:
+            return set()
+        session = self.db.get_session()
+        try:
+            rows = session.query(Email.uid).join(
+                EmailLabel, EmailLabel.email_id == Email.id
+            ).filter(
+                Email.uid.in_(uids),
+                EmailLabel.label == label
+            ).distinct().all()
+            return {row[0] for row in rows}
+        finally:
+            session.close()
+
     def save_email(
         self,
         uid: str,
@@ -56,122 +134,203 @@ class EmailStorage:
         raw_message: str,
         plain_text: Optional[str],
         attachments: Optional[List[Dict[str, Any]]] = None,
-    ) -> Email:
-        """Save email and attachments to database."""
+    ) -> int:
+        """Save email and attachments to database.
+        
+        The email row is written with a single INSERT ... ON CONFLICT (uid, folder)
+        DO UPDATE, so re-importing a message updates it in place.
+        
+        Returns:
+            ID of the inserted or updated email
+        """
         session = self.db.get_session()
         try:
-            # Check if email already exists
-            existing = session.query(Email).filter(
-                Email.uid == uid,
-                Email.folder == folder
-            ).first()
-            if existing:
-                # Update existing email
-                existing.subject = subject
-                existing.snippet = snippet
-                existing.from_address = from_address
-                existing.to_addresses = to_addresses
-                existing.cc_addresses = cc_addresses
-                existing.bcc_addresses = bcc_addresses
-                existing.date = date
-                existing.raw_message = raw_message
-                existing.plain_text = plain_text
-                email = existing
-            else:
-                # Create new email
-                email = Email(
-                    uid=uid,
-                    folder=folder,
-                    subject=subject,
-                    snippet=snippet,
-                    from_address=from_address,
-                    to_addresses=to_addresses,
-                    cc_addresses=cc_addresses,
-                    bcc_addresses=bcc_addresses,
-                    date=date,
-                    raw_message=raw_message,
-                    plain_text=plain_text,
-                )
-                session.add(email)
-                session.flush()  # Get the email ID
-
-            # Save attachments
-            has_saved_attachments = False
-            if attachments:
-                # Delete existing media items for this email if updating
-                if existing:
-                    session.query(MediaMetadata).filter(
-                        MediaMetadata.source == "email_attachment",
-                        MediaMetadata.source_reference == str(email.id)
-                    ).delete()
-
-                for att_data in attachments:
-                    attachment_data = att_data.get("data")
-                    thumbnail_data = att_data.get("thumbnail")
-                    content_type = att_data.get("mimeType") or att_data.get("content_type")
-                    
-                    # Create MediaBlob and MediaItem entries for unified media system
-                    if attachment_data is not None:
-                        try:
-                            # Extract EXIF data if it's an image
-                            exif_data = {}
-                            if content_type and content_type.startswith('image/'):
-                                try:
-                                    exif_data = extract_exif_data_from_bytes(attachment_data)
-                                except Exception as e:
-                                    print(f"Warning: Could not extract EXIF data from email attachment: {e}")
-                                    exif_data = {}
-                            
-                            # Create MediaBlob
-                            media_blob = MediaBlob(
-                                image_data=attachment_data,
-                                thumbnail_data=thumbnail_data
-                            )
-                            session.add(media_blob)
-                            session.flush()  # Get blob ID
-                            
-                            # Extract year and month - prefer EXIF data, fallback to email date
-                            year = exif_data.get('year')
-                            month = exif_data.get('month')
-                            if year is None or month is None:
-                                if email.date:
-                                    if isinstance(email.date, datetime):
-                                        year = email.date.year
-                                        month = email.date.month
-                            
-                            # Create MediaItem with source="email_attachment" and source_reference=email.id
-                            media_item = MediaMetadata(
-                                media_blob_id=media_blob.id,
-                                source="email_attachment",
-                                source_reference=str(email.id),  # Email ID as string in source_reference
-                                title=exif_data.get('title') or att_data.get("filename"),  # Use EXIF title if available, otherwise filename
-                                description=exif_data.get('description') or email.snippet,  # Use EXIF description if available, otherwise email snippet
-                                tags=email.subject,  # Use email subject as tags
-                                media_type=content_type,  # Store all content types (images, PDFs, etc.)
-                                year=year,
-                                month=month,
-                                latitude=exif_data.get('latitude'),
-                                longitude=exif_data.get('longitude'),
-                                altitude=exif_data.get('altitude'),
-                                has_gps=exif_data.get('has_gps', False)
-                            )
-                            session.add(media_item)
-                            has_saved_attachments = True
-                        except Exception as e:
-                            # Log error but don't fail the attachment save
-                            print(f"Warning: Could not create unified media entry for email attachment: {e}")
-
-            # Set has_attachments flag - True only if attachments passed filter and were saved
-            email.has_attachments = has_saved_attachments
-
+            email_id = self._write_email(
+                session, uid, folder, subject, snippet, from_address, to_addresses, cc_addresses,
+                bcc_addresses, date, raw_message, plain_text, attachments
+            )
             session.commit()
-            return email
+            return email_id
         except Exception:
             session.rollback()
             raise
         finally:
             session.close()
 
+    def save_emails(self, emails: List[Dict[str, Any]]) -> List[Optional[int]]:
+        """Save several emails in one transaction.
+        
+        Args:
+            emails: save_email keyword arguments, one dictionary per email
+            
+        Returns:
+            ID of each saved email in input order, None for emails that failed to save.
+            If the batch fails, its emails are saved one at a time so one bad email
+            does not lose the others.
+        """
+        if not emails:
+            return []
+        session = self.db.get_session()
+        try:
+            email_ids = [self._write_email(session, **email) for email in emails]
+            session.commit()
+            return email_ids
+        except Exception as e:
+            session.rollback()
+            if len(emails) == 1:
+                print(f"Error saving email {emails[0].get('uid')}: {e}")
+                return [None]
+            print(f"Warning: Saving a batch of {len(emails)} emails failed ({e}), saving them one at a time")
+        finally:
+            session.close()
+
+        email_ids = []
+        for email in emails:
+            try:
+                email_ids.append(self.save_email(**email))
+            except Exception as e:
+                print(f"Error saving email {email.get('uid')}: {e}")
+                email_ids.append(None)
+        return email_ids
+
+    def _write_email(
+        self,
+        session: Session,
+        uid: str,
+        folder: str,
+        subject: Optional[str],
+        snippet: Optional[str],
+        from_address: Optional[str],
+        to_addresses: Optional[str],
+        cc_addresses: Optional[str],
+        bcc_addresses: Optional[str],
+        date: Optional[Any],
+        raw_message: str,
+        plain_text: Optional[str],
+        attachments: Optional[List[Dict[str, Any]]] = None,
+    ) -> int:
+        """Write an email and its attachments in the given session without committing."""
+        values = {
+            "uid": uid,
+            "folder": folder,
+            "subject": subject,
+            "snippet": snippet,
+            "from_address": from_address,
+            "to_addresses": to_addresses,
+            "cc_addresses": cc_addresses,
+            "bcc_addresses": bcc_addresses,
+            "date": date,
+            **encode_bodies(session, self.db.config.email_bodies.compression, raw_message, plain_text,
+                            self.db.config.email_bodies.level),
+            # Corrected below if an attachment fails to save
+            "has_attachments": any(att.get("data") is not None for att in attachments or []),
+        }
+        stmt = pg_insert(Email).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Email.uid, Email.folder],
+            set_={
+                **{field: stmt.excluded[field] for field in values if field not in ("uid", "folder")},
+                "updated_at": utcnow(),
+            },
+        ).returning(Email.id, UPSERT_WAS_UPDATE)
+        email_id, existing = session.execute(stmt).one()
+        _replace_email_labels(session, email_id, folder)
+
+        # Save attachments
+        has_saved_attachments = False
+        if attachments:
+            # Delete existing media items for this email if updating
+            if existing:
+                session.query(MediaMetadata).filter(
+                    MediaMetadata.email_id == email_id
+                ).delete()
+                session.query(PendingEmailAttachment).filter(
+                    PendingEmailAttachment.email_id == email_id
+                ).delete()
+
+            for att_data in attachments:
+                if att_data.get("data") is None and att_data.get("attachmentId"):
+                    # Lazily downloaded attachment: keep its metadata until the body is fetched
+                    session.add(PendingEmailAttachment(
+                        email_id=email_id,
+                        gmail_attachment_id=att_data["attachmentId"],
+                        filename=att_data.get("filename"),
+                        mime_type=att_data.get("mimeType"),
+                        size=att_data.get("size"),
+                    ))
+                    continue
+                
+                # Create MediaBlob and MediaItem entries for unified media system
+                if att_data.get("data") is not None:
+                    try:
+                        self._add_email_media_item(session, email_id, att_data, date, subject, snippet)
+                        has_saved_attachments = True
+                    except Exception as e:
+                        # Log error but don't fail the attachment save
+                        print(f"Warning: Could not create unified media entry for email attachment: {e}")
+
+        # Set has_attachments flag - True only if attachments passed filter and were saved
+        if has_saved_attachments != values["has_attachments"]:
+            session.execute(
+                update(Email).where(Email.id == email_id).values(has_attachments=has_saved_attachments)
+            )
+
+        return email_id
+
+    def _add_email_media_item(
+        self,
+        session: Session,
+        email_id: int,
+        attachment: Dict[str, Any],
+        date: Optional[Any],
+        subject: Optional[str],
+        snippet: Optional[str],
+    ):
+        """Store a downloaded email attachment as a media item linked to the email."""
+        attachment_data = attachment["data"]
+        thumbnail_data = attachment.get("thumbnail")
+        content_type = attachment.get("mimeType") or attachment.get("content_type")
+        
+        # Extract EXIF data if it's an image (unless the caller already did)
+        exif_data = attachment.get("exif") or {}
+        if "exif" not in attachment and content_type and content_type.startswith('image/'):
+            try:
+                exif_data = extract_exif_data_from_bytes(attachment_data)
+            except Exception as e:
+                print(f"Warning: Could not extract EXIF data from email attachment: {e}")
+                exif_data = {}
+        
+        # Reuse the MediaBlob if this content is already stored
+        media_blob_id = get_or_create_media_blob(session, attachment_data, thumbnail_data)
+        
+        # Extract year and month - prefer EXIF data, fallback to email date
+        year = exif_data.get('year')
+        month = exif_data.get('month')
+        if year is None or month is None:
+            if date:
+                if isinstance(date, datetime):
+                    year = date.year
+                    month = date.month
+        
+        # Create MediaItem with source="email_attachment" and source_reference=email.id
+        media_item = MediaMetadata(
+            media_blob_id=media_blob_id,
+            source="email_attachment",
+            source_reference=str(email_id),  # Email ID as string in source_reference
+            email_id=email_id,
+            title=exif_data.get('title') or attachment.get("filename"),  # Use EXIF title if available, otherwise filename
+            description=exif_data.get('description') or snippet,  # Use EXIF description if available, otherwise email snippet
+            tags=subject,  # Use email subject as tags
+            media_type=content_type,  # Store all content types (images, PDFs, etc.)
+            year=year,
+            month=month,
+            latitude=exif_data.get('latitude'),
+            longitude=exif_data.get('longitude'),
+            altitude=exif_data.get('altitude'),
+            has_gps=exif_data.get('has_gps', False)
+        )
+        session.add(media_item)
+
     def get_email(self, email_id: int) -> Optional[Email]:
         """Get email by ID."""
         session = self.db.get_session()
@@ -180,6 +339,158 @@ class EmailStorage:
         finally:
             session.close()
 
+    def get_email_folders(self, uids: List[str]) -> Dict[str, str]:
+        """Get the stored folder (comma-separated labels) of each of the given UIDs that exists."""
+        if not uids:
+            return {}
+        session = self.db.get_session()
+        try:
+            rows = session.query(Email.uid, Email.folder).filter(Email.uid.in_(uids)).order_by(Email.id).all()
+            # The newest row wins where a UID was stored under several folders
+            return {uid: folder for uid, folder in rows}
+        finally:
+            session.close()
+
+    def update_email_folders(self, folders: Dict[str, str]) -> int:
+        """Set the folder of already stored emails after their labels changed.
+        
+        Updates the newest row of each UID, unless a row with the new folder already
+        exists for that UID.
+        
+        Args:
+            folders: Dictionary of UID to new folder (comma-separated labels)
+            
+        Returns:
+            Number of emails updated
+        """
+        if not folders:
+            return 0
+        statement = text("""
+            UPDATE emails SET folder = :folder, updated_at = :updated_at
+            WHERE id = (SELECT MAX(id) FROM emails WHERE uid = :uid)
+            AND folder <> :folder
+            AND NOT EXISTS (SELECT 1 FROM emails AS other WHERE other.uid = :uid AND other.folder = :folder)
+            RETURNING id
+        """)
+        session = self.db.get_session()
+        try:
+            # One statement per UID, as each updated row's labels are replaced too
+            updated = 0
+            for uid, folder in folders.items():
+                email_id = session.execute(statement, {"uid": uid, "folder": folder, "updated_at": utcnow()}).scalar()
+                if email_id is not None:
+                    _replace_email_labels(session, email_id, folder)
+                    updated += 1
+            session.commit()
+            return updated
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_sync_history_id(self, label: str) -> Optional[str]:
+        """Get the Gmail history ID the label was last synced to, if any."""
+        session = self.db.get_session()
+        try:
+            return session.query(GmailSyncState.history_id).filter(GmailSyncState.label == label).scalar()
+        finally:
+            session.close()
+
+    def set_sync_history_id(self, label: str, history_id: str):
+        """Record the Gmail history ID the label is now synced to."""
+        session = self.db.get_session()
+        try:
+            stmt = pg_insert(GmailSyncState).values(label=label, history_id=history_id, updated_at=utcnow())
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[GmailSyncState.label],
+                set_={"history_id": stmt.excluded.history_id, "updated_at": stmt.excluded.updated_at},
+            )
+            session.execute(stmt)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_pending_attachments(self, limit: int, after_id: int = 0, max_attempts: int = 3) -> List[Dict[str, Any]]:
+        """Get email attachments waiting to be downloaded, in ID order.
+        
+        Args:
+            limit: Maximum number of attachments to return
+            after_id: Only return attachments with a higher ID (for paging through them)
+            max_attempts: Skip attachments whose download already failed this many times
+            
+        Returns:
+            List of dictionaries with the pending attachment's columns plus the email's
+            uid (Gmail message ID), date, subject and snippet
+        """
+        session = self.db.get_session()
+        try:
+            rows = session.query(
+                PendingEmailAttachment, Email.uid, Email.date, Email.subject, Email.snippet
+            ).join(
+                Email, Email.id == PendingEmailAttachment.email_id
+            ).filter(
+                PendingEmailAttachment.id > after_id,
+                PendingEmailAttachment.attempts < max_attempts
+            ).order_by(PendingEmailAttachment.id).limit(limit).all()
+            return [
+                {
+                    "id": pending.id,
+                    "email_id": pending.email_id,
+                    "gmail_attachment_id": pending.gmail_attachment_id,
+                    "filename": pending.filename,
+                    "mime_type": pending.mime_type,
+                    "size": pending.size,
+                    "uid": uid,
+                    "date": date,
+                    "subject": subject,
+                    "snippet": snippet,
+                }
+                for pending, uid, date, subject, snippet in rows
+            ]
+        finally:
+            session.close()
+
+    def save_downloaded_attachment(self, pending: Dict[str, Any], attachment: Dict[str, Any]):
+        """Store a downloaded attachment as a media item and drop it from the pending attachments.
+        
+        Args:
+            pending: Pending attachment as returned by get_pending_attachments
+            attachment: The attachment with its data decoded to bytes (see ingest.prepare_attachment)
+        """
+        session = self.db.get_session()
+        try:
+            self._add_email_media_item(
+                session, pending["email_id"], attachment, pending["date"], pending["subject"], pending["snippet"]
+            )
+            session.execute(update(Email).where(Email.id == pending["email_id"]).values(has_attachments=True))
+            session.execute(delete(PendingEmailAttachment).where(PendingEmailAttachment.id == pending["id"]))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def record_attachment_download_failure(self, pending_id: int, error: str):
+        """Count a failed download of a pending attachment."""
+        session = self.db.get_session()
+        try:
+            session.execute(
+                update(PendingEmailAttachment)
+                .where(PendingEmailAttachment.id == pending_id)
+                .values(attempts=PendingEmailAttachment.attempts + 1, last_error=error)
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
 
 def _convert_to_degrees(value):
     """Convert GPS coordinate to decimal degrees.
@@ -318,7 +629,644 @@ def extract_exif_data_from_bytes(image_data: bytes) -> Dict[str, Any]:
     except Exception as e:
         print(f"Warning: Could not extract EXIF data from image bytes: {e}")
     
-    return exif_data
+    return exif_data
+
+
+def compute_content_hash(data: Optional[bytes]) -> Optional[str]:
+    """Get the SHA-256 hex digest used to address media blob content."""
+    if data is None:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_or_create_media_blobs(session: Session, blob_rows: List[Dict[str, Any]]) -> List[int]:
+    """Resolve media blobs by content hash, inserting only content not already stored.
+    
+    Each row is a dict with image_data and optional thumbnail_data. Rows whose
+    image_data is already stored (or repeated within blob_rows) reuse the existing
+    blob; a missing thumbnail on a reused blob is filled in from the row. Rows
+    without image_data always get a new blob since there is nothing to address.
+    
+    Args:
+        session: Open session; the caller owns the transaction
+        blob_rows: Blob column values
+        
+    Returns:
+        List of MediaBlob IDs, one per row, in input order
+    """
+    hashes = [compute_content_hash(row.get("image_data")) for row in blob_rows]
+    wanted = {h for h in hashes if h is not None}
+
+    blob_ids: Dict[str, int] = {}
+    missing_thumbnails = set()
+    if wanted:
+        existing = session.query(
+            MediaBlob.id, MediaBlob.content_hash, MediaBlob.thumbnail_data.is_(None).label("missing_thumbnail")
+        ).filter(MediaBlob.content_hash.in_(wanted)).all()
+        for row in existing:
+            blob_ids[row.content_hash] = row.id
+            if row.missing_thumbnail:
+                missing_thumbnails.add(row.content_hash)
+
+    # First row for each unseen hash becomes the new blob. With an external blob
+    # store the content is written there and the row only keeps its key.
+    blob_store = get_blob_store()
+    new_rows = {}
+    for row, content_hash in zip(blob_rows, hashes):
+        if content_hash is not None and content_hash not in blob_ids and content_hash not in new_rows:
+            image_data = row.get("image_data")
+            image_key = blob_store.put(image_data, key=content_hash)
+            new_rows[content_hash] = {
+                "image_data": None if image_key else image_data,
+                "image_key": image_key,
+                "size": len(image_data),
+                "thumbnail_data": row.get("thumbnail_data"),
+                "content_hash": content_hash,
+            }
+
+    if new_rows:
+        inserted = session.execute(
+            pg_insert(MediaBlob)
+            .on_conflict_do_nothing(index_elements=[MediaBlob.content_hash])
+            .returning(MediaBlob.id, MediaBlob.content_hash),
+            list(new_rows.values()),
+        ).all()
+        for row in inserted:
+            blob_ids[row.content_hash] = row.id
+
+        # Another writer stored the same content concurrently
+        raced = [h for h in new_rows if h not in blob_ids]
+        if raced:
+            for row in session.query(MediaBlob.id, MediaBlob.content_hash).filter(MediaBlob.content_hash.in_(raced)).all():
+                blob_ids[row.content_hash] = row.id
+
+    # Fill in thumbnails that the existing blob was stored without
+    for row, content_hash in zip(blob_rows, hashes):
+        if content_hash in missing_thumbnails and row.get("thumbnail_data") is not None:
+            session.execute(
+                update(MediaBlob)
+                .where(MediaBlob.id == blob_ids[content_hash], MediaBlob.thumbnail_data.is_(None))
+                .values(thumbnail_data=row["thumbnail_data"], updated_at=utcnow())
+            )
+            missing_thumbnails.discard(content_hash)
+
+    # Blobs without content are never shared
+    result = []
+    for row, content_hash in zip(blob_rows, hashes):
+        if content_hash is None:
+            media_blob = MediaBlob(image_data=None, thumbnail_data=row.get("thumbnail_data"))
+            session.add(media_blob)
+            session.flush()
+            result.append(media_blob.id)
+        else:
+            result.append(blob_ids[content_hash])
+    return result
+
+
+def get_or_create_media_blob(session: Session, image_data: Optional[bytes], thumbnail_data: Optional[bytes] = None) -> int:
+    """Get the ID of the blob holding image_data, creating it if the content is new."""
+    return get_or_create_media_blobs(session, [{"image_data": image_data, "thumbnail_data": thumbnail_data}])[0]
+
+
+def get_media_blob_content(media_blob: Optional[MediaBlob]) -> Optional[bytes]:
+    """Get a media blob's image content, wherever the blob store keeps it."""
+    if media_blob is None:
+        return None
+    return read_blob(media_blob.image_data, media_blob.image_key)
+
+
+def media_blob_size_expression():
+    """SQL expression for a blob's content length that never reads the content itself."""
+    return func.coalesce(MediaBlob.size, func.octet_length(MediaBlob.image_data))
+
+
+def _upsert_imported_files(session: Session, files: List[Dict[str, Any]]):
+    """Insert or update imported_files manifest entries, keyed by path."""
+    if not files:
+        return
+    rows = [{**row, "updated_at": utcnow()} for row in files]
+    stmt = pg_insert(ImportedFile)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ImportedFile.path],
+        set_={column: stmt.excluded[column] for column in ("size", "mtime_ns", "content_hash", "media_item_id", "updated_at")},
+    )
+    session.execute(stmt, rows)
+
+
+def _insert_renditions(session: Session, renditions_by_blob: Dict[int, List[Tuple[int, str, int, int, bytes]]]) -> int:
+    """Insert media_renditions rows; sizes a concurrent request already stored are kept.
+    
+    A blob with an empty list gets the NO_RENDITIONS_SIZE marker row.
+    
+    Returns:
+        Number of renditions inserted, not counting markers
+    """
+    no_renditions = {blob_id: [(NO_RENDITIONS_SIZE, "", 0, 0, b"")] for blob_id, renditions in renditions_by_blob.items() if not renditions}
+    rows = [
+        {
+            "media_blob_id": blob_id,
+            "size": size,
+            "content_type": content_type,
+            "width": width,
+            "height": height,
+            "data": data,
+            "created_at": utcnow(),
+        }
+        for blob_id, renditions in {**renditions_by_blob, **no_renditions}.items()
+        for size, content_type, width, height, data in renditions
+    ]
+    if rows:
+        session.execute(pg_insert(MediaRendition).on_conflict_do_nothing(), rows)
+    return len(rows) - len(no_renditions)
+
+
+def delete_unreferenced_media_blobs(session: Session, blob_ids: Optional[List[int]] = None) -> int:
+    """Delete media blobs that no media item references any more.
+    
+    Args:
+        session: Open session; the caller owns the transaction
+        blob_ids: Candidate blob IDs. If None, every orphaned blob is deleted.
+        
+    Returns:
+        Number of blobs deleted
+    """
+    session.flush()
+    statement = delete(MediaBlob).where(
+        ~exists().where(MediaMetadata.media_blob_id == MediaBlob.id)
+    )
+    if blob_ids is not None:
+        blob_ids = [blob_id for blob_id in blob_ids if blob_id is not None]
+        if not blob_ids:
+            return 0
+        statement = statement.where(MediaBlob.id.in_(blob_ids))
+    result = session.execute(statement.execution_options(synchronize_session=False))
+    return result.rowcount
+
+
+def _merge_media_blob(session: Session, duplicate_id: int, target_id: int):
+    """Fold a blob into another with the same content.
+    
+    The duplicate's media items are repointed to the target, its thumbnail is
+    donated if the target has none, and it is deleted.
+    """
+    session.execute(
+        update(MediaMetadata).where(MediaMetadata.media_blob_id == duplicate_id).values(media_blob_id=target_id)
+    )
+    session.execute(text(
+        "UPDATE media_blob SET thumbnail_data = duplicate.thumbnail_data "
+        "FROM media_blob AS duplicate "
+        "WHERE media_blob.id = :target_id AND duplicate.id = :duplicate_id "
+        "AND media_blob.thumbnail_data IS NULL"
+    ), {"target_id": target_id, "duplicate_id": duplicate_id})
+    session.execute(delete(MediaBlob).where(MediaBlob.id == duplicate_id))
+
+
+def deduplicate_media_blobs(
+    db: Database,
+    batch_size: int = 500,
+    progress_callback: Optional[Any] = None,
+) -> Dict[str, int]:
+    """Backfill media_blob.content_hash and merge blobs with identical content.
+    
+    Hashing is done by PostgreSQL (sha256()), so blob bytes are not transferred.
+    Blobs already moved to the filesystem blob store take their key, which is the
+    same SHA-256 digest. Each duplicate has its media items repointed to the first
+    blob seen with the same content, donates its thumbnail if that blob has none,
+    and is then deleted. Commits once per batch, so the job can be stopped and
+    re-run safely.
+    
+    Args:
+        db: Database connection
+        batch_size: Number of unhashed blobs handled per transaction
+        progress_callback: Optional function called with the running stats after each batch
+        
+    Returns:
+        Dictionary with blobs_hashed, blobs_merged and bytes_freed (bytes of
+        database content removed; duplicates in the blob store share one file)
+    """
+    stats = {"blobs_hashed": 0, "blobs_merged": 0, "bytes_freed": 0}
+
+    while True:
+        session = db.get_session()
+        try:
+            rows = session.execute(text(
+                "SELECT id, COALESCE(image_key, encode(sha256(image_data), 'hex')) AS content_hash, "
+                "COALESCE(size, octet_length(image_data)) AS size, "
+                "octet_length(image_data) AS inline_size "
+                "FROM media_blob "
+                "WHERE content_hash IS NULL AND (image_data IS NOT NULL OR image_key IS NOT NULL) "
+                "ORDER BY id LIMIT :limit"
+            ), {"limit": batch_size}).all()
+            if not rows:
+                break
+
+            canonical = {
+                row.content_hash: row.id
+                for row in session.query(MediaBlob.content_hash, MediaBlob.id).filter(
+                    MediaBlob.content_hash.in_({row.content_hash for row in rows})
+                ).all()
+            }
+
+            for row in rows:
+                target_id = canonical.get(row.content_hash)
+                if target_id is None:
+                    session.execute(
+                        update(MediaBlob).where(MediaBlob.id == row.id).values(content_hash=row.content_hash, size=row.size)
+                    )
+                    canonical[row.content_hash] = row.id
+                    stats["blobs_hashed"] += 1
+                    continue
+
+                _merge_media_blob(session, row.id, target_id)
+                stats["blobs_merged"] += 1
+                stats["bytes_freed"] += row.inline_size or 0
+
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if progress_callback:
+            progress_callback(stats.copy())
+
+    return stats
+
+
+def backfill_media_renditions(
+    db: Database,
+    batch_size: int = 32,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, int]:
+    """Create the display renditions of image blobs stored without any.
+    
+    Blobs are read in ID order, in batches of batch_size; each batch is resized on
+    the INGEST_CPU_WORKERS process pool and committed, so the job can be stopped and
+    re-run. Images that give no renditions (animated, or not decodable by Pillow)
+    are counted as skipped, marked with a NO_RENDITIONS_SIZE row and served in full.
+    
+    Args:
+        db: Database connection
+        batch_size: Blobs read and committed per transaction
+        progress_callback: Optional function called with the running stats after each batch
+        
+    Returns:
+        Dictionary with blobs_processed, blobs_skipped, renditions_created and bytes_written
+    """
+    # Import here to avoid circular import
+    from src.services.process_images_service import ProcessImagesService
+    process_images_service = ProcessImagesService()
+
+    stats = {"blobs_processed": 0, "blobs_skipped": 0, "renditions_created": 0, "bytes_written": 0}
+    last_id = 0
+    while True:
+        session = db.get_session()
+        try:
+            blobs = session.query(MediaBlob.id, MediaBlob.image_data, MediaBlob.image_key).filter(
+                MediaBlob.id > last_id,
+                or_(MediaBlob.image_data.isnot(None), MediaBlob.image_key.isnot(None)),
+                exists().where(
+                    MediaMetadata.media_blob_id == MediaBlob.id,
+                    MediaMetadata.media_type.like("image/%"),
+                ),
+                ~exists().where(MediaRendition.media_blob_id == MediaBlob.id),
+            ).order_by(MediaBlob.id).limit(batch_size).all()
+            if not blobs:
+                break
+            last_id = blobs[-1].id
+
+            images = []
+            for blob in blobs:
+                try:
+                    images.append(read_blob(blob.image_data, blob.image_key))
+                except OSError as e:
+                    print(f"Error reading media blob {blob.id}: {e}")
+                    images.append(None)
+
+            renditions_by_blob = {}
+            for blob, image_data, renditions in zip(blobs, images, process_images_service.create_renditions_batch(images)):
+                if renditions:
+                    stats["blobs_processed"] += 1
+                    stats["bytes_written"] += sum(len(rendition[4]) for rendition in renditions)
+                else:
+                    stats["blobs_skipped"] += 1
+                # Content that could not be read is retried by the next run; images
+                # that gave no renditions are marked so they are not decoded again
+                if image_data is not None:
+                    renditions_by_blob[blob.id] = renditions
+            stats["renditions_created"] += _insert_renditions(session, renditions_by_blob)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        if progress_callback:
+            progress_callback(stats.copy())
+
+    return stats
+
+
+# (model, inline content column, blob store key column) for every externalizable column
+BLOB_COLUMNS = (
+    (MediaBlob, "image_data", "image_key"),
+    (Attachment, "data", "data_key"),
+    (ReferenceDocument, "data", "data_key"),
+)
+
+
+def move_blobs_to_store(
+    db: Database,
+    blob_store: BlobStore,
+    batch_size: int = 100,
+    workers: int = 8,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Move content out of the bytea columns into an external blob store.
+    
+    Rows are read in batches; each batch's content is hashed and written to the
+    store by a thread pool, then the rows are updated to hold only the key and
+    committed. Files are fsynced before the commit, so an interrupted run leaves
+    at most some unreferenced files behind and can simply be re-run.
+    
+    Media blobs not hashed yet take their key as content_hash; one whose content
+    another blob already holds is merged into that blob instead of moved, as
+    deduplicate_media_blobs does.
+    
+    Args:
+        db: Database connection
+        blob_store: Destination store; must be external
+        batch_size: Rows read and committed per transaction
+        workers: Number of concurrent file writes
+        progress_callback: Optional function called with the running stats after each batch
+        
+    Returns:
+        Dictionary with rows_moved, bytes_moved, blobs_merged and errors
+    """
+    if not blob_store.external:
+        raise ValueError("Destination blob store keeps content in the database; set BLOB_STORE_BACKEND=filesystem")
+
+    stats = {"rows_moved": 0, "bytes_moved": 0, "blobs_merged": 0, "errors": 0}
+
+    def write(row):
+        data = bytes(row.data)
+        return row.id, blob_store.put(data), len(data)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for model, data_attr, key_attr in BLOB_COLUMNS:
+            data_column = getattr(model, data_attr)
+            key_column = getattr(model, key_attr)
+            last_id = 0
+            while True:
+                session = db.get_session()
+                try:
+                    columns = [model.id, data_column.label("data")]
+                    if model is MediaBlob:
+                        columns.append(MediaBlob.content_hash)
+                    rows = session.query(*columns).filter(
+                        model.id > last_id,
+                        data_column.isnot(None),
+                        key_column.is_(None),
+                    ).order_by(model.id).limit(batch_size).all()
+                    if not rows:
+                        break
+                    last_id = rows[-1].id
+
+                    updates = []
+                    unhashed = {}
+                    futures = [executor.submit(write, row) for row in rows]
+                    for row, future in zip(rows, futures):
+                        try:
+                            row_id, key, size = future.result()
+                        except Exception as e:
+                            print(f"Error writing {model.__tablename__} content to blob store: {e}")
+                            stats["errors"] += 1
+                            continue
+                        values = {"id": row_id, data_attr: None, key_attr: key}
+                        if model is MediaBlob:
+                            # The key is the SHA-256 of the content, so it is the content hash too
+                            values["size"] = size
+                            values["content_hash"] = key
+                            if row.content_hash is None:
+                                unhashed[row_id] = key
+                        updates.append(values)
+                        stats["rows_moved"] += 1
+                        stats["bytes_moved"] += size
+
+                    # Blobs not hashed yet may hold content another blob already has
+                    merges = []
+                    if unhashed:
+                        canonical = dict(
+                            session.query(MediaBlob.content_hash, MediaBlob.id).filter(
+                                MediaBlob.content_hash.in_(set(unhashed.values()))
+                            ).all()
+                        )
+                        for row_id, key in unhashed.items():
+                            target_id = canonical.setdefault(key, row_id)
+                            if target_id != row_id:
+                                merges.append((row_id, target_id))
+                        merged_ids = {row_id for row_id, _ in merges}
+                        updates = [values for values in updates if values["id"] not in merged_ids]
+
+                    if updates:
+                        session.execute(update(model), updates)
+                    for row_id, target_id in merges:
+                        _merge_media_blob(session, row_id, target_id)
+                        stats["blobs_merged"] += 1
+                    session.commit()
+                except Exception:
+                    session.rollback()
+                    raise
+                finally:
+                    session.close()
+
+                if progress_callback:
+                    progress_callback(stats.copy())
+
+    return stats
+
+
+def train_email_body_dictionary(db: Database, codec: str, sample_size: int = 2000) -> Optional[int]:
+    """Train an HTML dictionary for codec on a random sample of stored email bodies.
+    
+    The dictionary is stored in compression_dictionaries and becomes the one new
+    HTML bodies are compressed with.
+    
+    Args:
+        db: Database connection
+        codec: "zlib" or "zstd"
+        sample_size: Maximum number of uncompressed HTML bodies to train on
+        
+    Returns:
+        ID of the new dictionary, or None if there are no uncompressed bodies to train on
+    """
+    session = db.get_session()
+    try:
+        sample_ids = session.query(Email.id).filter(
+            Email.raw_message.isnot(None),
+            Email.raw_message != ""
+        ).order_by(func.random()).limit(sample_size).subquery()
+        samples = [
+            row[0].encode("utf-8")
+            for row in session.query(Email.raw_message).filter(Email.id.in_(sample_ids.select())).all()
+        ]
+        if not samples:
+            return None
+        data = train_dictionary(codec, samples)
+        dictionary = CompressionDictionary(codec=codec, data=data, sample_count=len(samples))
+        session.add(dictionary)
+        session.commit()
+        set_current_dictionary(codec, dictionary.id, data)
+        return dictionary.id
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def compress_email_bodies(
+    db: Database,
+    codec: str,
+    level: Optional[int] = None,
+    batch_size: int = 500,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Compress the bodies of emails stored uncompressed.
+    
+    Rows are read in ID order and committed in batches, so an interrupted run can
+    simply be re-run.
+    
+    Args:
+        db: Database connection
+        codec: "zlib" or "zstd"
+        level: Compression level; None uses the codec's default
+        batch_size: Rows read and committed per transaction
+        progress_callback: Optional function called with the running stats after each batch
+        
+    Returns:
+        Dictionary with rows_compressed, bytes_before and bytes_after
+    """
+    stats = {"rows_compressed": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = 0
+    while True:
+        session = db.get_session()
+        try:
+            rows = session.query(Email.id, Email.raw_message, Email.plain_text).filter(
+                Email.id > last_id,
+                Email.body_codec.is_(None)
+            ).order_by(Email.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            
+            updates = []
+            for row in rows:
+                values = encode_bodies(session, codec, row.raw_message, row.plain_text, level)
+                updates.append({"id": row.id, **values})
+                stats["rows_compressed"] += 1
+                stats["bytes_before"] += sum(len(body.encode("utf-8")) for body in (row.raw_message, row.plain_text) if body)
+                stats["bytes_after"] += sum(
+                    len(body) for body in (values["raw_message_compressed"], values["plain_text_compressed"]) if body
+                )
+            session.execute(update(Email), updates)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        
+        if progress_callback:
+            progress_callback(stats.copy())
+    
+    return stats
+
+
+def delete_unreferenced_blob_files(db: Database, blob_store: BlobStore) -> int:
+    """Delete files in the blob store that no row refers to any more.
+    
+    Rows are deleted without touching the store, since content-addressed files
+    may be shared between rows and tables; this sweep reclaims the space. Run it
+    while no import is writing, as content is stored before its row is committed.
+    
+    Args:
+        db: Database connection
+        blob_store: Store to sweep
+        
+    Returns:
+        Number of files deleted
+    """
+    session = db.get_session()
+    try:
+        referenced = set()
+        for model, _, key_attr in BLOB_COLUMNS:
+            key_column = getattr(model, key_attr)
+            referenced.update(key for (key,) in session.query(key_column).filter(key_column.isnot(None)))
+    finally:
+        session.close()
+
+    deleted = 0
+    for key in list(blob_store.keys()):
+        if key not in referenced:
+            blob_store.delete(key)
+            deleted += 1
+    return deleted
+
+
+# Natural key used to detect duplicate messages (see models.MESSAGE_NATURAL_KEY)
+MESSAGE_KEY_FIELDS = ("chat_session", "message_date", "sender_id", "type")
+
+# Columns written from message_data by the message save paths
+MESSAGE_FIELDS = (
+    "chat_session",
+    "message_date",
+    "delivered_date",
+    "read_date",
+    "edited_date",
+    "service",
+    "type",
+    "sender_id",
+    "sender_name",
+    "status",
+    "replying_to",
+    "subject",
+    "text",
+    "is_group_chat",
+)
+
+
+def _message_key(values: Dict[str, Any]) -> tuple:
+    """Normalise a message's natural key the way the unique index does, so NULL and '' match."""
+    chat_session, message_date, sender_id, message_type = (values.get(field) for field in MESSAGE_KEY_FIELDS)
+    return (chat_session or "", message_date, sender_id or "", message_type or "")
+
+
+def _upsert_messages(session: Session, rows: List[Dict[str, Any]]) -> Dict[tuple, Tuple[int, bool]]:
+    """Insert or update messages by natural key with INSERT ... ON CONFLICT DO UPDATE.
+    
+    rows must not repeat a key, since one statement cannot update a row twice.
+    
+    Returns:
+        dict: normalised key -> (message_id, is_update)
+    """
+    stmt = pg_insert(IMessage)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(MESSAGE_NATURAL_KEY),
+        set_={
+            **{field: stmt.excluded[field] for field in MESSAGE_FIELDS if field not in MESSAGE_KEY_FIELDS},
+            "updated_at": utcnow(),
+        },
+    ).returning(
+        IMessage.id, IMessage.chat_session, IMessage.message_date, IMessage.sender_id, IMessage.type,
+        UPSERT_WAS_UPDATE,
+    )
+    return {
+        _message_key(row._mapping): (row.id, row.was_update)
+        for row in session.execute(stmt, rows)
+    }
 
 
 class IMessageStorage:
@@ -327,7 +1275,7 @@ class IMessageStorage:
     def __init__(self, db: Optional[Database] = None):
         """Initialize storage with database connection."""
         if db is None:
-            db = Database()
+            db = get_database()
         self.db = db
 
     def save_imessage(
@@ -337,7 +1285,7 @@ class IMessageStorage:
         attachment_filename: Optional[str] = None,
         attachment_type: Optional[str] = None,
         source: Optional[str] = None
-    ) -> Tuple[IMessage, bool]:
+    ) -> Tuple[int, bool]:
         """Save iMessage to database. Updates existing message if found, otherwise creates new one.
         
         If attachment_data is provided, it will be saved to media_blob/media_items tables
@@ -348,9 +1296,10 @@ class IMessageStorage:
         - message_date
         - sender_id
         - type (Incoming/Outgoing)
+        The message row is written with a single INSERT ... ON CONFLICT on that key.
         
         Returns:
-            tuple: (IMessage instance, is_update: bool) where is_update is True if message was updated, False if created
+            tuple: (message_id, is_update: bool) where is_update is True if message was updated, False if created
         """
         session = self.db.get_session()
 
@@ -360,122 +1309,36 @@ class IMessageStorage:
             message_data["is_group_chat"] = True
             
         try:
-            # Check if message already exists
-            existing = session.query(IMessage).filter(
-                IMessage.chat_session == message_data.get("chat_session"),
-                IMessage.message_date == message_data.get("message_date"),
-                IMessage.sender_id == message_data.get("sender_id"),
-                IMessage.type == message_data.get("type")
-            ).first()
+            row = {field: message_data.get(field) for field in MESSAGE_FIELDS}
+            message_id, is_update = _upsert_messages(session, [row])[_message_key(row)]
             
-            if existing:
-                # Update existing message
-                existing.delivered_date = message_data.get("delivered_date")
-                existing.read_date = message_data.get("read_date")
-                existing.edited_date = message_data.get("edited_date")
-                existing.service = message_data.get("service")
-                existing.sender_name = message_data.get("sender_name")
-                existing.status = message_data.get("status")
-                existing.replying_to = message_data.get("replying_to")
-                existing.subject = message_data.get("subject")
-                existing.text = message_data.get("text")
-                existing.is_group_chat = message_data.get("is_group_chat")
-                
+            if is_update:
                 # Delete existing message attachments if updating
-                session.query(MessageAttachment).filter(MessageAttachment.message_id == existing.id).delete()
-                
-                imessage = existing
-                is_update = True
-            else:
-                # Create new message
-                imessage = IMessage(
-                    chat_session=message_data.get("chat_session"),
-                    message_date=message_data.get("message_date"),
-                    delivered_date=message_data.get("delivered_date"),
-                    read_date=message_data.get("read_date"),
-                    edited_date=message_data.get("edited_date"),
-                    service=message_data.get("service"),
-                    type=message_data.get("type"),
-                    sender_id=message_data.get("sender_id"),
-                    sender_name=message_data.get("sender_name"),
-                    status=message_data.get("status"),
-                    replying_to=message_data.get("replying_to"),
-                    subject=message_data.get("subject"),
-                    text=message_data.get("text"),
-                    is_group_chat=message_data.get("is_group_chat"),
-                )
-                session.add(imessage)
-                session.flush()  # Get message ID
-                is_update = False
+                session.execute(delete(MessageAttachment).where(MessageAttachment.message_id == message_id))
             
             # Handle attachment if provided
             if attachment_data is not None:
                 try:
-                    # Create thumbnail if it's an image
-                    thumbnail_data = None
-                    exif_data = {}
-
-                    
-                    if attachment_type and attachment_type.startswith('image/'):
-                        # Import here to avoid circular import
-                        from src.services.process_images_service import ProcessImagesService
-                        process_images_service = ProcessImagesService()
-                        thumbnail_data, exif_data = process_images_service.create_thumb_and_get_exif(attachment_data, process_thunbnail=True, process_exif=True, width=200)
-                        # try:
-                        #     from ..imageimport.filesystemimport import create_thumbnail
-                        #     thumbnail_data = create_thumbnail(attachment_data)
-                        # except Exception as e:
-                        #     print(f"Warning: Could not create thumbnail for message attachment: {e}")
-                        
-                        # # Extract EXIF data including GPS location
-                        # try:
-                        #     exif_data = extract_exif_data_from_bytes(attachment_data)
-                        # except Exception as e:
-                        #     print(f"Warning: Could not extract EXIF data from message attachment: {e}")
-                        #     exif_data = {}
-                    
-                    # Create MediaBlob
-                    media_blob = MediaBlob(
-                        image_data=attachment_data,
-                        thumbnail_data=thumbnail_data
+                    blob_row, metadata_row = self._build_attachment_rows(
+                        message_data, attachment_data, attachment_filename, attachment_type, source
                     )
-                    session.add(media_blob)
-                    session.flush()  # Get blob ID
-                    
-                    # Extract year and month - prefer EXIF data, fallback to message date
-                    year = exif_data.get('year')
-                    month = exif_data.get('month')
-                    if year is None or month is None:
-                        message_date = message_data.get("message_date")
-                        if message_date:
-                            if isinstance(message_date, datetime):
-                                year = message_date.year
-                                month = message_date.month
-                    
-                    if source == None:
-                        source = "message_attachment"
+
+                    # Reuse the MediaBlob if this content is already stored
+                    media_blob_id = get_or_create_media_blob(session, **blob_row)
+
                     # Create MediaMetadata entry with GPS data if available
                     media_item = MediaMetadata(
-                        media_blob_id=media_blob.id,
-                        tags=message_data.get("chat_session"),
-                        source=source,
-                        source_reference=str(imessage.id),
-                        title=exif_data.get('title') or attachment_filename,
-                        description=exif_data.get('description') if exif_data else None,
-                        media_type=attachment_type,
-                        year=year,
-                        month=month,
-                        latitude=exif_data.get('latitude')if exif_data else None,
-                        longitude=exif_data.get('longitude')if exif_data else None,
-                        altitude=exif_data.get('altitude')if exif_data else None,
-                        has_gps=exif_data.get('has_gps', False)if exif_data else None,
+                        media_blob_id=media_blob_id,
+                        source_reference=str(message_id),
+                        message_id=message_id,
+                        **metadata_row
                     )
                     session.add(media_item)
                     session.flush()  # Get media_item ID
                     
                     # Create MessageAttachment junction entry
                     message_attachment = MessageAttachment(
-                        message_id=imessage.id,
+                        message_id=message_id,
                         media_item_id=media_item.id
                     )
                     session.add(message_attachment)
@@ -483,7 +1346,183 @@ class IMessageStorage:
                     print(f"Warning: Could not create unified media entry for message attachment: {e}")
             
             session.commit()
-            return (imessage, is_update)
+            return (message_id, is_update)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+    def _build_attachment_rows(
+        self,
+        message_data: Dict[str, Any],
+        attachment_data: bytes,
+        attachment_filename: Optional[str],
+        attachment_type: Optional[str],
+        source: Optional[str],
+        image_result: Optional[Tuple[Optional[bytes], Optional[Dict[str, Any]]]] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Build the media_blob and media_items column values for a message attachment.
+        
+        Thumbnail and EXIF extraction happen here (unless image_result already holds
+        the attachment's (thumbnail, exif)), so callers can do this CPU work before
+        checking out a database connection.
+        
+        Returns:
+            tuple: (blob_row, metadata_row). metadata_row has no media_blob_id or
+            source_reference; those are only known once the rows are inserted.
+        """
+        # Create thumbnail if it's an image
+        thumbnail_data = None
+        exif_data = {}
+
+        if image_result is not None:
+            thumbnail_data, exif_data = image_result
+        elif attachment_type and attachment_type.startswith('image/'):
+            # Import here to avoid circular import
+            from src.services.process_images_service import ProcessImagesService
+            process_images_service = ProcessImagesService()
+            thumbnail_data, exif_data = process_images_service.create_thumb_and_get_exif(attachment_data, process_thunbnail=True, process_exif=True, width=200)
+
+        # Extract year and month - prefer EXIF data, fallback to message date
+        year = exif_data.get('year') if exif_data else None
+        month = exif_data.get('month') if exif_data else None
+        if year is None or month is None:
+            message_date = message_data.get("message_date")
+            if message_date:
+                if isinstance(message_date, datetime):
+                    year = message_date.year
+                    month = message_date.month
+
+        if source == None:
+            source = "message_attachment"
+
+        blob_row = {
+            "image_data": attachment_data,
+            "thumbnail_data": thumbnail_data,
+        }
+        metadata_row = {
+            "tags": message_data.get("chat_session"),
+            "source": source,
+            "title": exif_data.get('title') or attachment_filename if exif_data else attachment_filename,
+            "description": exif_data.get('description') if exif_data else None,
+            "media_type": attachment_type,
+            "year": year,
+            "month": month,
+            "latitude": exif_data.get('latitude') if exif_data else None,
+            "longitude": exif_data.get('longitude') if exif_data else None,
+            "altitude": exif_data.get('altitude') if exif_data else None,
+            "has_gps": exif_data.get('has_gps', False) if exif_data else False,
+        }
+        return blob_row, metadata_row
+
+    def save_imessages_bulk(self, batch: List[Dict[str, Any]]) -> List[Tuple[int, bool]]:
+        """Save a batch of messages and their attachments in a single transaction.
+        
+        Each entry in batch is a dict holding the arguments of save_imessage:
+        message_data, and optionally attachment_data, attachment_filename,
+        attachment_type and source.
+        
+        Messages are upserted with one INSERT ... ON CONFLICT statement on the same
+        key as save_imessage (chat_session, message_date, sender_id, type); media_blob,
+        media_items and message_attachments rows are written with multi-row INSERTs
+        and the batch is committed once. If an entry repeats a key seen earlier in
+        the batch, the later entry wins, as it would with sequential save_imessage
+        calls.
+        
+        Returns:
+            list: (message_id, is_update) for each entry, in input order
+        """
+        if not batch:
+            return []
+
+        # Normalise the message rows and do the CPU-bound attachment work up front;
+        # image thumbnails and EXIF data are made for the whole batch on the process pool
+        image_indexes = [
+            index for index, item in enumerate(batch)
+            if item.get("attachment_data") is not None and (item.get("attachment_type") or "").startswith('image/')
+        ]
+        image_results: Dict[int, Tuple[Optional[bytes], Optional[Dict[str, Any]]]] = {}
+        if image_indexes:
+            # Import here to avoid circular import
+            from src.services.process_images_service import ProcessImagesService
+            results = ProcessImagesService().create_thumbs_and_get_exif(
+                [batch[index]["attachment_data"] for index in image_indexes],
+                process_thumbnail=True, process_exif=True, width=200
+            )
+            image_results = dict(zip(image_indexes, results))
+
+        entries = []
+        for index, item in enumerate(batch):
+            message_data = dict(item["message_data"])
+            message_data["is_group_chat"] = bool(message_data.get("is_group_chat"))
+            key = _message_key(message_data)
+            media_rows = None
+            attachment_data = item.get("attachment_data")
+            if attachment_data is not None:
+                try:
+                    media_rows = self._build_attachment_rows(
+                        message_data,
+                        attachment_data,
+                        item.get("attachment_filename"),
+                        item.get("attachment_type"),
+                        item.get("source"),
+                        image_results.get(index),
+                    )
+                except Exception as e:
+                    print(f"Warning: Could not create unified media entry for message attachment: {e}")
+            entries.append((key, message_data, media_rows))
+
+        # Collapse the batch to one row per key; later entries overwrite earlier ones
+        rows_by_key: Dict[tuple, Dict[str, Any]] = {}
+        media_by_key: Dict[tuple, Any] = {}
+        results: List[Tuple[tuple, bool]] = []
+        for key, message_data, media_rows in entries:
+            results.append((key, key in rows_by_key))
+            rows_by_key[key] = {field: message_data.get(field) for field in MESSAGE_FIELDS}
+            media_by_key[key] = media_rows
+
+        session = self.db.get_session()
+        try:
+            upserted = _upsert_messages(session, list(rows_by_key.values()))
+            message_ids = {key: message_id for key, (message_id, _) in upserted.items()}
+
+            updated_ids = [message_id for message_id, is_update in upserted.values() if is_update]
+            if updated_ids:
+                # Updated messages get their attachment links replaced, as in save_imessage
+                session.execute(
+                    delete(MessageAttachment).where(MessageAttachment.message_id.in_(updated_ids))
+                )
+
+            media_keys = [key for key, media_rows in media_by_key.items() if media_rows is not None]
+            if media_keys:
+                blob_ids = get_or_create_media_blobs(session, [media_by_key[key][0] for key in media_keys])
+                media_item_ids = session.scalars(
+                    insert(MediaMetadata).returning(MediaMetadata.id, sort_by_parameter_order=True),
+                    [
+                        {
+                            **media_by_key[key][1],
+                            "media_blob_id": blob_id,
+                            "source_reference": str(message_ids[key]),
+                            "message_id": message_ids[key],
+                        }
+                        for key, blob_id in zip(media_keys, blob_ids)
+                    ],
+                ).all()
+                session.execute(
+                    insert(MessageAttachment),
+                    [
+                        {"message_id": message_ids[key], "media_item_id": media_item_id}
+                        for key, media_item_id in zip(media_keys, media_item_ids)
+                    ],
+                )
+
+            session.commit()
+            return [
+                (message_ids[key], repeated or upserted[key][1])
+                for key, repeated in results
+            ]
         except Exception:
             session.rollback()
             raise
@@ -497,7 +1536,7 @@ class FacebookAlbumStorage:
     def __init__(self, db: Optional[Database] = None):
         """Initialize storage with database connection."""
         if db is None:
-            db = Database()
+            db = get_database()
         self.db = db
 
     def save_album(
@@ -573,13 +1612,8 @@ class FacebookAlbumStorage:
                 except Exception as e:
                     print(f"Warning: Could not create thumbnail for album image: {e}")
             
-            # Create MediaBlob
-            media_blob = MediaBlob(
-                image_data=image_data,
-                thumbnail_data=thumbnail_data
-            )
-            session.add(media_blob)
-            session.flush()  # Get blob ID
+            # Reuse the MediaBlob if this content is already stored
+            media_blob_id = get_or_create_media_blob(session, image_data, thumbnail_data)
             
             # Extract year and month from creation_timestamp if available
             year = None
@@ -595,9 +1629,10 @@ class FacebookAlbumStorage:
             
             # Create MediaMetadata entry
             media_item = MediaMetadata(
-                media_blob_id=media_blob.id,
+                media_blob_id=media_blob_id,
                 source="facebook_album",
                 source_reference=str(album_id),
+                album_id=album_id,
                 title=title or filename,
                 description=description,
                 tags=album_name,  # Include album name in tags
@@ -631,7 +1666,7 @@ class ImageStorage:
     def __init__(self, db: Optional[Database] = None):
         """Initialize storage with database connection."""
         if db is None:
-            db = Database()
+            db = get_database()
         self.db = db
 
     def save_image(
@@ -652,9 +1687,11 @@ class ImageStorage:
         source: str = "Filesystem",
         processed: bool = False,
         **kwargs
-    ) -> Tuple[MediaMetadata, bool]:
+    ) -> Tuple[int, bool]:
         """Save or update image with metadata.
         
+        The media item is upserted on (source, source_reference); see save_images_bulk.
+        
         Args:
             source_reference: Full file path (used for duplicate detection)
             image_data: Binary image data
@@ -673,85 +1710,222 @@ class ImageStorage:
             **kwargs: Additional metadata fields
             
         Returns:
-            Tuple of (MediaMetadata instance, is_update: bool)
+            Tuple of (media item ID, is_update: bool)
         """
-        session = self.db.get_session()
-        try:
-            # Check for existing image by source_reference
-            existing_metadata = session.query(MediaMetadata).filter(
-                MediaMetadata.source == source).filter(
-                MediaMetadata.source_reference == source_reference
-            ).first()
+        return self.save_images_bulk([{
+            "source_reference": source_reference,
+            "image_data": image_data,
+            "thumbnail_data": thumbnail_data,
+            "media_type": media_type,
+            "title": title,
+            "description": description,
+            "tags": tags,
+            "year": year,
+            "month": month,
+            "latitude": latitude,
+            "longitude": longitude,
+            "altitude": altitude,
+            "has_gps": has_gps,
+            "source": source,
+            "processed": processed,
+            **kwargs,
+        }])[0]
+
+    def save_images_bulk(
+        self,
+        images: List[Dict[str, Any]],
+        imported_files: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> List[Tuple[int, bool]]:
+        """Save or update many images in a single transaction.
+        
+        Each entry holds the keyword arguments of save_image. Blobs are resolved by
+        content hash in one pass, and media items are upserted on (source,
+        source_reference) with INSERT ... ON CONFLICT DO UPDATE, one statement per
+        distinct set of columns. Updated items keep their processed flag and rating.
+        Blobs that updated items no longer use are deleted if nothing else
+        references them. If an entry repeats a path seen earlier in the batch, the
+        later entry wins.
+        
+        Args:
+            images: save_image keyword arguments, one dict per image
+            imported_files: Optional size, mtime_ns and content_hash of each image's file
+                            (None entries are skipped), recorded in the imported_files
+                            manifest in the same transaction
             
-            if existing_metadata:
-                # Update existing image
-                is_update = True
-                # Update MediaBlob
-                existing_blob = session.query(MediaBlob).filter(
-                    MediaBlob.id == existing_metadata.media_blob_id
-                ).first()
-                
-                if existing_blob:
-                    existing_blob.image_data = image_data
-                    if thumbnail_data is not None:
-                        existing_blob.thumbnail_data = thumbnail_data
-                    existing_blob.updated_at = utcnow()
-                
-                # Update MediaMetadata
-                existing_metadata.title = title
-                existing_metadata.description = description
-                existing_metadata.tags = tags
-                existing_metadata.media_type = media_type
-                existing_metadata.year = year
-                existing_metadata.month = month
-                existing_metadata.latitude = latitude
-                existing_metadata.longitude = longitude
-                existing_metadata.altitude = altitude
-                existing_metadata.has_gps = has_gps
-                existing_metadata.source = source
-                existing_metadata.source_reference = source_reference
-                existing_metadata.updated_at = utcnow()
-                
-                # Update any additional fields from kwargs
-                for key, value in kwargs.items():
-                    if hasattr(existing_metadata, key):
-                        setattr(existing_metadata, key, value)
-                
-                session.commit()
-                return (existing_metadata, is_update)
-            else:
-                # Create new image
-                is_update = False
-                # Create MediaBlob first
-                media_blob = MediaBlob(
-                    image_data=image_data,
-                    thumbnail_data=thumbnail_data
+        Returns:
+            List of (media item ID, is_update) for each entry, in input order
+            
+        Raises:
+            ValueError: If an entry's source is not keyed by file path
+        """
+        if not images:
+            return []
+
+        rows_by_reference: Dict[str, Dict[str, Any]] = {}
+        blobs_by_reference: Dict[str, Dict[str, Any]] = {}
+        results: List[Tuple[str, bool]] = []
+        for image in images:
+            image = dict(image)
+            source = image.pop("source", PATH_KEYED_MEDIA_SOURCE)
+            if source != PATH_KEYED_MEDIA_SOURCE:
+                raise ValueError(
+                    f"save_image only handles '{PATH_KEYED_MEDIA_SOURCE}' images keyed by path, got source '{source}'"
                 )
-                session.add(media_blob)
-                session.flush()  # Get the blob ID
-                
-                # Create MediaMetadata
-                media_metadata = MediaMetadata(
-                    media_blob_id=media_blob.id,
-                    title=title,
-                    description=description,
-                    tags=tags,
-                    media_type=media_type,
-                    year=year,
-                    month=month,
-                    latitude=latitude,
-                    longitude=longitude,
-                    altitude=altitude,
-                    has_gps=has_gps,
-                    source=source,
-                    source_reference=source_reference,
-                    processed=processed,
-                    **kwargs
+            source_reference = image.pop("source_reference")
+            blob_row = {"image_data": image.pop("image_data"), "thumbnail_data": image.pop("thumbnail_data", None)}
+            row = {
+                "source": source,
+                "source_reference": source_reference,
+                "has_gps": image.pop("has_gps", False),
+                "processed": image.pop("processed", False),
+            }
+            for key, value in image.items():
+                if hasattr(MediaMetadata, key):
+                    row[key] = value
+
+            results.append((source_reference, source_reference in rows_by_reference))
+            rows_by_reference[source_reference] = row
+            blobs_by_reference[source_reference] = blob_row
+
+        session = self.db.get_session()
+        try:
+            # Reuse the MediaBlob wherever this content is already stored
+            references = list(rows_by_reference)
+            blob_ids = get_or_create_media_blobs(session, [blobs_by_reference[ref] for ref in references])
+            for ref, blob_id in zip(references, blob_ids):
+                rows_by_reference[ref]["media_blob_id"] = blob_id
+
+            # Rows are grouped by column set since one statement needs uniform rows
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for row in rows_by_reference.values():
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+
+            saved: Dict[str, Tuple[int, bool]] = {}
+            stale_blob_ids = set()
+            for columns, group_rows in groups.items():
+                stmt = pg_insert(MediaMetadata)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[MediaMetadata.source, MediaMetadata.source_reference],
+                    index_where=PATH_KEYED_MEDIA_SOURCE_WHERE,
+                    set_={
+                        **{column: stmt.excluded[column] for column in columns if column not in ("source", "source_reference", "processed")},
+                        "updated_at": utcnow(),
+                    },
+                ).returning(
+                    MediaMetadata.id, MediaMetadata.source_reference, MediaMetadata.media_blob_id,
+                    UPSERT_WAS_UPDATE, PREVIOUS_MEDIA_BLOB_ID,
                 )
-                session.add(media_metadata)
-                session.commit()
-                
-                return (media_metadata, is_update)
+                for row in session.execute(stmt, group_rows):
+                    saved[row.source_reference] = (row.id, row.was_update)
+                    # Blobs may be shared, so a replaced blob is only deleted once unreferenced
+                    if row.previous_blob_id is not None and row.previous_blob_id != row.media_blob_id:
+                        stale_blob_ids.add(row.previous_blob_id)
+
+            if stale_blob_ids:
+                delete_unreferenced_media_blobs(session, list(stale_blob_ids))
+
+            if imported_files:
+                manifest_rows = {}
+                for (ref, _), file_info in zip(results, imported_files):
+                    if file_info is not None:
+                        manifest_rows[ref] = {**file_info, "path": ref, "media_item_id": saved[ref][0]}
+                _upsert_imported_files(session, list(manifest_rows.values()))
+
+            session.commit()
+            return [
+                (saved[ref][0], repeated or saved[ref][1])
+                for ref, repeated in results
+            ]
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get_imported_files(self, root_directory: str) -> Dict[str, Dict[str, Any]]:
+        """Get the manifest entries of the files under a directory.
+        
+        Args:
+            root_directory: Absolute directory path
+            
+        Returns:
+            Dictionary of path -> {size, mtime_ns, content_hash, media_item_id}
+        """
+        prefix = os.path.join(root_directory, "")
+        session = self.db.get_session()
+        try:
+            rows = session.query(
+                ImportedFile.path, ImportedFile.size, ImportedFile.mtime_ns,
+                ImportedFile.content_hash, ImportedFile.media_item_id
+            ).filter(ImportedFile.path.startswith(prefix, autoescape=True)).all()
+            return {
+                row.path: {
+                    "size": row.size,
+                    "mtime_ns": row.mtime_ns,
+                    "content_hash": row.content_hash,
+                    "media_item_id": row.media_item_id,
+                }
+                for row in rows
+            }
+        finally:
+            session.close()
+
+    def record_imported_files(self, files: List[Dict[str, Any]]):
+        """Upsert manifest entries (path, size, mtime_ns, content_hash, media_item_id)."""
+        if not files:
+            return
+        session = self.db.get_session()
+        try:
+            _upsert_imported_files(session, files)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def move_imported_file(self, old_path: str, new_path: str, file_info: Dict[str, Any],
+                           title: Optional[str] = None, tags: Optional[str] = None) -> bool:
+        """Point an imported image at the path its file was moved or renamed to.
+        
+        The media item keeps its blob, thumbnail and metadata; only its path, title and
+        directory tags change, and the manifest entry moves with it.
+        
+        Args:
+            old_path: Manifest path the file was imported from
+            new_path: Absolute path the same content is now at
+            file_info: size, mtime_ns and content_hash of the file at new_path
+            title: New title (file name without extension)
+            tags: New directory tags
+            
+        Returns:
+            True if the image was moved; False if the old entry has no media item, or
+            another image is already stored for new_path
+        """
+        session = self.db.get_session()
+        try:
+            old_entry = session.query(ImportedFile).filter(ImportedFile.path == old_path).first()
+            if old_entry is None or old_entry.media_item_id is None:
+                return False
+            taken = session.query(exists().where(
+                MediaMetadata.source == PATH_KEYED_MEDIA_SOURCE,
+                MediaMetadata.source_reference == new_path,
+            )).scalar()
+            if taken:
+                return False
+
+            media_item_id = old_entry.media_item_id
+            session.query(MediaMetadata).filter(MediaMetadata.id == media_item_id).update({
+                "source_reference": new_path,
+                "title": title,
+                "tags": tags,
+                "updated_at": utcnow(),
+            }, synchronize_session=False)
+            session.delete(old_entry)
+            session.flush()
+            _upsert_imported_files(session, [{**file_info, "path": new_path, "media_item_id": media_item_id}])
+            session.commit()
+            return True
         except Exception:
             session.rollback()
             raise
@@ -769,7 +1943,9 @@ class ImageStorage:
         """
         session = self.db.get_session()
         try:
-            media_blob = session.query(MediaBlob).filter(MediaBlob.id == blob_id).first()
+            media_blob = session.query(MediaBlob).options(
+                undefer(MediaBlob.image_data), undefer(MediaBlob.thumbnail_data)
+            ).filter(MediaBlob.id == blob_id).first()
             if media_blob:
                 # Detach the object from the session to avoid session management issues
                 session.expunge(media_blob)
@@ -790,7 +1966,9 @@ class ImageStorage:
         try:
             metadata = session.query(MediaMetadata).filter(MediaMetadata.id == metadata_id).first()
             if metadata:
-                media_blob = session.query(MediaBlob).filter(MediaBlob.id == metadata.media_blob_id).first()
+                media_blob = session.query(MediaBlob).options(
+                    undefer(MediaBlob.image_data), undefer(MediaBlob.thumbnail_data)
+                ).filter(MediaBlob.id == metadata.media_blob_id).first()
                 if media_blob:
                     # Detach the object from the session to avoid session management issues
                     session.expunge(media_blob)
@@ -798,7 +1976,129 @@ class ImageStorage:
             return None
         finally:
             session.close()
+
+    def get_thumbnail_by_blob_id(self, blob_id: int) -> Optional[bytes]:
+        """Retrieve only the thumbnail bytes of a blob, without reading the full image.
+        
+        Args:
+            blob_id: The ID of the MediaBlob
+            
+        Returns:
+            Thumbnail bytes, or None if the blob is not found or has no thumbnail
+        """
+        session = self.db.get_session()
+        try:
+            return session.query(MediaBlob.thumbnail_data).filter(MediaBlob.id == blob_id).scalar()
+        finally:
+            session.close()
+
+    def get_thumbnail_by_metadata_id(self, metadata_id: int) -> Optional[bytes]:
+        """Retrieve only the thumbnail bytes of a media item's blob, without reading the full image.
+        
+        Args:
+            metadata_id: The ID of the MediaMetadata
+            
+        Returns:
+            Thumbnail bytes, or None if the item is not found or has no thumbnail
+        """
+        session = self.db.get_session()
+        try:
+            return session.query(MediaBlob.thumbnail_data).join(
+                MediaMetadata, MediaMetadata.media_blob_id == MediaBlob.id
+            ).filter(MediaMetadata.id == metadata_id).scalar()
+        finally:
+            session.close()
     
+    def get_image_blob(self, image_id: int, id_type: str = "blob") -> Optional[Any]:
+        """Get the blob ID and names of an image, if a media item with an image/* type uses it.
+        
+        Args:
+            image_id: Blob ID or media item ID, depending on id_type
+            id_type: 'blob' for media_blob.id or 'metadata' for media_items.id
+            
+        Returns:
+            Row with media_blob_id, source_reference and title, or None if not found
+            or not an image
+        """
+        session = self.db.get_session()
+        try:
+            query = session.query(
+                MediaMetadata.media_blob_id, MediaMetadata.source_reference, MediaMetadata.title
+            ).filter(MediaMetadata.media_type.like("image/%"))
+            if id_type == "metadata":
+                query = query.filter(MediaMetadata.id == image_id)
+            else:
+                query = query.filter(MediaMetadata.media_blob_id == image_id)
+            return query.first()
+        finally:
+            session.close()
+
+    def get_blobs_by_media_type(self, media_types: List[str], after_id: int = 0, limit: int = 100) -> List[Any]:
+        """Retrieve a batch of hashed blobs used by media items of the given types, in ID order.
+        
+        Args:
+            media_types: Lower-case MIME types
+            after_id: Only blobs with a greater ID are returned
+            limit: Maximum number of blobs
+            
+        Returns:
+            Rows with id and content_hash
+        """
+        session = self.db.get_session()
+        try:
+            return session.query(MediaBlob.id, MediaBlob.content_hash).filter(
+                MediaBlob.id > after_id,
+                MediaBlob.content_hash.isnot(None),
+                exists().where(
+                    MediaMetadata.media_blob_id == MediaBlob.id,
+                    func.lower(MediaMetadata.media_type).in_(media_types),
+                ),
+            ).order_by(MediaBlob.id).limit(limit).all()
+        finally:
+            session.close()
+
+    def get_rendition_sizes(self, blob_id: int) -> List[int]:
+        """Get the sizes of the renditions stored for a blob."""
+        session = self.db.get_session()
+        try:
+            return [row.size for row in session.query(MediaRendition.size).filter(MediaRendition.media_blob_id == blob_id).all()]
+        finally:
+            session.close()
+
+    def get_rendition(self, blob_id: int, size: int) -> Optional[Tuple[str, bytes]]:
+        """Retrieve one rendition of a blob.
+        
+        Returns:
+            (content type, image bytes), or None if there is no rendition of that size
+        """
+        session = self.db.get_session()
+        try:
+            row = session.query(MediaRendition.content_type, MediaRendition.data).filter(
+                MediaRendition.media_blob_id == blob_id,
+                MediaRendition.size == size,
+            ).first()
+            return (row.content_type, row.data) if row else None
+        finally:
+            session.close()
+
+    def save_renditions(self, blob_id: int, renditions: List[Tuple[int, str, int, int, bytes]]):
+        """Store renditions of a blob, keeping any of the same size already stored.
+        
+        Args:
+            blob_id: The ID of the MediaBlob
+            renditions: (size, content type, width, height, image bytes) tuples; an
+                        empty list marks the blob as having no renditions
+        """
+        session = self.db.get_session()
+        try:
+            _insert_renditions(session, {blob_id: renditions})
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
     def update_media_metadata(
         self,
         metadata_id: int,
@@ -854,7 +2154,7 @@ class ImageStorage:
             session.close()
     
     def delete_image_by_metadata_id(self, metadata_id: int) -> bool:
-        """Delete an image by metadata ID, ensuring cascade deletion of MediaBlob.
+        """Delete an image by metadata ID, deleting its MediaBlob if no other item shares it.
         
         Args:
             metadata_id: The ID of the MediaMetadata to delete
@@ -869,10 +2169,9 @@ class ImageStorage:
             if not metadata:
                 return False
             
-            # Delete the metadata - this should cascade delete the MediaBlob
-            # We need to explicitly load the relationship for cascade to work
-            _ = metadata.media_blob  # Load the relationship
+            blob_id = metadata.media_blob_id
             session.delete(metadata)
+            delete_unreferenced_media_blobs(session, [blob_id])
             session.commit()
             return True
         except Exception:
@@ -1,6 +1,10 @@
 import base64
-import json
 import os.path
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google.auth.exceptions import RefreshError
@@ -8,46 +12,79 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from .history import HistoryLog
+
+
+# HTTP statuses of batch entries that are retried (rate limiting and transient server errors)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
 
 class GmailClient:
 
     TRACEON = False
 
+    # Attempts per batch entry before giving up on it
+    BATCH_ATTEMPTS = 4
+
 
     def set_trace(self, traceon):
         self.TRACEON = traceon
 
-    def __init__(self, credentials_file="credentials.json", token_file="token.json", history_file="history.json"):
+    def __init__(self, credentials_file="credentials.json", token_file="token.json", history_file="history.json",
+                 batch_size=1, batches_in_flight=1, service_factory=None, attachment_filter=None,
+                 lazy_attachments=False):
+        """Create a client.
+
+        batch_size: Messages fetched per Gmail batch request; 1 fetches one message per request.
+        batches_in_flight: Batches fetched ahead in background threads while earlier ones are processed.
+        history_file: Processed message IDs are kept in an append-only log next to it
+                      (history.json -> history.log); an existing JSON history is imported
+                      into the log the first time.
+        service_factory: Optional callable returning a Gmail service object, used instead of
+                         building one from the OAuth credentials (e.g. a local fake for testing).
+                         It is called once per fetching thread, as service objects are not thread-safe.
+        attachment_filter: Optional function(attachment) -> bool deciding from an attachment's
+                           filename, mimeType and declared size whether it is wanted. Rejected
+                           attachments are left out of the message and never downloaded.
+        lazy_attachments: If True, wanted attachments stored on the server are not downloaded
+                          with their message; they are returned with data None and their
+                          attachmentId, to be fetched later with fetch_attachments.
+        """
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.history_file = history_file
         self.scopes = ["https://www.googleapis.com/auth/gmail.readonly"]
+        self.batch_size = max(1, batch_size)
+        self.batches_in_flight = max(1, batches_in_flight)
+        self.service_factory = service_factory
+        self.attachment_filter = attachment_filter
+        self.lazy_attachments = lazy_attachments
+        self.credentials = None
         self.service = None
+        self._thread_local = threading.local()
         self.history = self._load_history()
+        # Messages that could not be listed, fetched or processed during the last fetch_and_process_messages
+        self.fetch_errors = 0
         self.label_map_id_to_name = {}  # Cache for ID -> Name
         self.label_map_name_to_id = {}  # Cache for Name -> ID
 
     def _load_history(self):
-        """Loads processed message IDs from the history file."""
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, "r") as f:
-                    return set(json.load(f))
-            except (json.JSONDecodeError, IOError):
-                print("Warning: Could not load history file. Starting with empty history.")
-                return set()
-        return set()
+        """Loads processed message IDs from the history log, importing a JSON history file."""
+        base, extension = os.path.splitext(self.history_file)
+        if extension == ".json":
+            return HistoryLog(f"{base}.log", json_file=self.history_file)
+        return HistoryLog(self.history_file)
 
     def save_history(self):
-        """Saves processed message IDs to the history file."""
-        try:
-            with open(self.history_file, "w") as f:
-                json.dump(list(self.history), f)
-        except IOError as e:
-            print(f"Error saving history file: {e}")
+        """Appends the message IDs processed since the last save to the history log."""
+        self.history.flush()
 
     def authenticate(self):
         """Authenticates the user and creates the Gmail service."""
+        if self.service_factory:
+            self.service = self.service_factory()
+            return
+
         print(f"Authenticating with credentials file: {self.credentials_file}")
         print(f"Authenticating with token file: {self.token_file}")
         print(f"Authenticating with history file: {self.history_file}")
@@ -78,7 +115,22 @@ class GmailClient:
             with open(self.token_file, "w") as token:
                 token.write(creds.to_json())
 
-        self.service = build("gmail", "v1", credentials=creds)
+        self.credentials = creds
+        self.service = self._create_service()
+
+    def _create_service(self):
+        """Creates a Gmail service object."""
+        if self.service_factory:
+            return self.service_factory()
+        return build("gmail", "v1", credentials=self.credentials)
+
+    def _worker_service(self):
+        """Gets the Gmail service object for the current fetching thread."""
+        service = getattr(self._thread_local, "service", None)
+        if service is None:
+            service = self._create_service()
+            self._thread_local.service = service
+        return service
 
     def _get_header_value(self, headers, name):
         """Utility to get header value by name."""
@@ -89,18 +141,35 @@ class GmailClient:
                 return header["value"]
         return None
 
-    def _decode_base64url(self, data):
-        """Decodes base64url string."""
+    def _decode_base64url_bytes(self, data):
+        """Decodes base64url string to bytes."""
         if not data:
-            return ""
+            return b""
         # Add padding if needed
         padding = len(data) % 4
         if padding:
             data += "=" * (4 - padding)
-        return base64.urlsafe_b64decode(data).decode("utf-8")
+        return base64.urlsafe_b64decode(data)
+
+    def _decode_base64url(self, data):
+        """Decodes base64url string."""
+        return self._decode_base64url_bytes(data).decode("utf-8")
+
+    def _take_attachment_data(self, response):
+        """Decodes the data of an attachments.get response to bytes.
+        The base64url text is removed from the response, so only the decoded copy stays in memory.
+        Returns None if the request failed or the data could not be decoded.
+        """
+        if not response:
+            return None
+        try:
+            return self._decode_base64url_bytes(response.pop("data", ""))
+        except (ValueError, TypeError) as error:
+            print(f"An error occurred decoding attachment: {error}")
+            return None
 
     def _get_attachment_data(self, user_id, message_id, attachment_id):
-        """Fetches and encodes attachment data."""
+        """Fetches and decodes attachment data."""
         try:
             response = (
                 self.service.users()
@@ -109,21 +178,36 @@ class GmailClient:
                 .get(userId=user_id, messageId=message_id, id=attachment_id)
                 .execute()
             )
-            return response.get("data", "")
+            return self._take_attachment_data(response)
         except HttpError as error:
             print(f"An error occurred fetching attachment: {error}")
             return None
 
-    def _parse_message_parts(self, user_id, message_id, parts):
-        """Recursively parses message parts for body and attachments."""
-        body_text = ""
-        body_html = ""
+    def _wants_attachment(self, filename, mime_type, size):
+        """Applies attachment_filter to an attachment's metadata."""
+        if self.attachment_filter is None:
+            return True
+        return self.attachment_filter({"filename": filename, "mimeType": mime_type, "size": size})
+
+    def _parse_message_parts(self, user_id, message_id, parts, prefetched_attachments=None):
+        """Recursively parses message parts for body and attachments.
+        prefetched_attachments: Optional dict of attachment ID -> decoded data fetched with
+                                the message's batch. When given, no attachment is fetched here,
+                                and used entries are removed from the dict.
+        Returns (body_text, body_html, attachments). Attachment data is bytes.
+        """
+        text_parts = []
+        html_parts = []
         attachments = []
-
-        if not parts:
-            return body_text, body_html, attachments
-
-        for part in parts:
+        self._collect_message_parts(
+            user_id, message_id, parts, prefetched_attachments, text_parts, html_parts, attachments
+        )
+        return "".join(text_parts), "".join(html_parts), attachments
+
+    def _collect_message_parts(self, user_id, message_id, parts, prefetched_attachments,
+                               text_parts, html_parts, attachments):
+        """Appends the bodies and attachments of parts (and their nested parts) to the given lists."""
+        for part in parts or []:
             mime_type = part.get("mimeType", "")
             filename = part.get("filename", "")
             part_body = part.get("body", {})
@@ -132,60 +216,66 @@ class GmailClient:
 
             # Handle nested parts (multipart)
             if "parts" in part:
-                sub_text, sub_html, sub_attachments = self._parse_message_parts(
-                    user_id, message_id, part["parts"]
+                self._collect_message_parts(
+                    user_id, message_id, part["parts"], prefetched_attachments,
+                    text_parts, html_parts, attachments
                 )
-                body_text += sub_text
-                body_html += sub_html
-                attachments.extend(sub_attachments)
 
             # Handle text/plain
             elif mime_type == "text/plain" and data:
-                body_text += self._decode_base64url(data)
+                text_parts.append(self._decode_base64url(data))
 
             # Handle text/html
             elif mime_type == "text/html" and data:
-                body_html += self._decode_base64url(data)
+                html_parts.append(self._decode_base64url(data))
 
             # Handle attachments (if filename is present, it's usually an attachment)
             elif filename:
-                attachment_data = ""
+                attachment_data = None
                 file_size = part_body.get("size", 0)
 
-                if attachment_id:
+                # Filter on the declared size before downloading anything
+                if file_size and not self._wants_attachment(filename, mime_type, file_size):
+                    continue
+
+                if attachment_id and self.lazy_attachments:
+                    attachments.append({
+                        "filename": filename,
+                        "mimeType": mime_type,
+                        "size": file_size,
+                        "data": None,
+                        "attachmentId": attachment_id,
+                    })
+                    continue
+                elif attachment_id and prefetched_attachments is not None:
+                    # Use the data fetched with the message's batch
+                    attachment_data = prefetched_attachments.pop(attachment_id, None)
+                elif attachment_id:
                     # Fetch full attachment data
                     attachment_data = self._get_attachment_data(
                         user_id, message_id, attachment_id
                     )
                 elif data:
                     # Attachment data might be inline for small files
-                    attachment_data = data
+                    try:
+                        attachment_data = self._decode_base64url_bytes(data)
+                    except (ValueError, TypeError) as error:
+                        print(f"An error occurred decoding attachment: {error}")
 
                 if attachment_data:
-                    # Calculate size if not provided by API
+                    # Filter on the actual size when the API did not declare one
                     if not file_size:
-                        try:
-                            # attachment_data is base64url encoded
-                            # Padding might be needed for strict decoding, but simple length estimation:
-                            # bytes = (len(str) * 3) / 4 - padding
-                            padding = len(attachment_data) % 4
-                            if padding:
-                                padded_data = attachment_data + "=" * (4 - padding)
-                            else:
-                                padded_data = attachment_data
-                            file_size = len(base64.urlsafe_b64decode(padded_data))
-                        except Exception:
-                            file_size = 0
+                        file_size = len(attachment_data)
+                        if not self._wants_attachment(filename, mime_type, file_size):
+                            continue
 
                     attachments.append({
                         "filename": filename,
                         "mimeType": mime_type,
                         "size": file_size,
-                        "data": attachment_data,  # This is base64url encoded
+                        "data": attachment_data,  # Decoded bytes
                     })
 
-        return body_text, body_html, attachments
-
     def _retrieve_message_from_server(self, message_id, clean_body_callback=None):
         """Fetches and processes a single message.
         clean_body_callback: Optional function that takes (text, html) and returns (cleaned_text, cleaned_html)
@@ -198,79 +288,235 @@ class GmailClient:
                 .get(userId="me", id=message_id, format="full")
                 .execute()
             )
-
-            payload = message_full.get("payload", {})
-            headers = payload.get("headers", [])
-            label_ids = message_full.get("labelIds", [])
-            
-            # Resolve label IDs to names
-            if not self.label_map_id_to_name:
-                self.get_labels() # Ensure cache is populated
-                
-            label_names = [self.label_map_id_to_name.get(lid, lid) for lid in label_ids]
-
-            # Extract metadata
-            metadata = {
-                "uid": message_id,
-                "labels": label_names,
-                "subject": self._get_header_value(headers, "Subject"),
-                "from": self._get_header_value(headers, "From"),
-                "to": self._get_header_value(headers, "To"),
-                "cc": self._get_header_value(headers, "Cc"),
-                "bcc": self._get_header_value(headers, "Bcc"),
-                "date": self._get_header_value(headers, "Date"),
-            }
-
-            # Parse body and attachments
-            body_text = ""
-            body_html = ""
-            attachments = []
-
-            # Payload might have parts or just a body
-            if "parts" in payload:
-                body_text, body_html, attachments = self._parse_message_parts(
-                    "me", message_id, payload["parts"]
-                )
-            else:
-                # Single part message (e.g. just text/plain or text/html)
-                mime_type = payload.get("mimeType", "")
-                data = payload.get("body", {}).get("data", "")
-                if mime_type == "text/plain":
-                    body_text = self._decode_base64url(data)
-                elif mime_type == "text/html":
-                    body_html = self._decode_base64url(data)
-
-            # Apply cleansing callback if provided
-            if clean_body_callback:
-                try:
-                    body_text, body_html = clean_body_callback(body_text, body_html)
-                except Exception as e:
-                    print(f"Error in cleansing callback for message {message_id}: {e}")
-
-            # Construct JSON structure
-            message_data = {
-                "id": message_id,
-                "threadId": message_full.get("threadId"),
-                "snippet": message_full.get("snippet"),
-                "metadata": metadata,
-                "body": {
-                    "text": body_text,
-                    "html": body_html
-                },
-                "attachments": attachments
-            }
-            return message_data
+            return self._build_message_data(message_id, message_full, clean_body_callback)
 
         except HttpError as error:
             print(f"An error occurred processing message {message_id}: {error}")
             return None
 
+    def _build_message_data(self, message_id, message_full, clean_body_callback=None, prefetched_attachments=None):
+        """Builds the message structure from a full-format messages.get response.
+        prefetched_attachments: See _parse_message_parts.
+        """
+        payload = message_full.get("payload", {})
+        headers = payload.get("headers", [])
+        label_ids = message_full.get("labelIds", [])
+        
+        # Resolve label IDs to names
+        if not self.label_map_id_to_name:
+            self.get_labels() # Ensure cache is populated
+            
+        label_names = [self.label_map_id_to_name.get(lid, lid) for lid in label_ids]
+
+        # Extract metadata
+        metadata = {
+            "uid": message_id,
+            "labels": label_names,
+            "subject": self._get_header_value(headers, "Subject"),
+            "from": self._get_header_value(headers, "From"),
+            "to": self._get_header_value(headers, "To"),
+            "cc": self._get_header_value(headers, "Cc"),
+            "bcc": self._get_header_value(headers, "Bcc"),
+            "date": self._get_header_value(headers, "Date"),
+        }
+
+        # Parse body and attachments
+        body_text = ""
+        body_html = ""
+        attachments = []
+
+        # Payload might have parts or just a body
+        if "parts" in payload:
+            body_text, body_html, attachments = self._parse_message_parts(
+                "me", message_id, payload["parts"], prefetched_attachments
+            )
+        else:
+            # Single part message (e.g. just text/plain or text/html)
+            mime_type = payload.get("mimeType", "")
+            data = payload.get("body", {}).get("data", "")
+            if mime_type == "text/plain":
+                body_text = self._decode_base64url(data)
+            elif mime_type == "text/html":
+                body_html = self._decode_base64url(data)
+
+        # Apply cleansing callback if provided
+        if clean_body_callback:
+            try:
+                body_text, body_html = clean_body_callback(body_text, body_html)
+            except Exception as e:
+                print(f"Error in cleansing callback for message {message_id}: {e}")
+
+        # Construct JSON structure
+        message_data = {
+            "id": message_id,
+            "threadId": message_full.get("threadId"),
+            "snippet": message_full.get("snippet"),
+            "metadata": metadata,
+            "body": {
+                "text": body_text,
+                "html": body_html
+            },
+            "attachments": attachments
+        }
+        return message_data
+
+    def _collect_attachment_ids(self, parts):
+        """Returns the IDs of the attachments _parse_message_parts would fetch for these parts."""
+        attachment_ids = []
+        for part in parts or []:
+            mime_type = part.get("mimeType", "")
+            part_body = part.get("body", {})
+            data = part_body.get("data", "")
+            if "parts" in part:
+                attachment_ids.extend(self._collect_attachment_ids(part["parts"]))
+            elif mime_type in ("text/plain", "text/html") and data:
+                continue
+            elif part.get("filename") and part_body.get("attachmentId") and not self.lazy_attachments:
+                file_size = part_body.get("size", 0)
+                if file_size and not self._wants_attachment(part["filename"], mime_type, file_size):
+                    continue
+                attachment_ids.append(part_body["attachmentId"])
+        return attachment_ids
+
+    def _execute_batch(self, service, requests):
+        """Executes requests as one Gmail batch request.
+        requests: Dict of key -> request object (not executed).
+        Returns a dict of key -> response, or None for requests that failed. Entries that are
+        rate limited or hit a transient server error are retried with exponential backoff.
+        """
+        responses = {}
+        pending = dict(requests)
+        for attempt in range(self.BATCH_ATTEMPTS):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(2 ** attempt)
+
+            keys = list(pending)
+            retry = {}
+
+            def on_response(request_id, response, exception):
+                key = keys[int(request_id)]
+                if exception is None:
+                    responses[key] = response
+                elif (isinstance(exception, HttpError) and exception.resp.status in RETRYABLE_STATUSES
+                        and attempt + 1 < self.BATCH_ATTEMPTS):
+                    retry[key] = pending[key]
+                else:
+                    print(f"An error occurred in batch request {key}: {exception}")
+                    responses[key] = None
+
+            batch = service.new_batch_http_request(callback=on_response)
+            for index, key in enumerate(keys):
+                batch.add(pending[key], request_id=str(index))
+            try:
+                batch.execute()
+            except HttpError as error:
+                # The batch request itself failed; retry all of it
+                if error.resp.status not in RETRYABLE_STATUSES or attempt + 1 == self.BATCH_ATTEMPTS:
+                    print(f"An error occurred executing batch request: {error}")
+                    return {**responses, **{key: None for key in keys}}
+                retry = {key: pending[key] for key in keys}
+            pending = retry
+        return responses
+
+    def _fetch_message_batch(self, message_ids, clean_body_callback=None):
+        """Fetches and processes messages with batch requests.
+        Runs in a fetching thread. Returns a list of (message_id, message_data or None).
+        """
+        service = self._worker_service()
+        messages = service.users().messages()
+
+        full_messages = self._execute_batch(service, {
+            message_id: messages.get(userId="me", id=message_id, format="full")
+            for message_id in message_ids
+        })
+
+        # Fetch the attachments of all messages in the batch, batch_size per request
+        wanted = [
+            (message_id, attachment_id)
+            for message_id in message_ids
+            if full_messages.get(message_id)
+            for attachment_id in self._collect_attachment_ids(full_messages[message_id].get("payload", {}).get("parts"))
+        ]
+        attachments = {message_id: {} for message_id in message_ids}
+        for start in range(0, len(wanted), self.batch_size):
+            responses = self._execute_batch(service, {
+                key: messages.attachments().get(userId="me", messageId=key[0], id=key[1])
+                for key in wanted[start:start + self.batch_size]
+            })
+            for (message_id, attachment_id), response in responses.items():
+                attachments[message_id][attachment_id] = self._take_attachment_data(response)
+
+        results = []
+        for message_id in message_ids:
+            message_full = full_messages.get(message_id)
+            data = None
+            if message_full:
+                data = self._build_message_data(message_id, message_full, clean_body_callback, attachments[message_id])
+            results.append((message_id, data))
+        return results
+
+    def fetch_attachments(self, attachments):
+        """Downloads attachments left out by lazy_attachments.
+        attachments: List of (message_id, attachment_id).
+        Returns a dict of (message_id, attachment_id) -> decoded bytes, or None where the
+        download failed. Fetched with batch requests of batch_size attachments.
+        """
+        if not self.service:
+            raise Exception("Service not authenticated. Call authenticate() first.")
+        messages = self.service.users().messages()
+        results = {}
+        for start in range(0, len(attachments), self.batch_size):
+            responses = self._execute_batch(self.service, {
+                key: messages.attachments().get(userId="me", messageId=key[0], id=key[1])
+                for key in attachments[start:start + self.batch_size]
+            })
+            for key, response in responses.items():
+                results[key] = self._take_attachment_data(response)
+        return results
+
+    def _retrieve_messages(self, messages, clean_body_callback=None):
+        """Fetches and processes listed messages, yielding (message_id, message_data or None) in order.
+
+        With batch_size 1, messages are fetched one request at a time. Otherwise they are
+        fetched batch_size per batch request, with up to batches_in_flight batches fetched
+        in background threads ahead of the one being consumed.
+        """
+        if self.batch_size == 1:
+            for msg in messages:
+                yield msg["id"], self._retrieve_message_from_server(msg["id"], clean_body_callback)
+            return
+
+        # Label names are resolved while parsing; load them before the fetching threads start
+        if not self.label_map_id_to_name:
+            self.get_labels()
+
+        messages = iter(messages)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.batches_in_flight, thread_name_prefix="gmail-fetch") as executor:
+            try:
+                while True:
+                    message_ids = [msg["id"] for msg in islice(messages, self.batch_size)]
+                    if message_ids:
+                        in_flight.append(executor.submit(self._fetch_message_batch, message_ids, clean_body_callback))
+                    if not in_flight:
+                        break
+                    if message_ids and len(in_flight) < self.batches_in_flight:
+                        continue
+                    yield from in_flight.popleft().result()
+            finally:
+                # Consumer stopped early or failed: drop batches that have not started
+                for future in in_flight:
+                    future.cancel()
+
     def _get_messages_metadata(self, target_labels, max_results=None, new_only=False, check_history_callback=None):
         """Helper to yield message metadata (IDs) from specified labels.
         If max_results is None, fetches all messages (uses pagination).
         If new_only is True, filters out messages already in history.
-        check_history_callback: Optional function(msg_id, label_name) -> bool. 
-                                Returns True if message exists (should be skipped).
+        check_history_callback: Optional function(msg_ids, label_name) -> iterable of IDs.
+                                Called once per listed page; returns the IDs among msg_ids
+                                that already exist (should be skipped).
         Yields message objects as they are found.
         """
         if not self.service:
@@ -325,6 +571,9 @@ class GmailClient:
                         if remaining <= 0:
                             return
                         list_kwargs["maxResults"] = min(remaining, 500) if remaining > 500 else remaining
+                    else:
+                        # Largest page Gmail allows (the default is 100)
+                        list_kwargs["maxResults"] = 500
                         
                     results = (
                         self.service.users()
@@ -336,24 +585,27 @@ class GmailClient:
                     messages = results.get("messages", [])
                     print(f"Found {len(messages)} messages for label {label_name} (page)")
                     if messages:
+                        existing_ids = set()
+                        if new_only:
+                            page_ids = [msg["id"] for msg in messages]
+                            if check_history_callback:
+                                # Use injected callback, once for the whole page
+                                try:
+                                    existing_ids = set(check_history_callback(page_ids, label_name))
+                                except Exception as e:
+                                    print(f"Error in history callback for {len(page_ids)} messages: {e}")
+                                    # Process them all: False is safer to ensure we get data.
+                                    existing_ids = set()
+                            else:
+                                # Use internal history
+                                existing_ids = {msg_id for msg_id in page_ids if msg_id in self.history}
+                        if existing_ids:
+                            print(f"Skipping {len(existing_ids)} already loaded messages for label {label_name} (page)")
+
                         for msg in messages:
                             msg_id = msg["id"]
                             if msg_id not in seen_message_ids:
-                                is_existing = False
-                                if new_only:
-                                    if check_history_callback:
-                                        # Use injected callback
-                                        try:
-                                            is_existing = check_history_callback(msg_id, label_name)
-                                        except Exception as e:
-                                            print(f"Error in history callback for {msg_id}: {e}")
-                                            # Default to False (process it) or True? False is safer to ensure we get data.
-                                            is_existing = False 
-                                    else:
-                                        # Use internal history
-                                        is_existing = msg_id in self.history
-                                
-                                if is_existing:
+                                if msg_id in existing_ids:
                                     continue
                                     
                                 yield msg
@@ -373,6 +625,7 @@ class GmailClient:
                         print(f"Continuing to next page for label {label_name}...")
                              
             except HttpError as e:
+                self.fetch_errors += 1
                 print(f"Error listing messages for label {label_name}: {e}")
                 import traceback
                 traceback.print_exc()
@@ -395,6 +648,102 @@ class GmailClient:
             print(f"An error occurred fetching labels: {error}")
             return []
             
+    def get_history_id(self):
+        """Returns the mailbox's current history ID (a string), the starting point for list_history_changes."""
+        if not self.service:
+            raise Exception("Service not authenticated. Call authenticate() first.")
+        profile = self.service.users().getProfile(userId="me").execute()
+        return str(profile["historyId"])
+
+    def list_history_changes(self, label_name, start_history_id):
+        """Lists the messages in a label that changed since start_history_id.
+
+        Returns a dict with:
+            changed: IDs of messages added to the mailbox with the label, or whose labels
+                     changed while in the label (including removal of the label itself)
+            deleted: IDs of deleted messages that carried the label
+            history_id: The history ID the listing is current to
+        or None if start_history_id is too old for Gmail to list changes from (the caller
+        should fall back to a full listing).
+        """
+        if not self.service:
+            raise Exception("Service not authenticated. Call authenticate() first.")
+        if not self.label_map_name_to_id:
+            self.get_labels()
+        label_id = self.label_map_name_to_id.get(label_name)
+        if not label_id:
+            print(f"[WARNING] Label '{label_name}' not found in label map.")
+            return None
+
+        # Dicts keep the IDs in the order the changes happened
+        changed = {}
+        deleted = {}
+        history_id = start_history_id
+        page_token = None
+        try:
+            while True:
+                results = (
+                    self.service.users()
+                    .history()
+                    .list(userId="me", startHistoryId=start_history_id, pageToken=page_token)
+                    .execute()
+                )
+                for record in results.get("history", []):
+                    for change in record.get("messagesAdded", []):
+                        message = change["message"]
+                        if label_id in message.get("labelIds", []):
+                            changed[message["id"]] = True
+                    for change in record.get("labelsAdded", []) + record.get("labelsRemoved", []):
+                        message = change["message"]
+                        if label_id in change.get("labelIds", []) or label_id in message.get("labelIds", []):
+                            changed[message["id"]] = True
+                    for change in record.get("messagesDeleted", []):
+                        message = change["message"]
+                        if label_id in message.get("labelIds", []):
+                            deleted[message["id"]] = True
+                history_id = str(results.get("historyId", history_id))
+                page_token = results.get("nextPageToken")
+                if not page_token:
+                    break
+        except HttpError as error:
+            # Gmail keeps history for a limited time; older start IDs return 404
+            if error.resp.status == 404:
+                print(f"History for label {label_name} is no longer available from {start_history_id}")
+                return None
+            raise
+
+        return {
+            "changed": [message_id for message_id in changed if message_id not in deleted],
+            "deleted": list(deleted),
+            "history_id": history_id,
+        }
+
+    def fetch_message_labels(self, message_ids):
+        """Returns a dict of message ID -> list of label names, fetching only the labels.
+        Messages that could not be fetched (e.g. deleted since) are left out.
+        """
+        if not self.label_map_id_to_name:
+            self.get_labels()
+        messages = self.service.users().messages()
+        responses = {}
+        for start in range(0, len(message_ids), self.batch_size):
+            chunk = message_ids[start:start + self.batch_size]
+            if self.batch_size == 1:
+                try:
+                    responses[chunk[0]] = messages.get(userId="me", id=chunk[0], format="minimal").execute()
+                except HttpError as error:
+                    print(f"An error occurred fetching labels of message {chunk[0]}: {error}")
+            else:
+                responses.update(self._execute_batch(self.service, {
+                    message_id: messages.get(userId="me", id=message_id, format="minimal")
+                    for message_id in chunk
+                }))
+        return {
+            message_id: [self.label_map_id_to_name.get(lid, lid) for lid in response.get("labelIds", [])]
+            for message_id, response in responses.items()
+            if response
+        }
+
     def fetch_messages(self, target_labels, max_results=None, new_only=False, clean_body_callback=None, check_history_callback=None):
         """Fetches messages from specified labels. Defaults to all if max_results is None."""
         if self.TRACEON:
@@ -402,14 +751,20 @@ class GmailClient:
         processed_messages = []
         generator = self._get_messages_metadata(target_labels, max_results, new_only, check_history_callback)
 
-        for msg in generator:
+        unsaved = 0
+        for msg_id, data in self._retrieve_messages(generator, clean_body_callback):
             if self.TRACEON:
-                print(f"Processing message ID: {msg['id']}")
-            data = self._retrieve_message_from_server(msg['id'], clean_body_callback)
+                print(f"Processing message ID: {msg_id}")
             if data:
                 processed_messages.append(data)
-                self.history.add(msg['id'])
-                self.save_history()
+                self.history.add(msg_id)
+                unsaved += 1
+                # Save once per batch rather than per message
+                if unsaved >= self.batch_size:
+                    self.save_history()
+                    unsaved = 0
+        if unsaved:
+            self.save_history()
         
         if not processed_messages:
              if self.TRACEON:
@@ -418,40 +773,55 @@ class GmailClient:
         # self.save_history() # Already saved incrementally
         return processed_messages
 
-    def fetch_and_process_messages(self, target_labels, callback, max_results=None, new_only=False, clean_body_callback=None, check_history_callback=None):
+    def fetch_and_process_messages(self, target_labels, callback, max_results=None, new_only=False, clean_body_callback=None, check_history_callback=None, message_ids=None):
         """Fetches messages and applies a callback function to each processed message.
         Yields processed message objects as they are processed.
+        message_ids: Optional list of message IDs to fetch instead of listing target_labels
+                     (e.g. the changes found by list_history_changes).
         """
         
         print(f"Starting message processing for labels: {target_labels}")
+        self.fetch_errors = 0
         try:
-            generator = self._get_messages_metadata(target_labels, max_results, new_only, check_history_callback)
+            if message_ids is not None:
+                generator = ({"id": message_id} for message_id in message_ids)
+            else:
+                generator = self._get_messages_metadata(target_labels, max_results, new_only, check_history_callback)
             count = 0
-            for msg in generator:
+            unsaved = 0
+            for msg_id, data in self._retrieve_messages(generator, clean_body_callback):
                 count += 1
-                #print(f"Found message ID: {msg.get('id', 'unknown')} ")
+                #print(f"Found message ID: {msg_id} ")
                 # if self.TRACEON:
-                #     print(f"Processing message ID: {msg['id']}")
-                data = self._retrieve_message_from_server(msg['id'], clean_body_callback)
+                #     print(f"Processing message ID: {msg_id}")
                 if data:
                     try:
                         #check if callback is a function
                         if callable(callback):
                             callback(data)
-                        self.history.add(msg['id'])
-                        self.save_history()
+                        self.history.add(msg_id)
+                        unsaved += 1
+                        # Save once per batch rather than per message
+                        if unsaved >= self.batch_size:
+                            self.save_history()
+                            unsaved = 0
                         yield data
                     except Exception as e:
-                        print(f"Error in callback for message {msg['id']}: {e}")
+                        self.fetch_errors += 1
+                        print(f"Error in callback for message {msg_id}: {e}")
                         import traceback
                         traceback.print_exc()
                 else:
-                    print(f"Warning: No data retrieved for message {msg.get('id', 'unknown')}")
+                    self.fetch_errors += 1
+                    print(f"Warning: No data retrieved for message {msg_id}")
+            if unsaved:
+                self.save_history()
             
             print(f"Completed processing. Total messages found: {count}")
             if count == 0:
                 print(f"No messages found or processed for labels: {target_labels}")
         except Exception as e:
+            self.fetch_errors += 1
             print(f"Error in fetch_and_process_messages: {e}")
             import traceback
             traceback.print_exc()
@@ -0,0 +1,109 @@
+import json
+import os
+
+
+class HistoryLog:
+    """Append-only record of processed Gmail message IDs.
+
+    IDs are kept in memory as a set and persisted to a log file with one ID per line.
+    add() buffers new IDs and flush() appends them in a single write, so saving costs
+    O(new IDs) rather than rewriting the whole history. A crash can at most leave a
+    partial last line, which is dropped on the next load.
+
+    The log is compacted (rewritten via a temporary file) when it is loaded with more
+    duplicate or torn lines than COMPACT_MIN_WASTE and than a third of its IDs, e.g.
+    after several clients appended to the same file.
+
+    A legacy JSON history (a list of IDs) is imported into the log when no log exists yet.
+    """
+
+    # Wasted lines tolerated before the log is compacted on load
+    COMPACT_MIN_WASTE = 1000
+
+    def __init__(self, log_file, json_file=None):
+        """Load the history.
+
+        log_file: Path of the append-only log
+        json_file: Optional path of a legacy JSON history to import when log_file does not exist
+        """
+        self.log_file = log_file
+        self.json_file = json_file
+        self._ids = set()
+        self._pending = []
+        self._load()
+
+    def __contains__(self, message_id):
+        return message_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, message_id):
+        """Record a processed message ID; it is written to the log by the next flush()."""
+        if message_id in self._ids:
+            return
+        self._ids.add(message_id)
+        self._pending.append(message_id)
+
+    def flush(self):
+        """Append the IDs added since the last flush to the log."""
+        if not self._pending:
+            return
+        try:
+            with open(self.log_file, "a") as f:
+                f.write("".join(f"{message_id}\n" for message_id in self._pending))
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending = []
+        except IOError as e:
+            print(f"Error saving history file: {e}")
+
+    def compact(self):
+        """Rewrite the log with one line per ID, replacing it atomically."""
+        temp_file = f"{self.log_file}.tmp"
+        try:
+            with open(temp_file, "w") as f:
+                f.write("".join(f"{message_id}\n" for message_id in self._ids))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.log_file)
+            self._pending = []
+        except (IOError, OSError) as e:
+            print(f"Error compacting history file: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.log_file):
+            if self.json_file and os.path.exists(self.json_file):
+                self._import_json()
+            return
+
+        try:
+            with open(self.log_file, "r") as f:
+                content = f.read()
+        except IOError:
+            print("Warning: Could not load history file. Starting with empty history.")
+            return
+
+        lines = content.split("\n")
+        # The last element is empty when the file ends with a newline; anything else is a torn write
+        torn = lines.pop() != ""
+        lines = [line for line in lines if line]
+        self._ids.update(lines)
+
+        waste = len(lines) - len(self._ids) + int(torn)
+        if torn or (waste > self.COMPACT_MIN_WASTE and waste * 3 > len(self._ids)):
+            self.compact()
+
+    def _import_json(self):
+        """Import a legacy JSON history into a new log."""
+        try:
+            with open(self.json_file, "r") as f:
+                self._ids.update(json.load(f))
+        except (json.JSONDecodeError, IOError):
+            print("Warning: Could not load history file. Starting with empty history.")
+            return
+        print(f"Imported {len(self._ids)} message IDs from {self.json_file} into {self.log_file}")
+        self.compact()
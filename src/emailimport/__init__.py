@@ -0,0 +1,5 @@
+"""Offline email import package."""
+
+from .mboximport import import_mbox_file
+
+__all__ = ['import_mbox_file']
@@ -1,11 +1,14 @@
 """Filesystem image import functionality."""
 
 import os
+import re
 import mimetypes
 import fnmatch
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional, Callable, List
+from typing import Dict, Any, Optional, Callable, List, Tuple
 from io import BytesIO
 
 from PIL import Image, ImageFilter
@@ -22,7 +25,7 @@ try:
 except ImportError:
     HEIF_SUPPORT = False
 
-from ..database.connection import Database
+from ..database.connection import Database, get_database
 from ..database.storage import ImageStorage
 
 
@@ -244,31 +247,96 @@ def create_thumbnail(image_data: bytes, max_size: int = 100) -> Optional[bytes]:
         return None
 
 
-def _should_exclude_directory(directory_path: Path, exclude_patterns: List[str]) -> bool:
-    """Check if a directory should be excluded based on patterns.
+# Files that are never imported: AppleDouble resource forks ("._*") and Windows/Explorer metadata
+JUNK_FILE_MARKERS = ("._", "Thumbs.db", "desktop.ini", "ehthumbs.db")
+
+# Directories that are never descended into (PhotoStructure caches)
+JUNK_DIRECTORY_MARKERS = (".photostructure",)
+
+# Files read ahead of the batch being written, so disk, CPU and database work overlap
+PREFETCH_BATCHES = 1
+
+# Deleted files listed in the import statistics (all are counted)
+MAX_REPORTED_DELETED_FILES = 1000
+
+
+def _compile_exclude_patterns(exclude_patterns: Optional[List[str]]) -> Callable[[str, str], bool]:
+    """Compile exclude patterns into a matcher of (directory path, directory name).
+    
+    A directory is excluded if a pattern matches its name or full path (wildcards * and ?),
+    or if the pattern text occurs literally anywhere in its path.
+    """
+    patterns = [pattern for pattern in exclude_patterns or [] if pattern]
+    if not patterns:
+        return lambda directory_str, directory_name: False
+    wildcard = re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+    def is_excluded(directory_str: str, directory_name: str) -> bool:
+        if wildcard.match(directory_name) or wildcard.match(directory_str):
+            return True
+        return any(pattern in directory_str for pattern in patterns)
+
+    return is_excluded
+
+
+def build_import_manifest(
+    root_path: Path,
+    exclude_patterns: Optional[List[str]] = None,
+    max_images: Optional[int] = None
+) -> List[Tuple[str, int, int]]:
+    """List the image files under root_path in a single os.scandir walk.
+    
+    Excluded and junk directories are pruned with everything below them, and files are
+    picked by name, so only image files are stat'ed. Entries are visited in name order.
     
     Args:
-        directory_path: Path to the directory to check
-        exclude_patterns: List of patterns to match against (supports wildcards * and ?)
+        root_path: Root directory to search for images
+        exclude_patterns: Directory patterns to exclude (see _compile_exclude_patterns)
+        max_images: Stop once this many images are listed (None for all)
         
     Returns:
-        True if directory should be excluded, False otherwise
+        List of (path, size, mtime_ns) of the image files
     """
-    if not exclude_patterns:
-        return False
-    
-    directory_str = str(directory_path)
-    directory_name = directory_path.name
+    image_extensions = set(get_image_extensions())
+    is_excluded = _compile_exclude_patterns(exclude_patterns)
+    manifest: List[Tuple[str, int, int]] = []
     
-    for pattern in exclude_patterns:
-        # Check if pattern matches directory name or any part of the path
-        if fnmatch.fnmatch(directory_name, pattern) or fnmatch.fnmatch(directory_str, pattern):
-            return True
-        # Also check if pattern appears anywhere in the path
-        if pattern in directory_str:
-            return True
+    directories = [str(root_path)]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Warning: Could not list {directory}: {e}")
+            continue
+        
+        subdirectories = []
+        for entry in entries:
+            name = entry.name
+            try:
+                is_directory = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_directory:
+                if any(marker in name for marker in JUNK_DIRECTORY_MARKERS) or is_excluded(entry.path, name):
+                    continue
+                subdirectories.append(entry.path)
+            elif os.path.splitext(name)[1].lower() in image_extensions:
+                if any(marker in name for marker in JUNK_FILE_MARKERS):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    print(f"Warning: Could not stat {entry.path}: {e}")
+                    continue
+                manifest.append((entry.path, stat.st_size, stat.st_mtime_ns))
+                if max_images and len(manifest) >= max_images:
+                    return manifest
+        # Reversed so the stack visits subdirectories in name order
+        directories.extend(reversed(subdirectories))
     
-    return False
+    return manifest
 
 
 def import_images_from_filesystem(
@@ -281,170 +349,238 @@ def import_images_from_filesystem(
 ) -> Dict[str, Any]:
     """Import images from filesystem directory.
     
+    The directory is walked once into a manifest of image files, which is compared with
+    the imported_files manifest of earlier imports:
+    
+    - Files with the size and mtime recorded before are skipped without being opened.
+    - Other files are read and hashed in the image process pool workers. A file whose
+      content was recorded before (touched, or moved/renamed from a path that is gone)
+      is only re-pointed, with no thumbnail made and no content rewritten.
+    - New and changed files get thumbnails and EXIF data and are written a batch at a
+      time with one save_images_bulk transaction, while the next batch is processed.
+    - Recorded files that are no longer found are reported in deleted_files.
+    
     Args:
         root_directory: Root directory to search for images
-        max_images: Maximum number of images to import (None for all)
+        max_images: Maximum number of new or changed images to import (None for all)
         create_thumb_and_get_exif: Whether to create thumbnails and process location data from EXIF (default True)
-        progress_callback: Optional callback function called after each image is processed
+        progress_callback: Optional callback function called after each batch of images is stored
         cancelled_check: Optional function to check if import should be cancelled
         exclude_patterns: Optional list of directory patterns to exclude (supports wildcards * and ?)
         
     Returns:
         Dictionary with import statistics
     """
-
-    image_service = ImageService(db=Database())
-    root_path = Path(root_directory)
+    root_path = Path(root_directory).absolute()
     if not root_path.exists() or not root_path.is_dir():
         raise ValueError(f"Directory does not exist or is not a directory: {root_directory}")
     
     storage = ImageStorage()
-    image_extensions = get_image_extensions()
+    process_images_service = ProcessImagesService()
+    batch_size = process_images_service.batch_size
+    
+    manifest = build_import_manifest(root_path, exclude_patterns)
+    known = storage.get_imported_files(str(root_path))
+    
+    # Compare with the recorded manifest; unchanged files are never opened
+    seen = set()
+    work: List[Tuple[str, int, int]] = []
+    files_unchanged = 0
+    for path, size, mtime_ns in manifest:
+        seen.add(path)
+        entry = known.get(path)
+        if (entry and entry["media_item_id"] is not None
+                and entry["size"] == size and entry["mtime_ns"] == mtime_ns):
+            files_unchanged += 1
+            continue
+        work.append((path, size, mtime_ns))
+    truncated = bool(max_images) and len(work) > max_images
+    if truncated:
+        work = work[:max_images]
     
-    # Default exclude_patterns to empty list if not provided
-    if exclude_patterns is None:
-        exclude_patterns = []
+    # Recorded files that are gone may have been moved to one of the new paths
+    missing = {path: entry for path, entry in known.items() if path not in seen}
+    missing_by_hash: Dict[str, str] = {}
+    for path, entry in missing.items():
+        if entry["media_item_id"] is not None:
+            missing_by_hash.setdefault(entry["content_hash"], path)
+    # Workers only hash files whose content may already be stored
+    skip_hashes = frozenset(missing_by_hash) | frozenset(
+        known[path]["content_hash"] for path, _, _ in work
+        if path in known and known[path]["media_item_id"] is not None
+    )
     
     stats = {
-        'total_files': 0,
+        'total_files': len(work),
         'files_processed': 0,
+        'files_found': len(manifest),
+        'files_unchanged': files_unchanged,
+        'files_moved': 0,
+        'files_deleted': 0,
+        'deleted_files': [],
         'images_imported': 0,
         'images_updated': 0,
         'errors': 0,
         'error_messages': [],
-        'current_file': None
+        'current_file': None,
+        'images_per_second': 0.0
     }
     
-    # Track files per directory
-    files_per_directory = {}
-    
-    # First pass: count total files
-    for file_path in root_path.rglob('*'):
-        #ignore any directory path which have a . in the path name
-
-        if ".photostructure" in file_path.parent.name:
-            continue
-        if "._" in file_path.name:
-            continue
-        if "Thumbs.db" in file_path.name:
-            continue
-        if "desktop.ini" in file_path.name:
-            continue
-        if "ehthumbs.db" in file_path.name:
-            continue
-        if "ehthumbs.db-shm" in file_path.name:
-            continue
-        
-        # Check if directory should be excluded
-        if exclude_patterns and _should_exclude_directory(file_path.parent, exclude_patterns):
-            continue
-
-        if file_path.is_file() and file_path.suffix.lower() in image_extensions:
-            stats['total_files'] += 1
-            # Track per directory
-            directory = str(file_path.parent)
-            files_per_directory[directory] = files_per_directory.get(directory, 0) + 1
-    
     # Print files per directory
-    print("\nFiles per directory:")
+    files_per_directory = Counter(os.path.dirname(path) for path, _, _ in work)
+    print("\nNew or changed files per directory:")
     print("-" * 80)
-    for directory, count in sorted(files_per_directory.items(), key=lambda item: item[1], reverse=True):
+    for directory, count in files_per_directory.most_common():
         print(f"{directory}: {count} file(s)")
     print("-" * 80)
-    print(f"Total files: {stats['total_files']}\n")
+    print(f"Files found: {len(manifest)}, unchanged: {files_unchanged}, to process: {len(work)}\n")
     
-    # Second pass: process images
-    images_processed = 0
-    process_images_service = ProcessImagesService()
-
-    for file_path in root_path.rglob('*'):
-        # Check for cancellation
-        if cancelled_check and cancelled_check():
-            stats['status'] = 'cancelled'
-            break
-
-        if ".photostructure" in file_path.parent.name:
-            continue
-        if "._" in file_path.parent.name:
-            continue
-        if "Thumbs.db" in file_path.parent.name:
-            continue
-        if "desktop.ini" in file_path.parent.name:
-            continue
-        if "ehthumbs.db" in file_path.parent.name:
-            continue
-        if "ehthumbs.db-shm" in file_path.parent.name:
-            continue
-        
-        # Check if directory should be excluded
-        if exclude_patterns and _should_exclude_directory(file_path.parent, exclude_patterns):
-            continue
-        
-        # Check max_images limit
-        if max_images and images_processed >= max_images:
-            break
-        
-        if not file_path.is_file():
-            continue
+    def record_error(error_msg: str):
+        print(error_msg)
+        stats['errors'] += 1
+        stats['error_messages'].append(error_msg)
+    
+    def build_row(path: str, image_data: bytes, thumbnail_data: Optional[bytes], exif_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        file_path = Path(path)
+        # Determine MIME type
+        mime_type, _ = mimetypes.guess_type(path)
+        return {
+            "source_reference": path,
+            "image_data": image_data,
+            "thumbnail_data": thumbnail_data,
+            "media_type": mime_type,
+            "title": file_path.stem,
+            "description": exif_data.get('description') if exif_data else None,
+            "tags": generate_directory_tags(file_path, root_path),
+            "year": exif_data.get('year') if exif_data else None,
+            "month": exif_data.get('month') if exif_data else None,
+            "latitude": exif_data.get('latitude') if exif_data else None,
+            "longitude": exif_data.get('longitude') if exif_data else None,
+            "has_gps": exif_data.get('has_gps', False) if exif_data else False,
+            "source": "Filesystem",
+            "processed": create_thumb_and_get_exif,
+        }
+    
+    def process_batch(paths: List[str], skip: Optional[frozenset] = None) -> List[tuple]:
+        return process_images_service.read_files_and_create_thumbs(
+            paths, process_thumbnail=create_thumb_and_get_exif, process_exif=create_thumb_and_get_exif,
+            width=200, skip_hashes=skip
+        )
+    
+    def store_batch(entries: List[Tuple[str, int, int]], results: List[tuple]):
+        to_save = []
+        retry = []
+        touched = []
+        for (path, size, mtime_ns), (image_data, thumbnail_data, exif_data, error, content_hash) in zip(entries, results):
+            if error is not None:
+                record_error(f"Error processing {path}: {error}")
+                continue
+            file_info = {"size": size, "mtime_ns": mtime_ns, "content_hash": content_hash}
+            if image_data is not None:
+                to_save.append((path, file_info, build_row(path, image_data, thumbnail_data, exif_data)))
+                continue
+            
+            # The worker skipped content that is already stored
+            entry = known.get(path)
+            if entry and entry["content_hash"] == content_hash and entry["media_item_id"] is not None:
+                # Only the mtime changed
+                touched.append({**file_info, "path": path, "media_item_id": entry["media_item_id"]})
+                stats['files_unchanged'] += 1
+                continue
+            old_path = missing_by_hash.pop(content_hash, None)
+            file_path = Path(path)
+            if old_path and storage.move_imported_file(
+                old_path, path, file_info,
+                title=file_path.stem, tags=generate_directory_tags(file_path, root_path)
+            ):
+                print(f"Moved: {old_path} -> {path}")
+                missing.pop(old_path, None)
+                stats['files_moved'] += 1
+                continue
+            retry.append((path, size, mtime_ns))
         
-        if file_path.suffix.lower() not in image_extensions:
-            continue
+        if retry:
+            # Same content as another file, but nothing to re-point: import it normally
+            for (path, size, mtime_ns), (image_data, thumbnail_data, exif_data, error, content_hash) in zip(
+                retry, process_batch([path for path, _, _ in retry])
+            ):
+                if error is not None:
+                    record_error(f"Error processing {path}: {error}")
+                    continue
+                file_info = {"size": size, "mtime_ns": mtime_ns, "content_hash": content_hash}
+                to_save.append((path, file_info, build_row(path, image_data, thumbnail_data, exif_data)))
         
-        stats['current_file'] = str(file_path)
-        stats['files_processed'] += 1
+        try:
+            storage.record_imported_files(touched)
+        except Exception as e:
+            print(f"Warning: Could not record unchanged files: {e}")
         
         try:
-            # Read image data
-            with open(file_path, 'rb') as f:
-                image_data = f.read()
-            
-            # Determine MIME type
-            mime_type, _ = mimetypes.guess_type(str(file_path))
-            thumbnail_data, exif_data = process_images_service.create_thumb_and_get_exif(image_data, process_thunbnail=create_thumb_and_get_exif, process_exif=create_thumb_and_get_exif, width=200)
-            tags = generate_directory_tags(file_path, root_path)
-            
-            
-            # Save or update image
-            metadata, is_update = storage.save_image(
-                source_reference=str(file_path.absolute()),
-                image_data=image_data,
-                thumbnail_data=thumbnail_data,
-                media_type=mime_type,
-                title=file_path.stem,
-                description=exif_data.get('description') if exif_data else None,
-                tags=tags,
-                year=exif_data.get('year') if exif_data else None,
-                month=exif_data.get('month') if exif_data else None,
-                latitude=exif_data.get('latitude') if exif_data else None,
-                longitude=exif_data.get('longitude') if exif_data else None,
-                has_gps=exif_data.get('has_gps', False) if exif_data else False,
-                source="Filesystem",
-                processed=create_thumb_and_get_exif
-            )
-
-            
-
-            
-            if is_update:
+            saved = storage.save_images_bulk([row for _, _, row in to_save], [info for _, info, _ in to_save])
+        except Exception as e:
+            # Save one at a time so a bad file only fails itself
+            print(f"Warning: Batch write failed ({e}); saving images one at a time")
+            saved = []
+            for path, file_info, row in to_save:
+                try:
+                    saved.append(storage.save_images_bulk([row], [file_info])[0])
+                except Exception as row_error:
+                    record_error(f"Error processing {path}: {str(row_error)}")
+                    saved.append(None)
+        
+        for result in saved:
+            if result is None:
+                continue
+            if result[1]:
                 stats['images_updated'] += 1
             else:
                 stats['images_imported'] += 1
-            
-            images_processed += 1
-            
-            # Call progress callback
-            if progress_callback:
-                progress_callback(stats.copy())
-                
-        except Exception as e:
-            error_msg = f"Error processing {file_path}: {str(e)}"
-            print(error_msg)
-            stats['errors'] += 1
-            stats['error_messages'].append(error_msg)
-            
-            # Call progress callback even on error
-            if progress_callback:
-                progress_callback(stats.copy())
+        
+        stats['files_processed'] += len(entries)
+        stats['current_file'] = entries[-1][0]
+        stats['images_per_second'] = round(process_images_service.images_per_second(), 1)
+        if progress_callback:
+            progress_callback(stats.copy())
+    
+    batches = [work[start:start + batch_size] for start in range(0, len(work), batch_size)]
+    
+    # Batches are read and thumbnailed in a background thread (on the process pool),
+    # PREFETCH_BATCHES ahead of the batch being written
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = deque()
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            if cancelled_check and cancelled_check():
+                stats['status'] = 'cancelled'
+                break
+            while next_batch < len(batches) and len(pending) <= PREFETCH_BATCHES:
+                batch = batches[next_batch]
+                pending.append((batch, reader.submit(process_batch, [path for path, _, _ in batch], skip_hashes)))
+                next_batch += 1
+            entries, future = pending.popleft()
+            try:
+                results = future.result()
+            except Exception as e:
+                for path, _, _ in entries:
+                    record_error(f"Error processing {path}: {str(e)}")
+                stats['files_processed'] += len(entries)
+                continue
+            store_batch(entries, results)
+        for _, future in pending:
+            future.cancel()
+    
+    print(f"Thumbnails and EXIF: {process_images_service.throughput}")
+    
+    if stats.get('status') == 'cancelled':
+        return stats
+    
+    # Files not processed (max_images) may still turn out to be moves, so deletions
+    # are only reported after a complete run
+    if not truncated and missing:
+        stats['files_deleted'] = len(missing)
+        # Bounded, since the stats are sent with every progress event
+        stats['deleted_files'] = sorted(missing)[:MAX_REPORTED_DELETED_FILES]
+        print(f"{len(missing)} previously imported file(s) no longer found under {root_path}")
     
     stats['status'] = 'completed'
     return stats
@@ -0,0 +1,598 @@
+"""
+Thumbnail and EXIF engine for stored images.
+
+Backends turn image bytes into a JPEG thumbnail and an EXIF dictionary. The default
+"pillow" backend works in process with Pillow (and pillow-heif for HEIC/HEIF, when
+installed); large JPEGs are decoded in draft mode, at the smallest DCT scale that is
+still at least the thumbnail size, so a 12 MP photo is never fully decoded. The
+"magick" backend runs ImageMagick once per image, as before.
+
+process_images runs a batch of images on the shared ingest process pool, and
+process_image_files does the same for files, reading them in the workers.
+
+Renditions (the display-size copies kept in media_renditions) are always made with
+Pillow, whatever the backend: one decode per image, with each size resized from the
+next larger one.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from PIL import Image, ImageFilter, ImageOps, features
+
+# Try to register HEIF/HEIC support if pillow-heif is available
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORT = True
+except ImportError:
+    HEIF_SUPPORT = False
+
+
+# (thumbnail JPEG bytes or None, EXIF dictionary or None)
+ImageResult = Tuple[Optional[bytes], Optional[Dict[str, Any]]]
+
+# (file content or None, thumbnail, EXIF, error message if the file could not be read,
+#  SHA-256 hex digest of the content)
+ImageFileResult = Tuple[Optional[bytes], Optional[bytes], Optional[Dict[str, Any]], Optional[str], Optional[str]]
+
+# (rendition size, MIME type, width, height, image bytes)
+Rendition = Tuple[int, str, int, int, bytes]
+
+# Rendition format -> (Pillow format, MIME type, save options)
+RENDITION_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"optimize": True, "progressive": True}),
+}
+
+WEBP_SUPPORT = features.check("webp")
+
+# EXIF tags and IFDs read by the Pillow backend
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_TAG_DOCUMENT_NAME = 0x010D
+_TAG_IMAGE_DESCRIPTION = 0x010E
+_TAG_DATE_TIME = 0x0132
+_TAG_DATE_TIME_ORIGINAL = 0x9003
+_TAG_XP_KEYWORDS = 0x9C9E
+_GPS_LATITUDE_REF = 1
+_GPS_LATITUDE = 2
+_GPS_LONGITUDE_REF = 3
+_GPS_LONGITUDE = 4
+
+
+def _empty_exif() -> Dict[str, Any]:
+    return {
+        "width": None,
+        "height": None,
+        "date_taken": None,
+        "title": None,
+        "description": None,
+        "tags": None,
+        "year": None,
+        "month": None,
+        "day": None,
+        "latitude": None,
+        "longitude": None,
+        "has_gps": False,
+    }
+
+
+def _dms_to_degrees(value) -> Optional[float]:
+    """Convert an EXIF (degrees, minutes, seconds) rational triple to decimal degrees."""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value[:3])
+        return degrees + minutes / 60.0 + seconds / 3600.0
+    except (ValueError, TypeError, ZeroDivisionError):
+        return None
+
+
+def _exif_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        # XP* tags are UTF-16LE
+        value = value.decode("utf-16-le", errors="ignore")
+    value = str(value).strip("\x00 ")
+    return value or None
+
+
+def _flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Convert to RGB, putting transparent images on a white background."""
+    if img.mode in ("RGBA", "LA", "P"):
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+class PillowImageBackend:
+    """In-process thumbnails and EXIF with Pillow."""
+
+    name = "pillow"
+
+    def create_thumb_and_get_exif(self, image_data: bytes, process_thumbnail: bool = True,
+                                  process_exif: bool = True, width: int = 200) -> ImageResult:
+        if not process_thumbnail and not process_exif:
+            return None, None
+        try:
+            with Image.open(BytesIO(image_data)) as img:
+                exif = self._read_exif(img) if process_exif else None
+                thumbnail = self._create_thumbnail(img, width) if process_thumbnail else None
+            return thumbnail, exif
+        except Exception as e:
+            print(f"Error: Could not process image with Pillow: {e}")
+            return None, None
+
+    def _create_thumbnail(self, img: Image.Image, width: int) -> bytes:
+        if img.format == "JPEG":
+            # Let the JPEG decoder scale down by up to 8x while decoding
+            img.draft("RGB", (width, width))
+        img = _flatten_to_rgb(ImageOps.exif_transpose(img))
+
+        # Only shrinks, like ImageMagick's "-resize WxW>"
+        img.thumbnail((width, width), Image.Resampling.LANCZOS)
+        img = img.filter(ImageFilter.UnsharpMask(radius=0.75, percent=75, threshold=2))
+
+        output = BytesIO()
+        img.save(output, format="JPEG", quality=95)
+        return output.getvalue()
+
+    def _read_exif(self, img: Image.Image) -> Dict[str, Any]:
+        exif_data = _empty_exif()
+        exif_data["width"], exif_data["height"] = img.size
+
+        exif = img.getexif()
+        if not exif:
+            return exif_data
+        exif_ifd = exif.get_ifd(_EXIF_IFD)
+
+        exif_data["title"] = _exif_text(exif.get(_TAG_DOCUMENT_NAME))
+        exif_data["description"] = _exif_text(exif.get(_TAG_IMAGE_DESCRIPTION))
+        exif_data["tags"] = _exif_text(exif.get(_TAG_XP_KEYWORDS))
+
+        date_taken = _exif_text(exif_ifd.get(_TAG_DATE_TIME_ORIGINAL) or exif.get(_TAG_DATE_TIME))
+        if date_taken:
+            exif_data["date_taken"] = date_taken
+            try:
+                taken = datetime.strptime(date_taken[:19], "%Y:%m:%d %H:%M:%S")
+                exif_data["year"] = taken.year
+                exif_data["month"] = taken.month
+                exif_data["day"] = taken.day
+            except ValueError:
+                pass
+
+        gps = exif.get_ifd(_GPS_IFD)
+        if gps:
+            latitude = _dms_to_degrees(gps.get(_GPS_LATITUDE)) if gps.get(_GPS_LATITUDE) else None
+            longitude = _dms_to_degrees(gps.get(_GPS_LONGITUDE)) if gps.get(_GPS_LONGITUDE) else None
+            if latitude is not None and str(gps.get(_GPS_LATITUDE_REF, "")).strip().upper() == "S":
+                latitude = -latitude
+            if longitude is not None and str(gps.get(_GPS_LONGITUDE_REF, "")).strip().upper() == "W":
+                longitude = -longitude
+            exif_data["latitude"] = latitude
+            exif_data["longitude"] = longitude
+        exif_data["has_gps"] = exif_data["latitude"] is not None and exif_data["longitude"] is not None
+        return exif_data
+
+
+class ImageMagickBackend:
+    """Thumbnails and EXIF from an ImageMagick subprocess per image."""
+
+    name = "magick"
+
+    FORMAT_STRING = '{"width": "%w", "height": "%h", "date_taken": "%[EXIF:DateTimeOriginal]", "latitude": "%[EXIF:GPSLatitude]", "longitude": "%[EXIF:GPSLongitude]", "latitude_ref": "%[EXIF:GPSLatitudeRef]", "longitude_ref": "%[EXIF:GPSLongitudeRef]", "title": "%[EXIF:DocumentName]", "description": "%[EXIF:ImageDescription]", "tags": "%[EXIF:Keywords]"}'
+
+    # Windows installations are not always on PATH
+    COMMON_PATHS = [
+        r"C:\Program Files\ImageMagick-7.1.2-Q16-HDRI\magick.exe",
+        r"C:\Program Files\ImageMagick-7.1.0-Q16-HDRI\magick.exe",
+        r"C:\Program Files\ImageMagick-7.0.11-Q16-HDRI\magick.exe",
+        r"C:\Program Files (x86)\ImageMagick-7.1.1-Q16-HDRI\magick.exe",
+        r"C:\Program Files (x86)\ImageMagick-7.1.0-Q16-HDRI\magick.exe",
+    ]
+
+    _command: Optional[str] = None
+
+    @classmethod
+    def find_imagemagick_command(cls) -> Optional[str]:
+        """Find the ImageMagick 7 executable (looked up once per process).
+
+        Returns:
+            Path to ImageMagick executable or None if not found
+        """
+        if cls._command is None:
+            for cmd in ("magick", "magick.exe"):
+                path = shutil.which(cmd)
+                if path:
+                    cls._command = path
+                    break
+            else:
+                cls._command = next((path for path in cls.COMMON_PATHS if os.path.exists(path)), "")
+        return cls._command or None
+
+    @staticmethod
+    def parse_gps_coordinate(gps_string: str) -> Optional[float]:
+        """
+        Parse GPS coordinate from ImageMagick format (degrees/minutes/seconds as fractions)
+        to decimal degrees.
+
+        Format: "degrees/numerator,minutes/numerator,seconds/numerator"
+        Example: "25/1,6/1,4036/100" = 25° 6' 40.36"
+        """
+        if not gps_string or gps_string.strip() == '':
+            return None
+        try:
+            parts = gps_string.split(',')
+            if len(parts) != 3:
+                return None
+            values = []
+            for part in parts:
+                fraction = part.split('/')
+                values.append(float(fraction[0]) / float(fraction[1]) if len(fraction) == 2 else float(fraction[0]))
+            return values[0] + values[1] / 60.0 + values[2] / 3600.0
+        except (ValueError, IndexError, ZeroDivisionError) as e:
+            print(f"Warning: Could not parse GPS coordinate '{gps_string}': {e}")
+            return None
+
+    def parse_exif_data(self, exifJson: Dict[str, Any]) -> Dict[str, Any]:
+        if exifJson.get('date_taken'):
+            date_taken = datetime.strptime(exifJson['date_taken'], '%Y:%m:%d %H:%M:%S')
+            exifJson['year'] = date_taken.year
+            exifJson['month'] = date_taken.month
+            exifJson['day'] = date_taken.day
+        else:
+            exifJson['year'] = None
+            exifJson['month'] = None
+
+        # Convert empty strings to None
+        for key, ref_key, negative_ref in (("latitude", "latitude_ref", "S"), ("longitude", "longitude_ref", "W")):
+            value = exifJson.get(key, '')
+            decimal = self.parse_gps_coordinate(value) if value and value.strip() else None
+            if decimal is not None and exifJson.get(ref_key, '').strip().upper() == negative_ref:
+                decimal = -decimal
+            exifJson[key] = decimal
+
+        exifJson['has_gps'] = exifJson.get('latitude') is not None and exifJson.get('longitude') is not None
+        return exifJson
+
+    def create_thumb_and_get_exif(self, image_data: bytes, process_thumbnail: bool = True,
+                                  process_exif: bool = True, width: int = 200) -> ImageResult:
+        magick_cmd = self.find_imagemagick_command()
+        if not process_thumbnail and not process_exif:
+            return None, None
+        if magick_cmd is None:
+            print("❌ ImageMagick executable not found")
+            return None, None
+
+        resize = [
+            "-filter", "Lanczos",
+            "-colorspace", "sRGB",
+            "-resize", f"{width}x{width}>",
+            "-unsharp", "0x0.75+0.75+0.008",
+            "-quality", "95",
+            "-strip",
+            "jpg:-",
+        ]
+        if process_thumbnail and process_exif:
+            # The EXIF JSON goes to stderr and the thumbnail to stdout
+            cmd = [magick_cmd, "-", "-quiet", "-format", self.FORMAT_STRING, "-write", "info:fd:2"] + resize
+        elif process_thumbnail:
+            cmd = [magick_cmd, "-"] + resize
+        else:
+            cmd = [magick_cmd, "identify", "-quiet", "-format", self.FORMAT_STRING, "-"]
+
+        try:
+            process = subprocess.run(cmd, input=image_data, capture_output=True)
+        except OSError as e:
+            print(f"❌ Could not run ImageMagick ({magick_cmd}): {e}")
+            return None, None
+        if process.returncode != 0:
+            print(f"❌ ImageMagick Error: {process.stderr.decode('utf-8', errors='ignore')}")
+            return None, None
+
+        try:
+            if process_thumbnail and process_exif:
+                info = process.stderr
+            elif process_thumbnail:
+                return process.stdout, None
+            else:
+                info = process.stdout
+            if not info:
+                return (process.stdout if process_thumbnail else None), None
+            exif = self.parse_exif_data(json.loads(info.decode('utf-8', errors='ignore')))
+            return (process.stdout if process_thumbnail else None), exif
+        except Exception as e:
+            print(f"Error: {e}")
+            return None, None
+
+
+IMAGE_BACKENDS = {
+    PillowImageBackend.name: PillowImageBackend,
+    ImageMagickBackend.name: ImageMagickBackend,
+}
+
+_backends: Dict[str, Any] = {}
+
+
+def get_image_backend(name: str):
+    """Get the (per-process) instance of a backend by name."""
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in IMAGE_BACKENDS:
+            raise ValueError(f"Unknown image processing backend: {name}")
+        backend = _backends.setdefault(name, IMAGE_BACKENDS[name]())
+    return backend
+
+
+def process_image(backend: str, image_data: bytes, process_thumbnail: bool = True,
+                  process_exif: bool = True, width: int = 200) -> ImageResult:
+    """Create the thumbnail and read the EXIF data of one image. Runs in pool workers."""
+    return get_image_backend(backend).create_thumb_and_get_exif(image_data, process_thumbnail, process_exif, width)
+
+
+def _process_image_chunk(images: List[bytes], backend: str, process_thumbnail: bool,
+                         process_exif: bool, width: int) -> List[ImageResult]:
+    return [process_image(backend, image_data, process_thumbnail, process_exif, width) for image_data in images]
+
+
+def _process_image_file_chunk(paths: List[str], backend: str, process_thumbnail: bool,
+                              process_exif: bool, width: int,
+                              skip_hashes: Optional[FrozenSet[str]] = None) -> List[ImageFileResult]:
+    results = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                image_data = f.read()
+        except OSError as e:
+            results.append((None, None, None, str(e), None))
+            continue
+        content_hash = hashlib.sha256(image_data).hexdigest()
+        if skip_hashes and content_hash in skip_hashes:
+            # Content the caller already has; neither processed nor sent back
+            results.append((None, None, None, None, content_hash))
+            continue
+        thumbnail, exif = process_image(backend, image_data, process_thumbnail, process_exif, width)
+        results.append((image_data, thumbnail, exif, None, content_hash))
+    return results
+
+
+@dataclass
+class ImageThroughput:
+    """Images processed by an engine and the wall-clock time spent on them."""
+    images: int = 0
+    seconds: float = 0.0
+
+    def add(self, images: int, seconds: float):
+        self.images += images
+        self.seconds += seconds
+
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.images} images in {self.seconds:.1f}s ({self.images_per_second():.1f} images/s)"
+
+
+def _map_chunks(chunk_function, items: List[Any], workers: int, *args) -> List[Any]:
+    """Apply chunk_function(chunk, *args) to items, in chunks on the shared process pool.
+
+    Returns one result per item, in input order. With workers 0 (or a single item) the
+    items are processed in this process.
+    """
+    pool = None
+    if workers > 0 and len(items) > 1:
+        # Imported here so pool workers, which import this module, do not load the database layer
+        from .ingest import get_process_pool, _discard_process_pool
+        pool = get_process_pool(workers)
+    if pool is None:
+        return chunk_function(items, *args)
+
+    # A few chunks per worker balance uneven image sizes without a round trip per image
+    chunk_size = max(1, len(items) // (workers * 4))
+    try:
+        futures = [
+            pool.submit(chunk_function, items[start:start + chunk_size], *args)
+            for start in range(0, len(items), chunk_size)
+        ]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+    except Exception as e:
+        # A crashed worker breaks the pool; finish the batch in this process
+        print(f"Warning: Image process pool failed ({e}); processing in this process")
+        _discard_process_pool(pool)
+        return chunk_function(items, *args)
+
+
+def process_images(backend: str, images: List[Optional[bytes]], process_thumbnail: bool = True,
+                   process_exif: bool = True, width: int = 200, workers: int = 0,
+                   throughput: Optional[ImageThroughput] = None) -> List[ImageResult]:
+    """Create thumbnails and read EXIF data for a batch of images.
+
+    Args:
+        backend: Backend name ("pillow" or "magick")
+        images: Image bytes; None entries give (None, None)
+        workers: Size of the shared process pool (0 processes the batch in this process)
+        throughput: Optional ImageThroughput the batch is added to
+
+    Returns:
+        (thumbnail, exif) per image, in input order
+    """
+    started = time.monotonic()
+    indexes = [index for index, image_data in enumerate(images) if image_data]
+    results: List[ImageResult] = [(None, None)] * len(images)
+    processed = _map_chunks(_process_image_chunk, [images[index] for index in indexes], workers,
+                            backend, process_thumbnail, process_exif, width)
+    for index, result in zip(indexes, processed):
+        results[index] = result
+
+    if throughput is not None:
+        throughput.add(len(indexes), time.monotonic() - started)
+    return results
+
+
+def process_image_files(backend: str, paths: List[str], process_thumbnail: bool = True,
+                        process_exif: bool = True, width: int = 200, workers: int = 0,
+                        throughput: Optional[ImageThroughput] = None,
+                        skip_hashes: Optional[FrozenSet[str]] = None) -> List[ImageFileResult]:
+    """Read image files and create their thumbnails and EXIF data, in the pool workers.
+
+    Reading in the workers keeps several files in flight, and the content only
+    crosses a process boundary once, on its way back to be stored.
+
+    Args:
+        skip_hashes: Content hashes the caller already has; files with one of these
+                     come back with only their hash (content None, no error)
+
+    Returns:
+        (content, thumbnail, exif, error, content_hash) per path, in input order
+    """
+    started = time.monotonic()
+    results = _map_chunks(_process_image_file_chunk, list(paths), workers,
+                          backend, process_thumbnail, process_exif, width, skip_hashes)
+    if throughput is not None:
+        throughput.add(len(paths), time.monotonic() - started)
+    return results
+
+
+def rendition_sizes_for(sizes: List[int], width: int, height: int) -> List[int]:
+    """Get the rendition sizes worth storing for an image of width x height.
+
+    Sizes below the image's long edge are kept, plus the smallest size at or above it
+    (holding the image at its own size); larger sizes would only repeat that one.
+    """
+    long_edge = max(width, height)
+    kept = [size for size in sorted(set(sizes)) if size < long_edge]
+    larger = [size for size in sorted(set(sizes)) if size >= long_edge]
+    if larger:
+        kept.append(larger[0])
+    return kept
+
+
+def select_rendition_size(available: List[int], requested: int) -> Optional[int]:
+    """Pick the stored rendition to serve for a requested size.
+
+    The smallest rendition at least as large as requested, so the image is never
+    upscaled in the browser, or else the largest there is.
+    """
+    if not available:
+        return None
+    larger = [size for size in available if size >= requested]
+    return min(larger) if larger else max(available)
+
+
+def create_renditions(image_data: bytes, sizes: List[int], image_format: str = "webp",
+                      quality: int = 80) -> List[Rendition]:
+    """Create the renditions of one image, fitting each size x size box.
+
+    Animated images and content Pillow cannot decode give no renditions; the
+    original is served for those.
+
+    Args:
+        sizes: Bounding box sizes in pixels (long edge)
+        image_format: "webp" or "jpeg" (WebP falls back to JPEG when Pillow lacks libwebp)
+        quality: Encoder quality (1-100)
+
+    Returns:
+        (size, MIME type, width, height, image bytes) per rendition, largest first
+    """
+    if image_format == "webp" and not WEBP_SUPPORT:
+        image_format = "jpeg"
+    pil_format, content_type, save_options = RENDITION_FORMATS[image_format]
+    try:
+        with Image.open(BytesIO(image_data)) as img:
+            if getattr(img, "is_animated", False):
+                return []
+            kept = rendition_sizes_for(sizes, *img.size)
+            if img.format == "JPEG":
+                img.draft("RGB", (kept[-1], kept[-1]))
+            current = _flatten_to_rgb(ImageOps.exif_transpose(img))
+
+            renditions = []
+            # Each size is resized from the previous, larger one rather than the original
+            for size in reversed(kept):
+                current = current.copy()
+                current.thumbnail((size, size), Image.Resampling.LANCZOS)
+                output = BytesIO()
+                current.filter(ImageFilter.UnsharpMask(radius=0.75, percent=50, threshold=2)).save(
+                    output, format=pil_format, quality=quality, **save_options
+                )
+                renditions.append((size, content_type, current.width, current.height, output.getvalue()))
+            return renditions
+    except Exception as e:
+        print(f"Error: Could not create renditions with Pillow: {e}")
+        return []
+
+
+def _rendition_chunk(images: List[bytes], sizes: List[int], image_format: str, quality: int) -> List[List[Rendition]]:
+    return [create_renditions(image_data, sizes, image_format, quality) for image_data in images]
+
+
+def create_renditions_batch(images: List[Optional[bytes]], sizes: List[int], image_format: str = "webp",
+                            quality: int = 80, workers: int = 0,
+                            throughput: Optional[ImageThroughput] = None) -> List[List[Rendition]]:
+    """Create renditions for a batch of images on the shared process pool.
+
+    Returns:
+        The renditions of each image (empty for None entries), in input order
+    """
+    started = time.monotonic()
+    indexes = [index for index, image_data in enumerate(images) if image_data]
+    results: List[List[Rendition]] = [[] for _ in images]
+    processed = _map_chunks(_rendition_chunk, [images[index] for index in indexes], workers,
+                            list(sizes), image_format, quality)
+    for index, result in zip(indexes, processed):
+        results[index] = result
+
+    if throughput is not None:
+        throughput.add(len(indexes), time.monotonic() - started)
+    return results
+
+
+def convert_to_jpeg(image_data: bytes, quality: int = 95) -> Optional[bytes]:
+    """Re-encode an image (typically HEIC/HEIF) as a full-size JPEG, or None if it cannot be decoded."""
+    try:
+        with Image.open(BytesIO(image_data)) as img:
+            output = BytesIO()
+            _flatten_to_rgb(img).save(output, format="JPEG", quality=quality)
+            return output.getvalue()
+    except Exception as e:
+        print(f"Error: Could not convert image to JPEG with Pillow: {e}")
+        return None
+
+
+def _convert_to_jpeg_chunk(images: List[bytes], quality: int) -> List[Optional[bytes]]:
+    return [convert_to_jpeg(image_data, quality) for image_data in images]
+
+
+def convert_to_jpeg_batch(images: List[Optional[bytes]], quality: int = 95, workers: int = 0,
+                          throughput: Optional[ImageThroughput] = None) -> List[Optional[bytes]]:
+    """Convert a batch of images to full-size JPEGs on the shared process pool.
+
+    Returns:
+        JPEG bytes per image (None for None entries and failures), in input order
+    """
+    started = time.monotonic()
+    indexes = [index for index, image_data in enumerate(images) if image_data]
+    results: List[Optional[bytes]] = [None] * len(images)
+    converted = _map_chunks(_convert_to_jpeg_chunk, [images[index] for index in indexes], workers, quality)
+    for index, result in zip(indexes, converted):
+        results[index] = result
+
+    if throughput is not None:
+        throughput.add(len(indexes), time.monotonic() - started)
+    return results
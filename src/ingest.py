@@ -0,0 +1,607 @@
+"""
+Email ingest pipeline.
+
+Loading a label runs as concurrent stages connected by bounded queues: Gmail fetch
+(network, which also decodes attachment data), thumbnails and EXIF extraction (CPU,
+on a process pool) and batched database writes. Each stage reports its own throughput, so the
+slowest stage is visible in the log.
+"""
+
+import base64
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional
+from PIL import Image, ImageDraw, ImageFont
+
+from .config import AttachmentConfig
+from .database.storage import EmailStorage, extract_exif_data_from_bytes, folder_from_labels
+
+
+def get_file_type(mime_type: Optional[str], filename: Optional[str] = None) -> str:
+    """Determine file type from MIME type and/or filename.
+
+    Args:
+        mime_type: The MIME type
+        filename: Optional filename
+
+    Returns:
+        File type: 'image', 'pdf', 'text', 'video', 'audio', or 'unknown'
+    """
+    if not mime_type:
+        mime_type = ""
+    mime_lower = mime_type.lower()
+
+    if mime_lower.startswith("image/"):
+        return "image"
+    elif mime_lower == "application/pdf":
+        return "pdf"
+    elif mime_lower.startswith("text/"):
+        return "text"
+    elif mime_lower.startswith("video/"):
+        return "video"
+    elif mime_lower.startswith("audio/"):
+        return "audio"
+    elif filename:
+        # Check file extension as fallback
+        _, ext = os.path.splitext(filename)
+        ext = ext.lstrip(".").lower()
+        if ext == "pdf":
+            return "pdf"
+        elif ext in ["txt", "md", "csv", "json", "xml", "html", "css", "js"]:
+            return "text"
+        elif ext in ["mp4", "avi", "mov", "wmv", "flv", "webm", "mkv"]:
+            return "video"
+        elif ext in ["mp3", "wav", "ogg", "flac", "aac", "m4a"]:
+            return "audio"
+
+    return "unknown"
+
+def create_icon_thumbnail(file_type: str, max_size: int = 100) -> bytes:
+    """Create an icon-based thumbnail for non-image file types.
+
+    Args:
+        file_type: Type of file ('pdf', 'text', 'video', 'audio', 'unknown')
+        max_size: Size of thumbnail (default: 100)
+
+    Returns:
+        Binary thumbnail data as JPEG
+    """
+    # Define colors and labels for each file type
+    type_configs = {
+        "pdf": {"color": (220, 38, 38), "label": "PDF"},  # Red
+        "text": {"color": (34, 139, 34), "label": "TEXT"},  # Green
+        "video": {"color": (75, 0, 130), "label": "VIDEO"},  # Purple
+        "audio": {"color": (255, 140, 0), "label": "AUDIO"},  # Orange
+        "unknown": {"color": (128, 128, 128), "label": "FILE"},  # Gray
+    }
+
+    config = type_configs.get(file_type, type_configs["unknown"])
+    bg_color = config["color"]
+    label = config["label"]
+
+    # Create image with white background
+    img = Image.new("RGB", (max_size, max_size), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+
+    # Draw colored rectangle (slightly inset)
+    margin = 10
+    draw.rectangle(
+        [margin, margin, max_size - margin, max_size - margin],
+        fill=bg_color,
+        outline=(200, 200, 200),
+        width=2
+    )
+
+    # Try to use a default font, fallback to basic if not available
+    font_size = max_size // 4
+    font = None
+
+    # Try common font paths
+    font_paths = [
+        "arial.ttf",
+        "Arial.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/System/Library/Fonts/Helvetica.ttc",
+        "C:/Windows/Fonts/arial.ttf",
+    ]
+
+    for font_path in font_paths:
+        try:
+            font = ImageFont.truetype(font_path, font_size)
+            break
+        except:
+            continue
+
+    # Fallback to default font if no truetype font found
+    if font is None:
+        font = ImageFont.load_default()
+
+    # Calculate text position (centered)
+    bbox = draw.textbbox((0, 0), label, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    text_x = (max_size - text_width) // 2
+    text_y = (max_size - text_height) // 2
+
+    # Draw text in white
+    draw.text((text_x, text_y), label, fill=(255, 255, 255), font=font)
+
+    # Save to bytes as JPEG
+    thumbnail_bytes = BytesIO()
+    img.save(thumbnail_bytes, format="JPEG", quality=85)
+    thumbnail_bytes.seek(0)
+
+    return thumbnail_bytes.getvalue()
+
+def create_thumbnail(image_data: bytes, max_size: int = 100) -> Optional[bytes]:
+    """Create a thumbnail from image data.
+
+    Args:
+        image_data: Binary image data
+        max_size: Maximum width/height for thumbnail (default: 100)
+
+    Returns:
+        Binary thumbnail data as JPEG, or None if creation fails
+    """
+    try:
+        # Open image from bytes
+        img = Image.open(BytesIO(image_data))
+
+        # Convert to RGB if necessary (handles RGBA, P, etc.)
+        if img.mode in ("RGBA", "LA", "P"):
+            # Create a white background
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            if img.mode == "P":
+                img = img.convert("RGBA")
+            background.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        # Calculate thumbnail size maintaining aspect ratio
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+        # Save to bytes as JPEG
+        thumbnail_bytes = BytesIO()
+        img.save(thumbnail_bytes, format="JPEG", quality=85)
+        thumbnail_bytes.seek(0)
+
+        return thumbnail_bytes.getvalue()
+    except Exception as e:
+        print(f"Warning: Could not create thumbnail: {e}")
+        return None
+
+def should_save_attachment(attachment: Dict[str, Any], attachment_config: AttachmentConfig) -> bool:
+    """Check if an attachment should be saved based on configuration.
+
+    Args:
+        attachment: Dictionary containing attachment data with keys:
+            - filename: Optional filename
+            - mimeType: Optional MIME type
+            - size: Optional size in bytes
+        attachment_config: Attachment filtering configuration
+
+    Returns:
+        True if attachment should be saved, False otherwise
+    """
+    # If no filtering is configured, save all attachments
+    if attachment_config.allowed_types is None and attachment_config.min_size == 0:
+        return True
+
+    # Check size first (most efficient check)
+    size = attachment.get("size", 0)
+    if size < attachment_config.min_size:
+        return False
+
+    # If no type restrictions, only size matters
+    if attachment_config.allowed_types is None:
+        return True
+
+    # Check MIME type
+    mime_type = attachment.get("mimeType", "").lower()
+    if mime_type and mime_type in attachment_config.allowed_types:
+        return True
+
+    # Check file extension
+    filename = attachment.get("filename", "")
+    if filename:
+        # Get extension without the dot
+        _, ext = os.path.splitext(filename)
+        ext = ext.lstrip(".").lower()
+        if ext and ext in attachment_config.allowed_types:
+            return True
+
+    # Attachment doesn't match any allowed type
+    return False
+
+
+def prepare_attachment(attachment: Dict[str, Any]) -> Dict[str, Any]:
+    """Add an attachment's thumbnail and EXIF data.
+    
+    The attachment data is decoded once, by GmailClient or the importer that parsed the
+    message, and the same bytes object is passed on to thumbnailing, EXIF extraction and
+    storage without being copied.
+    
+    Args:
+        attachment: Attachment dictionary as produced by GmailClient, with data as bytes
+                    (base64url text is still accepted and decoded)
+        
+    Returns:
+        Copy of the attachment dictionary (sharing its data) with data as bytes (None if
+        it could not be decoded), plus "thumbnail" and, for images, "exif"
+    """
+    processed_att = attachment.copy()
+    mime_type = processed_att.get("mimeType", "")
+    filename = processed_att.get("filename", "")
+    file_type = get_file_type(mime_type, filename)
+    if "data" in processed_att and processed_att["data"]:
+        try:
+            data = processed_att["data"]
+            if isinstance(data, str):
+                # Add padding if needed
+                padding = len(data) % 4
+                if padding:
+                    data += "=" * (4 - padding)
+                processed_att["data"] = base64.urlsafe_b64decode(data)
+            elif not isinstance(data, bytes):
+                processed_att["data"] = bytes(data)
+            
+            # Create thumbnail for all attachment types
+            if file_type == "image" and processed_att["data"]:
+                # Create image thumbnail from actual image data
+                thumbnail = create_thumbnail(processed_att["data"])
+                if thumbnail:
+                    processed_att["thumbnail"] = thumbnail
+            else:
+                # Create icon-based thumbnail for non-image files
+                processed_att["thumbnail"] = create_icon_thumbnail(file_type)
+        except Exception as e:
+            print(f"Warning: Could not decode attachment data: {e}")
+            processed_att["data"] = None
+        
+        # Extract EXIF data here so save_email does not redo it while holding a transaction
+        if processed_att["data"] and (mime_type or "").lower().startswith("image/"):
+            try:
+                processed_att["exif"] = extract_exif_data_from_bytes(processed_att["data"])
+            except Exception as e:
+                print(f"Warning: Could not extract EXIF data from email attachment: {e}")
+                processed_att["exif"] = {}
+    elif file_type != "image":
+        # Even if no data, create thumbnail based on file type
+        processed_att["thumbnail"] = create_icon_thumbnail(file_type)
+    return processed_att
+
+
+def prepare_email(email: Dict[str, Any], attachment_config: AttachmentConfig) -> Dict[str, Any]:
+    """Turn a message from GmailClient into EmailStorage.save_email arguments.
+    
+    Does the CPU-bound part of storing an email: filters attachments by configuration,
+    creates thumbnails and extracts EXIF data from images.
+    Runs in pipeline worker processes, so it must only use its arguments.
+    
+    Args:
+        email: Message dictionary as produced by GmailClient
+        attachment_config: Attachment filtering configuration
+        
+    Returns:
+        Dictionary of save_email keyword arguments
+    """
+    uid = email["metadata"]["uid"]
+    # Convert labels list to comma-separated string
+    labels = email["metadata"]["labels"]
+    folder = folder_from_labels(labels if isinstance(labels, list) else str(labels).split(","))
+    
+    # Parse date string to datetime object
+    date_str = email["metadata"]["date"]
+    date = None
+    if date_str:
+        try:
+            date = parsedate_to_datetime(date_str)
+        except (ValueError, TypeError) as e:
+            print(f"Warning: Could not parse date '{date_str}': {e}")
+            date = None
+    
+    # Filter and process attachments
+    attachments = email.get("attachments", [])
+    processed_attachments = []
+    filtered_count = 0
+    for att in attachments:
+        # Check if attachment should be saved based on configuration
+        if not should_save_attachment(att, attachment_config):
+            filtered_count += 1
+            continue
+        
+        processed_attachments.append(prepare_attachment(att))
+    
+    if filtered_count > 0:
+        print(f"Filtered out {filtered_count} attachment(s) based on configuration")
+    
+    return {
+        "uid": uid,
+        "folder": folder,
+        "subject": email["metadata"]["subject"],
+        "snippet": email["snippet"],
+        "from_address": email["metadata"]["from"],
+        "to_addresses": email["metadata"]["to"],
+        "cc_addresses": email["metadata"]["cc"],
+        "bcc_addresses": email["metadata"]["bcc"],
+        "date": date,
+        "raw_message": email["body"]["html"],
+        "plain_text": email["body"]["text"],
+        "attachments": processed_attachments,
+    }
+
+
+# Process pool shared by all pipelines, so concurrent labels do not each start cpu_workers processes
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """Get the shared process pool for the CPU stage, or None if workers is 0."""
+    global _process_pool, _process_pool_workers
+    if workers < 1:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # Spawned rather than forked: forking a process that runs threads can copy held locks
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pool_workers = workers
+        return _process_pool
+
+
+def _discard_process_pool(pool: ProcessPoolExecutor):
+    """Forget a broken process pool so the next pipeline starts a new one."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+
+
+@dataclass
+class StageStats:
+    """Throughput of one pipeline stage."""
+    name: str
+    items: int = 0
+    busy_seconds: float = 0.0  # Time spent working rather than waiting on the neighbouring stages
+    elapsed_seconds: float = 0.0
+
+    def rate(self) -> float:
+        """Emails per second of busy time, i.e. what the stage could sustain on its own."""
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.name}: {self.items} emails in {self.elapsed_seconds:.1f}s, "
+                f"busy {self.busy_seconds:.1f}s ({self.rate():.1f} emails/s)")
+
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class EmailIngestPipeline:
+    """Stores a stream of Gmail messages through fetch, process and store stages.
+    
+    The fetch stage pulls messages from the GmailClient generator, the process stage
+    runs prepare_email on a process pool and the store stage writes the results in
+    batches of write_batch_size emails per transaction. Stages are connected by
+    queues holding at most queue_size emails, so a slow stage holds back the
+    others instead of buffering the mailbox in memory.
+    """
+    
+    def __init__(
+        self,
+        storage: EmailStorage,
+        attachment_config: AttachmentConfig,
+        cpu_workers: int = 0,
+        queue_size: int = 100,
+        write_batch_size: int = 25
+    ):
+        """Initialize the pipeline.
+        
+        Args:
+            storage: Storage the emails are saved with
+            attachment_config: Attachment filtering configuration
+            cpu_workers: Processes for the process stage; 0 runs it in a thread
+            queue_size: Emails buffered between stages
+            write_batch_size: Emails written per database transaction
+        """
+        self.storage = storage
+        self.attachment_config = attachment_config
+        self.cpu_workers = cpu_workers
+        self.queue_size = max(1, queue_size)
+        self.write_batch_size = max(1, write_batch_size)
+        # Emails that failed in the process or store stage, or a failed fetch stage
+        self.errors = 0
+        self.stats: List[StageStats] = []
+        self._errors_lock = threading.Lock()
+        self._stop = threading.Event()
+    
+    def run(self, emails: Iterable[Dict[str, Any]]) -> int:
+        """Store all emails of the iterable.
+        
+        Args:
+            emails: Messages as produced by GmailClient, e.g. fetch_and_process_messages
+            
+        Returns:
+            Number of emails stored
+        """
+        self.errors = 0
+        self.stats = [StageStats("fetch"), StageStats("process"), StageStats("store")]
+        self._stop.clear()
+        fetched = queue.Queue(maxsize=self.queue_size)
+        prepared = queue.Queue(maxsize=self.queue_size)
+        
+        threads = [
+            threading.Thread(target=self._fetch_stage, args=(emails, fetched), name="ingest-fetch", daemon=True),
+            threading.Thread(target=self._process_stage, args=(fetched, prepared), name="ingest-process", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            return self._store_stage(prepared)
+        finally:
+            # Lets the other stages give up if the store stage stopped early
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            for stats in self.stats:
+                print(f"Ingest {stats}")
+    
+    def _add_error(self):
+        with self._errors_lock:
+            self.errors += 1
+    
+    def _put(self, target: queue.Queue, item) -> bool:
+        """Put an item on a queue, giving up if the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, source: queue.Queue):
+        """Get an item from a queue, or _DONE if the pipeline is stopping."""
+        while True:
+            try:
+                return source.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _DONE
+    
+    def _fetch_stage(self, emails: Iterable[Dict[str, Any]], output: queue.Queue):
+        stats = self.stats[0]
+        started = time.monotonic()
+        iterator = iter(emails)
+        try:
+            while not self._stop.is_set():
+                busy_from = time.monotonic()
+                try:
+                    email = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    stats.busy_seconds += time.monotonic() - busy_from
+                stats.items += 1
+                if not self._put(output, email):
+                    break
+        except Exception as e:
+            self._add_error()
+            print(f"Error in ingest fetch stage: {e}")
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            stats.elapsed_seconds = time.monotonic() - started
+            self._put(output, _DONE)
+    
+    def _process_stage(self, source: queue.Queue, output: queue.Queue):
+        stats = self.stats[1]
+        started = time.monotonic()
+        pool = get_process_pool(self.cpu_workers)
+        # Submitted emails in arrival order, so emails are stored in the order they were fetched
+        pending = deque()
+        
+        def finish_oldest() -> bool:
+            future, email = pending.popleft()
+            busy_from = time.monotonic()
+            try:
+                result = future.result()
+            except Exception as e:
+                result = None
+                self._add_error()
+                print(f"Error processing email {email['metadata']['uid']}: {e}")
+            stats.busy_seconds += time.monotonic() - busy_from
+            if result is None:
+                return True
+            stats.items += 1
+            return self._put(output, result)
+        
+        try:
+            while True:
+                email = self._get(source)
+                if email is _DONE:
+                    break
+                if pool is not None:
+                    try:
+                        pending.append((pool.submit(prepare_email, email, self.attachment_config), email))
+                    except Exception as e:
+                        # A broken pool is not recoverable; finish this run in the thread
+                        print(f"Warning: Ingest process pool unavailable ({e}), processing emails in a thread")
+                        _discard_process_pool(pool)
+                        pool = None
+                    else:
+                        if len(pending) >= 2 * self.cpu_workers and not finish_oldest():
+                            return
+                        continue
+                busy_from = time.monotonic()
+                try:
+                    result = prepare_email(email, self.attachment_config)
+                except Exception as e:
+                    self._add_error()
+                    print(f"Error processing email {email['metadata']['uid']}: {e}")
+                    continue
+                finally:
+                    stats.busy_seconds += time.monotonic() - busy_from
+                stats.items += 1
+                if not self._put(output, result):
+                    return
+            while pending:
+                if not finish_oldest():
+                    return
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            stats.elapsed_seconds = time.monotonic() - started
+            self._put(output, _DONE)
+    
+    def _store_stage(self, source: queue.Queue) -> int:
+        stats = self.stats[2]
+        started = time.monotonic()
+        batch = []
+        try:
+            while True:
+                # Write what has arrived as soon as the stage would otherwise wait,
+                # so batches fill up only while storing is the bottleneck
+                try:
+                    item = source.get_nowait() if batch else self._get(source)
+                except queue.Empty:
+                    self._write_batch(batch)
+                    batch = []
+                    continue
+                if item is _DONE:
+                    break
+                batch.append(item)
+                if len(batch) >= self.write_batch_size:
+                    self._write_batch(batch)
+                    batch = []
+            self._write_batch(batch)
+            return stats.items
+        finally:
+            stats.elapsed_seconds = time.monotonic() - started
+    
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        stats = self.stats[2]
+        busy_from = time.monotonic()
+        for email in batch:
+            print(f"Saving email: {email['subject']} from folder: {email['folder']}")
+        email_ids = self.storage.save_emails(batch)
+        stats.busy_seconds += time.monotonic() - busy_from
+        stored = sum(1 for email_id in email_ids if email_id is not None)
+        stats.items += stored
+        for _ in range(len(email_ids) - stored):
+            self._add_error()
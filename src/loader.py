@@ -2,17 +2,21 @@
 Email Database Loader module for loading emails into a database.
 """
 
-import base64
-import os
-from io import BytesIO
-from email.utils import parsedate_to_datetime
-from typing import Any, Dict, List, Optional
-from PIL import Image, ImageDraw, ImageFont
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from .database import  Email
 from .config import Config, get_config
-from .database.storage import EmailStorage
+from .database.storage import EmailStorage, folder_from_labels
 from .email_client import GmailClient
+from .ingest import (
+    EmailIngestPipeline,
+    create_icon_thumbnail,
+    create_thumbnail,
+    get_file_type,
+    prepare_attachment,
+    prepare_email,
+    should_save_attachment,
+)
 
 
 class EmailDatabaseLoader:
@@ -31,7 +35,12 @@ class EmailDatabaseLoader:
     
     def init_client(self):
         """Initialize the Gmail client."""
-        self.client = GmailClient()
+        self.client = GmailClient(
+            batch_size=self.config.gmail.batch_size,
+            batches_in_flight=self.config.gmail.batches_in_flight,
+            attachment_filter=self._should_save_attachment,
+            lazy_attachments=self.config.attachments.lazy_download
+        )
         self.client.authenticate()
     
     def _is_image(self, mime_type: Optional[str]) -> bool:
@@ -48,331 +57,53 @@ class EmailDatabaseLoader:
         return mime_type.lower().startswith("image/")
     
     def _get_file_type(self, mime_type: Optional[str], filename: Optional[str] = None) -> str:
-        """Determine file type from MIME type and/or filename.
-        
-        Args:
-            mime_type: The MIME type
-            filename: Optional filename
-            
-        Returns:
-            File type: 'image', 'pdf', 'text', 'video', 'audio', or 'unknown'
-        """
-        if not mime_type:
-            mime_type = ""
-        mime_lower = mime_type.lower()
-        
-        if mime_lower.startswith("image/"):
-            return "image"
-        elif mime_lower == "application/pdf":
-            return "pdf"
-        elif mime_lower.startswith("text/"):
-            return "text"
-        elif mime_lower.startswith("video/"):
-            return "video"
-        elif mime_lower.startswith("audio/"):
-            return "audio"
-        elif filename:
-            # Check file extension as fallback
-            _, ext = os.path.splitext(filename)
-            ext = ext.lstrip(".").lower()
-            if ext == "pdf":
-                return "pdf"
-            elif ext in ["txt", "md", "csv", "json", "xml", "html", "css", "js"]:
-                return "text"
-            elif ext in ["mp4", "avi", "mov", "wmv", "flv", "webm", "mkv"]:
-                return "video"
-            elif ext in ["mp3", "wav", "ogg", "flac", "aac", "m4a"]:
-                return "audio"
-        
-        return "unknown"
+        """Determine file type from MIME type and/or filename (see ingest.get_file_type)."""
+        return get_file_type(mime_type, filename)
     
     def _create_icon_thumbnail(self, file_type: str, max_size: int = 100) -> bytes:
-        """Create an icon-based thumbnail for non-image file types.
-        
-        Args:
-            file_type: Type of file ('pdf', 'text', 'video', 'audio', 'unknown')
-            max_size: Size of thumbnail (default: 100)
-            
-        Returns:
-            Binary thumbnail data as JPEG
-        """
-        # Define colors and labels for each file type
-        type_configs = {
-            "pdf": {"color": (220, 38, 38), "label": "PDF"},  # Red
-            "text": {"color": (34, 139, 34), "label": "TEXT"},  # Green
-            "video": {"color": (75, 0, 130), "label": "VIDEO"},  # Purple
-            "audio": {"color": (255, 140, 0), "label": "AUDIO"},  # Orange
-            "unknown": {"color": (128, 128, 128), "label": "FILE"},  # Gray
-        }
-        
-        config = type_configs.get(file_type, type_configs["unknown"])
-        bg_color = config["color"]
-        label = config["label"]
-        
-        # Create image with white background
-        img = Image.new("RGB", (max_size, max_size), (255, 255, 255))
-        draw = ImageDraw.Draw(img)
-        
-        # Draw colored rectangle (slightly inset)
-        margin = 10
-        draw.rectangle(
-            [margin, margin, max_size - margin, max_size - margin],
-            fill=bg_color,
-            outline=(200, 200, 200),
-            width=2
-        )
-        
-        # Try to use a default font, fallback to basic if not available
-        font_size = max_size // 4
-        font = None
-        
-        # Try common font paths
-        font_paths = [
-            "arial.ttf",
-            "Arial.ttf",
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-            "/System/Library/Fonts/Helvetica.ttc",
-            "C:/Windows/Fonts/arial.ttf",
-        ]
-        
-        for font_path in font_paths:
-            try:
-                font = ImageFont.truetype(font_path, font_size)
-                break
-            except:
-                continue
-        
-        # Fallback to default font if no truetype font found
-        if font is None:
-            font = ImageFont.load_default()
-        
-        # Calculate text position (centered)
-        bbox = draw.textbbox((0, 0), label, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        text_x = (max_size - text_width) // 2
-        text_y = (max_size - text_height) // 2
-        
-        # Draw text in white
-        draw.text((text_x, text_y), label, fill=(255, 255, 255), font=font)
-        
-        # Save to bytes as JPEG
-        thumbnail_bytes = BytesIO()
-        img.save(thumbnail_bytes, format="JPEG", quality=85)
-        thumbnail_bytes.seek(0)
-        
-        return thumbnail_bytes.getvalue()
+        """Create an icon-based thumbnail for non-image file types (see ingest.create_icon_thumbnail)."""
+        return create_icon_thumbnail(file_type, max_size)
     
     def _create_thumbnail(self, image_data: bytes, max_size: int = 100) -> Optional[bytes]:
-        """Create a thumbnail from image data.
-        
-        Args:
-            image_data: Binary image data
-            max_size: Maximum width/height for thumbnail (default: 100)
-            
-        Returns:
-            Binary thumbnail data as JPEG, or None if creation fails
-        """
-        try:
-            # Open image from bytes
-            img = Image.open(BytesIO(image_data))
-            
-            # Convert to RGB if necessary (handles RGBA, P, etc.)
-            if img.mode in ("RGBA", "LA", "P"):
-                # Create a white background
-                background = Image.new("RGB", img.size, (255, 255, 255))
-                if img.mode == "P":
-                    img = img.convert("RGBA")
-                background.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
-                img = background
-            elif img.mode != "RGB":
-                img = img.convert("RGB")
-            
-            # Calculate thumbnail size maintaining aspect ratio
-            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-            
-            # Save to bytes as JPEG
-            thumbnail_bytes = BytesIO()
-            img.save(thumbnail_bytes, format="JPEG", quality=85)
-            thumbnail_bytes.seek(0)
-            
-            return thumbnail_bytes.getvalue()
-        except Exception as e:
-            print(f"Warning: Could not create thumbnail: {e}")
-            return None
+        """Create a thumbnail from image data (see ingest.create_thumbnail)."""
+        return create_thumbnail(image_data, max_size)
     
     def _should_save_attachment(self, attachment: Dict[str, Any]) -> bool:
-        """Check if an attachment should be saved based on configuration.
-        
-        Args:
-            attachment: Dictionary containing attachment data with keys:
-                - filename: Optional filename
-                - mimeType: Optional MIME type
-                - size: Optional size in bytes
-        
-        Returns:
-            True if attachment should be saved, False otherwise
-        """
-        attachment_config = self.config.attachments
-        
-        # If no filtering is configured, save all attachments
-        if attachment_config.allowed_types is None and attachment_config.min_size == 0:
-            return True
-        
-        # Check size first (most efficient check)
-        size = attachment.get("size", 0)
-        if size < attachment_config.min_size:
-            return False
-        
-        # If no type restrictions, only size matters
-        if attachment_config.allowed_types is None:
-            return True
-        
-        # Check MIME type
-        mime_type = attachment.get("mimeType", "").lower()
-        if mime_type and mime_type in attachment_config.allowed_types:
-            return True
-        
-        # Check file extension
-        filename = attachment.get("filename", "")
-        if filename:
-            # Get extension without the dot
-            _, ext = os.path.splitext(filename)
-            ext = ext.lstrip(".").lower()
-            if ext and ext in attachment_config.allowed_types:
-                return True
-        
-        # Attachment doesn't match any allowed type
-        return False
+        """Check if an attachment should be saved based on configuration (see ingest.should_save_attachment)."""
+        return should_save_attachment(attachment, self.config.attachments)
     
     def process_email(self, email):
         """Process an email. Saves the retrieved email to the database."""
+        values = prepare_email(email, self.config.attachments)
+        print(f"Saving email: {values['subject']} from folder: {values['folder']}")
+        return self.storage.save_email(**values)
 
-        uid = email["metadata"]["uid"]
-        # Convert labels list to comma-separated string
-        labels = email["metadata"]["labels"]
-        folder = ",".join(labels) if isinstance(labels, list) else str(labels)
-        subject = email["metadata"]["subject"]
-        snippet = email["snippet"]
-        from_address = email["metadata"]["from"]
-        to_addresses = email["metadata"]["to"]
-        cc_addresses = email["metadata"]["cc"]
-        bcc_addresses = email["metadata"]["bcc"]
-        
-        # Parse date string to datetime object
-        date_str = email["metadata"]["date"]
-        date = None
-        if date_str:
-            try:
-                date = parsedate_to_datetime(date_str)
-            except (ValueError, TypeError) as e:
-                print(f"Warning: Could not parse date '{date_str}': {e}")
-                date = None
+    def check_email_exists_callback(self, msg_ids: List[str], label_name: str) -> Set[str]:
+        """Callback function to find which listed emails already exist in the database.
         
-        raw_message = email["body"]["html"]
-        plain_text = email["body"]["text"]
-        
-        # Filter and process attachments - decode base64url data to bytes
-        attachments = email.get("attachments", [])
-        processed_attachments = []
-        filtered_count = 0
-        for att in attachments:
-            # Check if attachment should be saved based on configuration
-            if not self._should_save_attachment(att):
-                filtered_count += 1
-                continue
-            
-            processed_att = att.copy()
-            # Decode base64url encoded data to bytes
-            if "data" in processed_att and processed_att["data"]:
-                try:
-                    # Base64url decode
-                    data_str = processed_att["data"]
-                    # Add padding if needed
-                    padding = len(data_str) % 4
-                    if padding:
-                        data_str += "=" * (4 - padding)
-                    processed_att["data"] = base64.urlsafe_b64decode(data_str)
-                    
-                    # Create thumbnail for all attachment types
-                    mime_type = processed_att.get("mimeType", "")
-                    filename = processed_att.get("filename", "")
-                    file_type = self._get_file_type(mime_type, filename)
-                    
-                    if file_type == "image" and processed_att["data"]:
-                        # Create image thumbnail from actual image data
-                        thumbnail = self._create_thumbnail(processed_att["data"])
-                        if thumbnail:
-                            processed_att["thumbnail"] = thumbnail
-                    else:
-                        # Create icon-based thumbnail for non-image files
-                        thumbnail = self._create_icon_thumbnail(file_type)
-                        processed_att["thumbnail"] = thumbnail
-                except Exception as e:
-                    print(f"Warning: Could not decode attachment data: {e}")
-                    processed_att["data"] = None
-            else:
-                # Even if no data, create thumbnail based on file type
-                mime_type = processed_att.get("mimeType", "")
-                filename = processed_att.get("filename", "")
-                file_type = self._get_file_type(mime_type, filename)
-                if file_type != "image":
-                    thumbnail = self._create_icon_thumbnail(file_type)
-                    processed_att["thumbnail"] = thumbnail
-            processed_attachments.append(processed_att)
-        
-        if filtered_count > 0:
-            print(f"Filtered out {filtered_count} attachment(s) based on configuration")
-        
-        print(f"Saving email: {subject} from folder: {folder}")
-        return self.storage.save_email(uid, folder, subject, snippet, from_address, to_addresses, cc_addresses, bcc_addresses, date, raw_message, plain_text, processed_attachments)
-
-    def check_email_exists_callback(self, msg_id: str, label_name: str) -> bool:
-        """Callback function to check if an email already exists in the database.
-        
-        This function checks the database by uid (Gmail message ID) and folder (label)
-        to determine if an email has already been processed and saved.
+        Called once per listing page. Checks the database by uid (Gmail message ID) and
+        folder (label) with one query for the whole page.
         
         Args:
-            msg_id: Gmail message ID (used as uid in database)
+            msg_ids: Gmail message IDs on the page (used as uid in database)
             label_name: Current label being processed (checked against folder field)
             
         Returns:
-            True if email exists in database with this uid and label (should be skipped), False otherwise
+            Set of the IDs that exist in database with this label (should be skipped)
         """
-        # The uid in the database is the Gmail message ID
-        # The folder field stores comma-separated labels
-        # Check if an email exists with this uid where the folder contains the label_name
-        session = self.storage.db.get_session()
-        print(f"Checking if email exists with uid: {msg_id} and label: {label_name}", end='')
-        try:
-            from .database import Email
-            from sqlalchemy import and_, or_
-            
-            # Check if email exists with this uid AND folder containing the label
-            # Handle comma-separated labels: exact match, at start, in middle, or at end
-            count = session.query(Email).filter(
-                and_(
-                    Email.uid == msg_id,
-                    or_(
-                        Email.folder == label_name,  # Exact match
-                        Email.folder.like(f"{label_name},%"),  # Label at start
-                        Email.folder.like(f"%,{label_name},%"),  # Label in middle
-                        Email.folder.like(f"%,{label_name}")  # Label at end
-                    )
-                )
-            ).count()
-            print(f"...Found: {count} email(s)")
-            return count > 0
-        finally:
-            session.close()
+        return self.storage.get_existing_uids_with_label(msg_ids, label_name)
     
     def load_emails(self, label: str, new_only: bool = False) -> int:
         """Load emails from a specific label into the database.
         
+        With new_only, a label that was synced before is brought up to date from the
+        Gmail history since its last sync, so only changed messages are fetched. A full
+        listing is used the first time and when Gmail no longer has that history.
+        
         Args:
             label: The Gmail label to process (e.g., "INBOX")
-            new_only: If True, only load new emails (uses database check callback)
+            new_only: If True, only load new emails (incremental sync, or a full listing
+                      that skips emails already in the database)
             
         Returns:
             Number of emails processed
@@ -380,18 +111,152 @@ class EmailDatabaseLoader:
         if not hasattr(self, 'client') or self.client is None:
             self.init_client()
         
-        count = 0
+        if new_only:
+            history_id = self.storage.get_sync_history_id(label)
+            if history_id:
+                count = self._sync_label_changes(label, history_id)
+                if count is not None:
+                    return count
+                print(f"Falling back to a full listing of label {label}")
+        
+        # Taken before listing, so changes made while listing are picked up by the next sync
+        start_history_id = self._get_history_id()
+        
         # Use database check callback when new_only is True
         check_callback = self.check_email_exists_callback if new_only else None
         email_generator = self.client.fetch_and_process_messages(
             [label], 
-            self.process_email, 
+            None,
             new_only=new_only,
             check_history_callback=check_callback
         )
-        for email in email_generator:
-            count += 1
+        count, errors = self._store_emails(email_generator)
+        
+        # Only a complete listing is a safe starting point for incremental syncs
+        if start_history_id and errors == 0:
+            self.storage.set_sync_history_id(label, start_history_id)
         
         return count
 
+    def _store_emails(self, emails: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+        """Store fetched emails through the ingest pipeline.
+        
+        Args:
+            emails: Generator from GmailClient.fetch_and_process_messages
+            
+        Returns:
+            Tuple of (emails stored, emails that could not be fetched, processed or stored)
+        """
+        ingest_config = self.config.ingest
+        pipeline = EmailIngestPipeline(
+            self.storage,
+            self.config.attachments,
+            cpu_workers=ingest_config.cpu_workers,
+            queue_size=ingest_config.queue_size,
+            write_batch_size=ingest_config.write_batch_size
+        )
+        count = pipeline.run(emails)
+        # fetch_errors is final once the pipeline has drained the generator
+        return count, self.client.fetch_errors + pipeline.errors
+
+    def download_pending_attachments(self, batch_size: int = 100) -> int:
+        """Download the attachment bodies left out by lazy attachment downloads.
         
+        Attachments are fetched batch_size at a time and stored as media items of their
+        email. A failed download is retried on a later call, up to three attempts.
+        
+        Returns:
+            Number of attachments stored
+        """
+        if not hasattr(self, 'client') or self.client is None:
+            self.init_client()
+        
+        stored = 0
+        after_id = 0
+        while True:
+            pending = self.storage.get_pending_attachments(batch_size, after_id=after_id)
+            if not pending:
+                break
+            after_id = pending[-1]["id"]
+            
+            bodies = self.client.fetch_attachments([(row["uid"], row["gmail_attachment_id"]) for row in pending])
+            for row in pending:
+                data = bodies.get((row["uid"], row["gmail_attachment_id"]))
+                if not data:
+                    self.storage.record_attachment_download_failure(row["id"], "Download failed")
+                    continue
+                attachment = prepare_attachment({
+                    "filename": row["filename"],
+                    "mimeType": row["mime_type"],
+                    "size": row["size"],
+                    "data": data,
+                })
+                if attachment["data"] is None:
+                    self.storage.record_attachment_download_failure(row["id"], "Could not decode attachment data")
+                    continue
+                try:
+                    self.storage.save_downloaded_attachment(row, attachment)
+                    stored += 1
+                except Exception as e:
+                    print(f"Error storing attachment {row['filename']} of email {row['uid']}: {e}")
+                    self.storage.record_attachment_download_failure(row["id"], str(e))
+            print(f"Downloaded {stored} pending attachment(s) so far")
+        
+        return stored
+
+    def _get_history_id(self) -> Optional[str]:
+        """Get the mailbox's current Gmail history ID, or None if it is unavailable."""
+        try:
+            return self.client.get_history_id()
+        except Exception as e:
+            print(f"Warning: Could not get Gmail history ID: {e}")
+            return None
+
+    def _sync_label_changes(self, label: str, history_id: str) -> Optional[int]:
+        """Apply the changes to a label since the given Gmail history ID.
+        
+        New messages are fetched and saved; emails already stored whose labels changed
+        get their folder updated without refetching. Messages deleted in Gmail are kept.
+        
+        Returns:
+            Number of emails saved or updated, or None if the history is no longer
+            available and a full listing is needed
+        """
+        changes = self.client.list_history_changes(label, history_id)
+        if changes is None:
+            return None
+        
+        changed = changes["changed"]
+        labels = self.client.fetch_message_labels(changed) if changed else {}
+        stored_folders = self.storage.get_email_folders(changed)
+        
+        # Messages not stored yet that are (still) in the label are fetched in full
+        new_ids = [
+            message_id for message_id in changed
+            if message_id not in stored_folders and label in labels.get(message_id, [])
+        ]
+        # Stored messages only need their folder (comma-separated labels) brought up to date
+        relabelled = {
+            message_id: folder_from_labels(labels[message_id]) for message_id in changed
+            if message_id in stored_folders and message_id in labels
+        }
+        updated = self.storage.update_email_folders(relabelled)
+        
+        count, errors = 0, 0
+        if new_ids:
+            email_generator = self.client.fetch_and_process_messages(
+                [label],
+                None,
+                message_ids=new_ids
+            )
+            count, errors = self._store_emails(email_generator)
+        
+        if changes["deleted"]:
+            print(f"{len(changes['deleted'])} message(s) were deleted from label {label} in Gmail; stored copies are kept")
+        print(f"Incremental sync of label {label}: {count} new, {updated} relabelled")
+        
+        # On errors keep the old history ID so the failed messages are retried next time
+        if errors == 0:
+            self.storage.set_sync_history_id(label, changes["history_id"])
+        
+        return count + updated
@@ -6,7 +6,7 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, Optional, Callable
 
-from ..database.connection import Database
+from ..database.connection import Database, get_database
 from ..database.storage import FacebookAlbumStorage
 from .export_root_detector import detect_facebook_export_root
 
@@ -276,7 +276,7 @@ def import_facebook_albums_from_directory(
 def main():
     """Main function for testing the import."""
     # Initialize database connection and create tables
-    db = Database()
+    db = get_database()
     db.create_tables()
     
     # Test directory path - update this to your actual directory
@@ -11,8 +11,9 @@ from sqlalchemy import func
 
 from src.database import IMessage
 
-from ..database.connection import Database
+from ..database.connection import Database, get_database
 from ..database.storage import IMessageStorage
+from .message_batch import MessageBatchWriter
 from .export_root_detector import detect_facebook_export_root
 
 
@@ -349,7 +350,8 @@ def import_facebook_from_directory(
     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
     cancelled_check: Optional[Callable[[], bool]] = None,
     export_root: Optional[str] = None,
-    user_name: Optional[str] = None
+    user_name: Optional[str] = None,
+    batch_size: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     Import Facebook Messenger messages from a directory structure.
@@ -365,6 +367,8 @@ def import_facebook_from_directory(
                         Should return True if cancelled.
         export_root: Optional path to Facebook export root directory (for resolving attachment URIs)
         user_name: Optional user's name to determine incoming/outgoing messages
+        batch_size: Optional number of messages written per transaction
+                    (defaults to IMPORT_MESSAGE_BATCH_SIZE)
         
     Returns:
         dict: Statistics about the import process
@@ -399,6 +403,7 @@ def import_facebook_from_directory(
         "attachments_missing": 0,
         "missing_attachment_filenames": [],
     }
+    writer = MessageBatchWriter(storage, stats, batch_size=batch_size)
     
     # Iterate through subdirectories
     for subdir in directory.iterdir():
@@ -507,8 +512,8 @@ def import_facebook_from_directory(
                                 "attachment_type": attachment_type,
                             }
                             
-                            # Save main message to database
-                            _, is_update = storage.save_imessage(
+                            # Queue main message for the next batched database write
+                            writer.add(
                                 message_data,
                                 attachment_data=attachment_data,
                                 attachment_filename=attachment_filename,
@@ -516,13 +521,6 @@ def import_facebook_from_directory(
                                 source="Facebook"
                             )
                             
-                            if is_update:
-                                stats["messages_updated"] += 1
-                            else:
-                                stats["messages_created"] += 1
-                            
-                            stats["messages_imported"] += 1
-                            
                             # Create separate database entries for each additional attachment
                             for idx, additional_att in enumerate(additional_attachments, start=1):
                                 # Track attachment statistics
@@ -548,21 +546,14 @@ def import_facebook_from_directory(
                                     "attachment_type": additional_att.get('type'),
                                 }
                                 
-                                # Save additional attachment as separate message entry
-                                _, is_update_att = storage.save_imessage(
+                                # Queue additional attachment as separate message entry
+                                writer.add(
                                     additional_message_data, 
                                     attachment_data=additional_att.get('data'),
                                     attachment_filename=additional_att.get('filename'),
                                     attachment_type=additional_att.get('type'),
                                     source="Facebook"
                                 )
-                                
-                                if is_update_att:
-                                    stats["messages_updated"] += 1
-                                else:
-                                    stats["messages_created"] += 1
-                                
-                                stats["messages_imported"] += 1
                             
                         except Exception as e:
                             print(f"Error processing message: {e}")
@@ -582,6 +573,10 @@ def import_facebook_from_directory(
         if progress_callback:
             progress_callback(stats.copy())
 
+    writer.flush()
+    if progress_callback:
+        progress_callback(stats.copy())
+
     detect_group_chat()
     
     return stats
@@ -589,7 +584,7 @@ def import_facebook_from_directory(
 def detect_group_chat():
     """Detect if a chat is a group chat based on the participants."""
     try:
-        db = Database()
+        db = get_database()
         session = db.get_session()
 
         try:
@@ -633,7 +628,7 @@ def detect_group_chat():
 def main():
     """Main function for testing the import."""
     # Initialize database connection and create tables
-    db = Database()
+    db = get_database()
     db.create_tables()
     
     # Test directory path - update this to your actual directory
@@ -9,8 +9,9 @@ from typing import Dict, Any, Optional, Callable
 
 from src.services.subject_configuration_service import SubjectConfigurationService
 
-from ..database.connection import Database
+from ..database.connection import Database, get_database
 from ..database.storage import IMessageStorage
+from .message_batch import MessageBatchWriter
 
 
 def parse_date(date_str: Optional[str]) -> Optional[datetime]:
@@ -27,7 +28,8 @@ def parse_date(date_str: Optional[str]) -> Optional[datetime]:
 def import_imessages_from_directory(
     directory_path: str,
     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
-    cancelled_check: Optional[Callable[[], bool]] = None
+    cancelled_check: Optional[Callable[[], bool]] = None,
+    batch_size: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     Import iMessages from a directory structure.
@@ -41,6 +43,8 @@ def import_imessages_from_directory(
                           Receives a dict with current stats including missing_attachment_filenames.
         cancelled_check: Optional function to check if import should be cancelled.
                         Should return True if cancelled.
+        batch_size: Optional number of messages written per transaction
+                    (defaults to IMPORT_MESSAGE_BATCH_SIZE)
         
     Returns:
         dict: Statistics about the import process
@@ -49,7 +53,7 @@ def import_imessages_from_directory(
     if not directory.exists() or not directory.is_dir():
         raise ValueError(f"Directory does not exist or is not a directory: {directory_path}")
     
-    config_service = SubjectConfigurationService(db=Database())
+    config_service = SubjectConfigurationService(db=get_database())
     configuration = config_service.get_configuration()
 
     subject_name = configuration.subject_name if configuration else None
@@ -72,6 +76,7 @@ def import_imessages_from_directory(
         "attachments_missing": 0,
         "missing_attachment_filenames": [],
     }
+    writer = MessageBatchWriter(storage, stats, batch_size=batch_size)
     
     # Iterate through subdirectories
     for subdir in directory.iterdir():
@@ -219,18 +224,13 @@ def import_imessages_from_directory(
                                 # print(f"Error processing sender name: {e}")
                                 
                             
-                            # Save to database
-                            _, is_update = storage.save_imessage(
+                            # Queue for the next batched database write
+                            writer.add(
                                 message_data, 
                                 attachment_data=attachment_data,
                                 attachment_filename=attachment_filename,
                                 attachment_type=attachment_type
                             )
-                            if is_update:
-                                stats["messages_updated"] += 1
-                            else:
-                                stats["messages_created"] += 1
-                            stats["messages_imported"] += 1
                             
                         except Exception as e:
                             print(f"Error processing message row: {e}")
@@ -246,13 +246,17 @@ def import_imessages_from_directory(
         if progress_callback:
             progress_callback(stats.copy())
     
+    writer.flush()
+    if progress_callback:
+        progress_callback(stats.copy())
+    
     return stats
 
 
 def main():
     """Main function for testing the import."""
     # Initialize database connection and create tables
-    db = Database()
+    db = get_database()
     db.create_tables()
     
     # Test directory path - update this to your actual directory
@@ -7,8 +7,9 @@ from pathlib import Path
 import re
 from typing import Dict, Any, Optional, Callable
 
-from ..database.connection import Database
+from ..database.connection import Database, get_database
 from ..database.storage import IMessageStorage
+from .message_batch import MessageBatchWriter
 from .export_root_detector import detect_instagram_export_root
 
 
@@ -52,7 +53,8 @@ def import_instagram_from_directory(
     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
     cancelled_check: Optional[Callable[[], bool]] = None,
     export_root: Optional[str] = None,
-    user_name: Optional[str] = None
+    user_name: Optional[str] = None,
+    batch_size: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     Import Instagram messages from a directory structure.
@@ -68,6 +70,8 @@ def import_instagram_from_directory(
                         Should return True if cancelled.
         export_root: Optional path to Instagram export root directory (for consistency, not used for attachments)
         user_name: Optional user's name to determine incoming/outgoing messages
+        batch_size: Optional number of messages written per transaction
+                    (defaults to IMPORT_MESSAGE_BATCH_SIZE)
         
     Returns:
         dict: Statistics about the import process
@@ -99,6 +103,7 @@ def import_instagram_from_directory(
         "messages_created": 0,
         "errors": 0,
     }
+    writer = MessageBatchWriter(storage, stats, batch_size=batch_size)
     
     # Iterate through subdirectories
     for subdir in directory.iterdir():
@@ -247,31 +252,17 @@ def import_instagram_from_directory(
                                         print(f"Warning: Could not read photo file {photo_path}: {e}")
                                         continue
                                     
-                                    # Save message with photo attachment
-                                    _, is_update = storage.save_imessage(
+                                    # Queue message with photo attachment
+                                    writer.add(
                                         message_data,
                                         attachment_data=attachment_data,
                                         attachment_filename=attachment_filename,
                                         attachment_type=attachment_type,
                                         source="Instagram"
                                     )
-                                    
-                                    if is_update:
-                                        stats["messages_updated"] += 1
-                                    else:
-                                        stats["messages_created"] += 1
-                                    
-                                    stats["messages_imported"] += 1
                             else:
-                                # Save message without attachment
-                                _, is_update = storage.save_imessage(message_data, source="Instagram")
-                                
-                                if is_update:
-                                    stats["messages_updated"] += 1
-                                else:
-                                    stats["messages_created"] += 1
-                                
-                                stats["messages_imported"] += 1
+                                # Queue message without attachment
+                                writer.add(message_data, source="Instagram")
                             
                         except Exception as e:
                             print(f"Error processing message: {e}")
@@ -291,13 +282,17 @@ def import_instagram_from_directory(
         if progress_callback:
             progress_callback(stats.copy())
     
+    writer.flush()
+    if progress_callback:
+        progress_callback(stats.copy())
+    
     return stats
 
 
 def main():
     """Main function for testing the import."""
     # Initialize database connection and create tables
-    db = Database()
+    db = get_database()
     db.create_tables()
     
     # Test directory path - update this to your actual directory
@@ -0,0 +1,102 @@
+"""Batched message writes shared by the message importers."""
+
+from typing import Dict, Any, Optional, List
+
+from ..config import get_config
+from ..database.storage import IMessageStorage
+
+
+class MessageBatchWriter:
+    """Buffer parsed messages and write them with IMessageStorage.save_imessages_bulk.
+
+    Import statistics (messages_created, messages_updated, messages_imported, errors)
+    are updated on the shared stats dict when each batch is written. If a batch
+    fails as a whole, its messages are retried one at a time, so a single bad row
+    only counts as one error.
+    """
+
+    def __init__(
+        self,
+        storage: IMessageStorage,
+        stats: Dict[str, Any],
+        batch_size: Optional[int] = None,
+        max_batch_bytes: Optional[int] = None,
+    ):
+        """Initialize the writer.
+
+        Args:
+            storage: Storage used to write messages
+            stats: Import statistics dict to update as batches are written
+            batch_size: Messages per transaction (defaults to IMPORT_MESSAGE_BATCH_SIZE)
+            max_batch_bytes: Flush early once buffered attachment data reaches this size
+                             (defaults to IMPORT_MESSAGE_BATCH_MAX_BYTES)
+        """
+        if batch_size is None or max_batch_bytes is None:
+            import_config = get_config().imports
+            if batch_size is None:
+                batch_size = import_config.message_batch_size
+            if max_batch_bytes is None:
+                max_batch_bytes = import_config.message_batch_max_bytes
+        self.storage = storage
+        self.stats = stats
+        self.batch_size = max(1, batch_size)
+        self.max_batch_bytes = max_batch_bytes
+        self._batch: List[Dict[str, Any]] = []
+        self._batch_bytes = 0
+
+    def add(
+        self,
+        message_data: Dict[str, Any],
+        attachment_data: Optional[bytes] = None,
+        attachment_filename: Optional[str] = None,
+        attachment_type: Optional[str] = None,
+        source: Optional[str] = None,
+    ) -> None:
+        """Queue a message for saving. Takes the same arguments as IMessageStorage.save_imessage."""
+        self._batch.append({
+            "message_data": message_data,
+            "attachment_data": attachment_data,
+            "attachment_filename": attachment_filename,
+            "attachment_type": attachment_type,
+            "source": source,
+        })
+        if attachment_data is not None:
+            self._batch_bytes += len(attachment_data)
+
+        if len(self._batch) >= self.batch_size or self._batch_bytes >= self.max_batch_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write any buffered messages."""
+        if not self._batch:
+            return
+
+        batch = self._batch
+        self._batch = []
+        self._batch_bytes = 0
+
+        try:
+            results = self.storage.save_imessages_bulk(batch)
+        except Exception as e:
+            print(f"Error saving batch of {len(batch)} messages, retrying individually: {e}")
+            results = []
+            for item in batch:
+                try:
+                    message_id, is_update = self.storage.save_imessage(
+                        item["message_data"],
+                        attachment_data=item["attachment_data"],
+                        attachment_filename=item["attachment_filename"],
+                        attachment_type=item["attachment_type"],
+                        source=item["source"],
+                    )
+                    results.append((message_id, is_update))
+                except Exception as row_error:
+                    print(f"Error processing message row: {row_error}")
+                    self.stats["errors"] += 1
+
+        for _, is_update in results:
+            if is_update:
+                self.stats["messages_updated"] += 1
+            else:
+                self.stats["messages_created"] += 1
+            self.stats["messages_imported"] += 1
@@ -10,8 +10,9 @@ from typing import Dict, Any, Optional, Callable
 from src.database import IMessage
 from src.services.subject_configuration_service import SubjectConfigurationService
 
-from ..database.connection import Database
+from ..database.connection import Database, get_database
 from ..database.storage import IMessageStorage
+from .message_batch import MessageBatchWriter
 
 
 def parse_date(date_str: Optional[str]) -> Optional[datetime]:
@@ -67,7 +68,8 @@ def find_attachment_file(base_dir: Path, filename: str) -> Optional[Path]:
 def import_whatsapp_from_directory(
     directory_path: str,
     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
-    cancelled_check: Optional[Callable[[], bool]] = None
+    cancelled_check: Optional[Callable[[], bool]] = None,
+    batch_size: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     Import WhatsApp messages from a directory structure.
@@ -81,6 +83,8 @@ def import_whatsapp_from_directory(
                           Receives a dict with current stats including missing_attachment_filenames.
         cancelled_check: Optional function to check if import should be cancelled.
                         Should return True if cancelled.
+        batch_size: Optional number of messages written per transaction
+                    (defaults to IMPORT_MESSAGE_BATCH_SIZE)
         
     Returns:
         dict: Statistics about the import process
@@ -105,6 +109,7 @@ def import_whatsapp_from_directory(
         "attachments_missing": 0,
         "missing_attachment_filenames": [],
     }
+    writer = MessageBatchWriter(storage, stats, batch_size=batch_size)
     
     # Iterate through subdirectories
     for subdir in directory.iterdir():
@@ -123,7 +128,7 @@ def import_whatsapp_from_directory(
         # Find CSV files in the subdirectory
         csv_files = list(subdir.glob("*.csv"))
 
-        config_service = SubjectConfigurationService(db=Database())
+        config_service = SubjectConfigurationService(db=get_database())
         configuration = config_service.get_configuration()
 
         subject_name = configuration.subject_name if configuration else None
@@ -243,8 +248,8 @@ def import_whatsapp_from_directory(
                                 print(f"Skipping message from {message_data['chat_session']}")
                                 continue;
                             
-                            # Save message to database
-                            imessage, is_update = storage.save_imessage(
+                            # Queue for the next batched database write
+                            writer.add(
                                 message_data, 
                                 attachment_data=attachment_data,
                                 attachment_filename=attachment_filename,
@@ -252,15 +257,6 @@ def import_whatsapp_from_directory(
                                 source="WhatsApp"
                             )
                             
-                            if is_update:
-                                stats["messages_updated"] += 1
-                            else:
-                                stats["messages_created"] += 1
-                            
-                            stats["messages_imported"] += 1
-
-                            
-                            
                         except Exception as e:
                             print(f"Error processing message row: {e}")
                             stats["errors"] += 1
@@ -275,6 +271,10 @@ def import_whatsapp_from_directory(
         if progress_callback:
             progress_callback(stats.copy())
     
+    writer.flush()
+    if progress_callback:
+        progress_callback(stats.copy())
+    
     print("Setting is_group_chat flag")
     set_is_group_chat()
     
@@ -284,7 +284,7 @@ def set_is_group_chat() -> Dict[str, Any]:
         """Set the is_notification flag for the message data."""
         #for each distinct chat_session, checi his any message is a notification and if so, set the is_notification flag to True for all messages in that chat_session
         try:
-            db = Database()
+            db = get_database()
             session = db.get_session()
             distinct_chat_sessions = session.query(IMessage.chat_session).distinct().filter(IMessage.service == 'WhatsApp').all()
             for chat_session_tuple in distinct_chat_sessions:
@@ -306,7 +306,7 @@ def set_is_group_chat() -> Dict[str, Any]:
 def main():
     """Main function for testing the import."""
     # Initialize database connection and create tables
-    db = Database()
+    db = get_database()
     db.create_tables()
 
     #empty the messages table and the media_items table and the message_attachments table and the media_blob table
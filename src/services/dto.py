@@ -50,10 +50,15 @@ class BulkDeleteResult:
 
 @dataclass
 class ImageContent:
-    """Image content with metadata."""
-    content: bytes
+    """Image content with metadata.
+
+    When the content lives in a filesystem blob store, file_path is set instead of
+    content so that it can be served without reading it into memory.
+    """
+    content: Optional[bytes]
     content_type: str
     filename: str
+    file_path: Optional[str] = None
 
 
 @dataclass
@@ -4,8 +4,9 @@ from typing import List, Callable, Optional, Dict, Any
 import threading
 
 from ..loader import EmailDatabaseLoader
-from ..database import Database
+from ..database import Database, get_database
 from ..database.models import Email
+from ..database.bodycodec import decode_body
 from sqlalchemy import or_
 from .exceptions import ConflictError, ValidationError, NotFoundError
 
@@ -135,11 +136,21 @@ class EmailService:
             NotFoundError: If no emails found for the participant
         """
         if db is None:
-            db = Database()
+            db = get_database()
         
         session = db.get_session()
         try:
-            emails = session.query(Email).filter(
+            # Only the columns the transcript needs; raw_message and embedding stay in the database
+            emails = session.query(
+                Email.date,
+                Email.from_address,
+                Email.to_addresses,
+                Email.plain_text,
+                Email.plain_text_compressed,
+                Email.body_codec,
+                Email.snippet,
+                Email.has_attachments
+            ).filter(
                 or_(
                     Email.from_address.like(f"%{participant_email}%"),
                     Email.to_addresses.like(f"%{participant_email}%")
@@ -163,7 +174,7 @@ class EmailService:
                     "message_date": email.date.isoformat() if email.date else None,
                     "sender_name": email.from_address or "Unknown",
                     "type": "Incoming" if email.to_addresses and participant_email in (email.to_addresses or "") else "Outgoing",
-                    "text": email.plain_text or email.snippet or "",
+                    "text": decode_body(session, email.body_codec, email.plain_text, email.plain_text_compressed) or email.snippet or "",
                     "has_attachment": email.has_attachments or False
                 })
             
@@ -11,6 +11,8 @@ import google.genai as genai
 from google.genai import types
 from ..database import Database
 from ..database.models import ReferenceDocument, IMessage, Email, GeminiFile, ChatConversation, ChatTurn
+from ..database.blobstore import read_blob
+from ..database.bodycodec import decode_body
 from sqlalchemy import or_
 
 
@@ -446,7 +448,7 @@ class ChatService:
                 # Save BytesIO to a temporary file for upload (new SDK requires file path)
                 import tempfile
                 with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{doc.filename}") as tmp_file:
-                    tmp_file.write(doc.data)
+                    tmp_file.write(read_blob(doc.data, doc.data_key))
                     tmp_file_path = tmp_file.name
                 
                 try:
@@ -785,7 +787,19 @@ class ChatService:
         
         session = self.db.get_session()
         try:
-            emails = session.query(Email).filter(
+            # Only the columns the summary needs; raw_message and embedding stay in the database
+            emails = session.query(
+                Email.id,
+                Email.date,
+                Email.from_address,
+                Email.to_addresses,
+                Email.subject,
+                Email.plain_text,
+                Email.plain_text_compressed,
+                Email.body_codec,
+                Email.snippet,
+                Email.has_attachments
+            ).filter(
                 or_(
                     Email.from_address.like(f"%{name}%"),
                     Email.to_addresses.like(f"%{name}%")
@@ -803,7 +817,7 @@ class ChatService:
                     "from_address": email.from_address or "",
                     "to_addresses": email.to_addresses or "",
                     "subject": email.subject or "",
-                    "plain_text": email.plain_text or email.snippet or "",
+                    "plain_text": decode_body(session, email.body_codec, email.plain_text, email.plain_text_compressed) or email.snippet or "",
                     "has_attachments": email.has_attachments or False
                 })
             
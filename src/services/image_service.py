@@ -4,10 +4,10 @@ import json
 import os
 import shutil
 import platform
-from io import BytesIO
 import subprocess
 import tempfile
-from typing import List, Optional, Dict, Any
+import threading
+from typing import List, Optional, Dict, Any, Callable
 from datetime import datetime
 from PIL import Image
 
@@ -15,9 +15,13 @@ from sqlalchemy import and_
 from sqlalchemy.orm import Session
 
 from ..database import Database
-from ..database.models import MediaMetadata, MediaBlob, FacebookAlbum, Attachment, Email, AlbumMedia
-from ..database.storage import ImageStorage
+from ..database.models import NO_RENDITIONS_SIZE, MediaMetadata, MediaBlob, FacebookAlbum, Attachment, Email, AlbumMedia
+from ..database.blobstore import blob_file_path
+from ..database.conversioncache import get_conversion_cache
+from ..database.storage import ImageStorage, get_media_blob_content
 from .exceptions import NotFoundError, ValidationError
+from .process_images_service import ProcessImagesService
+from ..imaging import convert_to_jpeg, select_rendition_size
 #from ..imageimport.filesystemimport import create_thumbnail
 from .dto import (
     ImageSearchFilters,
@@ -36,6 +40,16 @@ except ImportError:
     HEIF_SUPPORT = False
 
 
+HEIC_MEDIA_TYPES = ("image/heic", "image/heif")
+
+
+def _jpeg_filename(filename: Optional[str]) -> str:
+    """Get the file name of an image's JPEG conversion."""
+    if filename and filename.lower().endswith(('.heic', '.heif')):
+        return os.path.splitext(filename)[0] + '.jpg'
+    return "image.jpg"
+
+
 class ImageService:
     """Service for image-related business logic."""
 
@@ -262,7 +276,8 @@ class ImageService:
         image_id: int,
         id_type: str = "blob",
         preview: bool = False,
-        convert_heic: bool = True
+        convert_heic: bool = True,
+        size: Optional[int] = None
     ) -> ImageContent:
         """Get image content by ID.
         
@@ -271,6 +286,8 @@ class ImageService:
             id_type: Type of ID - 'blob' for image_blob.id or 'metadata' for image_information.id
             preview: If True, return thumbnail instead of full image
             convert_heic: If True, convert HEIC images to JPG format
+            size: If set, return the nearest display rendition instead of the full image
+                  (the full image when no rendition can be made)
             
         Returns:
             ImageContent with content, content_type, and filename
@@ -278,29 +295,30 @@ class ImageService:
         Raises:
             NotFoundError: If image not found or has no content
         """
-        # Get image blob based on type
-        if id_type == "metadata":
-            image_blob = self.storage.get_image_by_metadata_id(image_id)
-        else:
-            image_blob = self.storage.get_image_by_blob_id(image_id)
-        
-        if not image_blob:
-            raise NotFoundError(f"Image with ID {image_id} (type: {id_type}) not found")
-        
+        if size and not preview:
+            image = self.storage.get_image_blob(image_id, id_type)
+            if image is not None and image.media_blob_id is not None:
+                # Named like the full image: the file name of its path, or its title
+                filename = (image.source_reference.split(os.sep)[-1] if image.source_reference else None) or image.title or "image"
+                rendition = self.get_rendition(image.media_blob_id, size, filename)
+                if rendition is not None:
+                    return rendition
+
         # Determine content
         if preview:
-            content = image_blob.thumbnail_data
+            # Select only the thumbnail bytes so previews never read the full image
+            if id_type == "metadata":
+                content = self.storage.get_thumbnail_by_metadata_id(image_id)
+            else:
+                content = self.storage.get_thumbnail_by_blob_id(image_id)
+            file_path = None
             if content is None:
-                raise NotFoundError(f"Image with ID {image_id} has no thumbnail available")
+                raise NotFoundError(f"Image with ID {image_id} (type: {id_type}) not found or has no thumbnail available")
             content_type = "image/jpeg"  # Thumbnails are always JPEG
             filename = "image_thumb.jpg"
             
         else:
-            content = image_blob.image_data
-            if content is None:
-                raise NotFoundError(f"Image with ID {image_id} has no image data")
-            
-            # Get content type from metadata
+            # Look up the media type, file name and blob without reading the content
             session = self.db.get_session()
             try:
                 if id_type == "metadata":
@@ -308,11 +326,16 @@ class ImageService:
                     metadata = session.query(MediaMetadata).filter(
                         MediaMetadata.id == image_id
                     ).first()
+                    blob_id = metadata.media_blob_id if metadata else None
                 else:
                     # Query metadata by blob_id
                     metadata = session.query(MediaMetadata).filter(
-                        MediaMetadata.media_blob_id == image_blob.id
+                        MediaMetadata.media_blob_id == image_id
                     ).first()
+                    blob_id = image_id
+                blob = session.query(MediaBlob.id, MediaBlob.content_hash).filter(
+                    MediaBlob.id == blob_id
+                ).first() if blob_id is not None else None
                 
                 if metadata and metadata.media_type:
                     content_type = metadata.media_type
@@ -322,44 +345,169 @@ class ImageService:
             finally:
                 session.close()
             
+            if blob is None:
+                raise NotFoundError(f"Image with ID {image_id} (type: {id_type}) not found")
+            
+            convert = convert_heic and content_type and content_type.lower() in HEIC_MEDIA_TYPES
+            conversion_cache = get_conversion_cache()
+            if convert and blob.content_hash:
+                # Serve an earlier conversion straight from the disk cache
+                cached_path = conversion_cache.get_path(blob.id, blob.content_hash)
+                if cached_path:
+                    return ImageContent(
+                        content=None,
+                        content_type="image/jpeg",
+                        filename=_jpeg_filename(filename),
+                        file_path=cached_path
+                    )
+            
+            image_blob = self.storage.get_image_by_blob_id(blob.id)
+            if not image_blob:
+                raise NotFoundError(f"Image with ID {image_id} (type: {id_type}) not found")
+            
+            content = image_blob.image_data
+            file_path = blob_file_path(image_blob.image_key) if content is None else None
+            if content is None and file_path is None:
+                raise NotFoundError(f"Image with ID {image_id} has no image data")
+            
             # Convert HEIC to JPG if requested
-            if convert_heic and content_type and content_type.lower() in ('image/heic', 'image/heif'):
-                try:
-                    # Open the HEIC image
-                    img = Image.open(BytesIO(content))
-                    
-                    # Convert to RGB if necessary
-                    if img.mode in ("RGBA", "LA", "P"):
-                        background = Image.new("RGB", img.size, (255, 255, 255))
-                        if img.mode == "P":
-                            img = img.convert("RGBA")
-                        background.paste(img, mask=img.split()[-1] if img.mode in ("RGBA", "LA") else None)
-                        img = background
-                    elif img.mode != "RGB":
-                        img = img.convert("RGB")
-                    
-                    # Convert to JPEG bytes
-                    jpg_bytes = BytesIO()
-                    img.save(jpg_bytes, format="JPEG", quality=95)
-                    jpg_bytes.seek(0)
-                    content = jpg_bytes.getvalue()
-                    
-                    # Update content type and filename
+            if convert:
+                if content is None:
+                    content = get_media_blob_content(image_blob)
+                jpg_bytes = convert_to_jpeg(content)
+                if jpg_bytes is not None:
+                    content = jpg_bytes
+                    file_path = None
                     content_type = "image/jpeg"
-                    if filename and filename.lower().endswith(('.heic', '.heif')):
-                        filename = os.path.splitext(filename)[0] + '.jpg'
-                    else:
-                        filename = "image.jpg"
-                except Exception:
-                    # If conversion fails, return original image
-                    pass  # Fall through to return original content
+                    filename = _jpeg_filename(filename)
+                    if image_blob.content_hash:
+                        try:
+                            conversion_cache.put(image_blob.id, image_blob.content_hash, jpg_bytes)
+                        except OSError as e:
+                            print(f"Warning: Could not cache JPEG conversion of blob {image_blob.id}: {e}")
+                # If conversion fails, return original image
         
         return ImageContent(
-            content=content,
+            content=content if file_path is None else None,
             content_type=content_type,
-            filename=filename
+            filename=filename,
+            file_path=file_path
         )
 
+    def get_rendition(self, blob_id: int, size: int, filename: str = "image") -> Optional[ImageContent]:
+        """Get the stored rendition of a blob nearest to size, making them on first use.
+        
+        All sizes are made from one decode of the original and stored, so later
+        requests for any size never read the original.
+        
+        Args:
+            blob_id: The ID of the MediaBlob
+            size: Requested long edge in pixels
+            filename: Name the rendition's filename is derived from
+            
+        Returns:
+            ImageContent of the rendition, or None if the blob has no content or its
+            image cannot be resized (animated or undecodable images, which are
+            marked the first time so that they are only decoded once)
+        """
+        sizes = self.storage.get_rendition_sizes(blob_id)
+        if NO_RENDITIONS_SIZE in sizes:
+            return None
+        chosen = select_rendition_size(sizes, size)
+        rendition = self.storage.get_rendition(blob_id, chosen) if chosen is not None else None
+        if rendition is not None:
+            content_type, content = rendition
+        else:
+            content = get_media_blob_content(self.storage.get_image_by_blob_id(blob_id))
+            if content is None:
+                return None
+            renditions = ProcessImagesService().create_renditions(content)
+            self.storage.save_renditions(blob_id, renditions)
+            if not renditions:
+                return None
+            chosen = select_rendition_size([rendition[0] for rendition in renditions], size)
+            _, content_type, _, _, content = next(rendition for rendition in renditions if rendition[0] == chosen)
+
+        base_name = os.path.splitext(filename)[0] or "image"
+        extension = "webp" if content_type == "image/webp" else "jpg"
+        return ImageContent(content=content, content_type=content_type, filename=f"{base_name}_{chosen}.{extension}")
+
+    def warm_conversion_cache(
+        self,
+        progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        cancelled: Optional[threading.Event] = None
+    ) -> Dict[str, Any]:
+        """Convert stored HEIC/HEIF images to JPEG ahead of time, into the conversion cache.
+        
+        Blobs are read in ID order and converted a batch at a time on the process
+        pool; blobs already cached are skipped. The run stops early once it has
+        written as much as the cache can hold, as further entries would only evict
+        the ones just written.
+        
+        Args:
+            progress_callback: Optional function called with the running stats after each batch
+            cancelled: Optional event that stops the run between batches
+            
+        Returns:
+            Dictionary with images_found, images_cached, images_skipped, errors,
+            bytes_written, images_per_second and stopped_at_budget
+        """
+        conversion_cache = get_conversion_cache()
+        if not conversion_cache.enabled:
+            raise ValidationError("The conversion cache is disabled (CONVERSION_CACHE_MAX_BYTES=0)")
+        
+        process_images_service = ProcessImagesService()
+        stats = {
+            "images_found": 0,
+            "images_cached": 0,
+            "images_skipped": 0,
+            "errors": 0,
+            "bytes_written": 0,
+            "images_per_second": 0.0,
+            "stopped_at_budget": False,
+        }
+        last_id = 0
+        while not (cancelled and cancelled.is_set()):
+            blobs = self.storage.get_blobs_by_media_type(
+                list(HEIC_MEDIA_TYPES), after_id=last_id, limit=process_images_service.batch_size
+            )
+            if not blobs:
+                break
+            last_id = blobs[-1].id
+            stats["images_found"] += len(blobs)
+            
+            pending = [blob for blob in blobs if not conversion_cache.contains(blob.id, blob.content_hash)]
+            stats["images_skipped"] += len(blobs) - len(pending)
+            images = []
+            for blob in pending:
+                try:
+                    images.append(get_media_blob_content(self.storage.get_image_by_blob_id(blob.id)))
+                except OSError as e:
+                    print(f"Error reading media blob {blob.id}: {e}")
+                    images.append(None)
+            
+            for blob, jpg_bytes in zip(pending, process_images_service.convert_to_jpeg_batch(images)):
+                if jpg_bytes is None:
+                    stats["errors"] += 1
+                    continue
+                try:
+                    if conversion_cache.put(blob.id, blob.content_hash, jpg_bytes):
+                        stats["images_cached"] += 1
+                        stats["bytes_written"] += len(jpg_bytes)
+                except OSError as e:
+                    print(f"Error caching JPEG conversion of blob {blob.id}: {e}")
+                    stats["errors"] += 1
+            
+            stats["images_per_second"] = round(process_images_service.images_per_second(), 1)
+            if progress_callback:
+                progress_callback(stats.copy())
+            if stats["bytes_written"] >= conversion_cache.max_bytes:
+                print("Conversion cache budget reached; stopping warm-up")
+                stats["stopped_at_budget"] = True
+                break
+        
+        return stats
+
     def find_and_process_images_with_magick(self):
         """Find and process images with ImageMagick."""
         # Find MediaMetadata where processed=False and media_type starts with "image/"
@@ -372,20 +520,24 @@ class ImageService:
         if not images_metadata:
             raise NotFoundError(f"Images with IDs  not found")
 
-        for image_metadata in images_metadata:
+        process_images_service = ProcessImagesService()
+        batch_size = process_images_service.batch_size
+        for start in range(0, len(images_metadata), batch_size):
+            batch = images_metadata[start:start + batch_size]
+            images = []
+            for image_metadata in batch:
+                image = self.storage.get_image_by_metadata_id(image_metadata.id)
+                if not image:
+                    raise NotFoundError(f"Image with ID {image_metadata.id} not found")
+                images.append(get_media_blob_content(image))
 
-            image = self.storage.get_image_by_metadata_id(image_metadata.id)
-            if not image:
-                raise NotFoundError(f"Image with ID {image_metadata.id} not found")
-            print(f"Processing image {image_metadata.id}. Description: {image_metadata.description} with Magick")
-            try:
-                thumbnail_data = ImageService.create_thumbnail_from_bytes(image.image_data)
-            except Exception as e:
-                print(f"Error processing image {image_metadata.id}. Description: {image_metadata.description} with Magick: {e}")
-                continue
-            print(f"Done Processing image {image_metadata.id}. Description: {image_metadata.description} with Magick")
-            image.thumbnail_data = thumbnail_data
-            self.storage.update_image_thumbnail(image_id=image.id, thumbnail_data=thumbnail_data)
+            results = process_images_service.create_thumbs_and_get_exif(images, process_thumbnail=True, process_exif=False, width=200)
+            for image_metadata, (thumbnail_data, _) in zip(batch, results):
+                if not thumbnail_data:
+                    print(f"Error processing image {image_metadata.id}. Description: {image_metadata.description}")
+                    continue
+                self.storage.update_image_thumbnail(image_id=image_metadata.id, thumbnail_data=thumbnail_data)
+            print(f"Processed {start + len(batch)}/{len(images_metadata)} images: {process_images_service.throughput}")
 
     @staticmethod
     def to_response_model(image: MediaMetadata) -> dict:
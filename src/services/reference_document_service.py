@@ -5,6 +5,7 @@ from typing import Optional
 from fastapi import UploadFile
 
 from ..database import Database
+from ..database.blobstore import get_blob_store
 from ..database.models import ReferenceDocument
 from .exceptions import ValidationError, NotFoundError
 from .dto import FileValidationResult, FileData, DocumentMetadata, DocumentUpdate
@@ -87,6 +88,9 @@ class ReferenceDocumentService:
         Returns:
             Created ReferenceDocument instance
         """
+        # With an external blob store only the key is kept in the row
+        data_key = get_blob_store().put(file_data.content)
+        
         session = self.db.get_session()
         try:
             document = ReferenceDocument(
@@ -96,7 +100,8 @@ class ReferenceDocumentService:
                 author=metadata.author,
                 content_type=file_data.content_type,
                 size=file_data.size,
-                data=file_data.content,
+                data=None if data_key else file_data.content,
+                data_key=data_key,
                 tags=metadata.tags,
                 categories=metadata.categories,
                 notes=metadata.notes,